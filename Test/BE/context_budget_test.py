@@ -0,0 +1,69 @@
+import os
+os.environ.setdefault("OPENAI_API_KEY", "test-key")  # prompts builds its OpenAI clients at import
+
+from context_budget import count_tokens, truncate_tokens, fit_sections, context_window, prompt_budget
+import prompts
+import flow
+
+
+def test_sections_share_the_budget():
+    sections = [
+        {"name": "instructions", "text": "Be brief. " * 10},                             # fixed: never cut
+        {"name": "memories", "items": [f"memory {i} " + "x" * 400 for i in range(10)], "share": 1, "mode": "drop"},
+        {"name": "prompt", "text": "question " * 50, "share": 1},
+    ]
+    fitted, cuts = fit_sections(sections, 10_000)
+    assert cuts == [] and fitted["memories"] == sections[1]["items"]
+
+    fitted, cuts = fit_sections(sections, 600)
+    assert fitted["instructions"] == sections[0]["text"]
+    assert fitted["prompt"] == sections[2]["text"], "❌ Small section cut while a larger one had room to give"
+    assert [cut["section"] for cut in cuts] == ["memories"] and cuts[0]["dropped_items"] > 0
+    assert fitted["memories"][0].startswith("memory 0"), "❌ Most relevant memory dropped"
+    used = sum(count_tokens(fitted[name]) for name in ("instructions", "prompt")) + sum(count_tokens(m) + 1 for m in fitted["memories"])
+    assert used <= 600
+    print("✅ per-section budgets")
+
+
+def test_even_mode_keeps_every_entry():
+    items = ["short entry", "long " * 2000, "another long " * 1000]
+    fitted, cuts = fit_sections([{"name": "log", "items": items, "share": 1, "mode": "even"}], 800)
+    assert len(fitted["log"]) == 3 and fitted["log"][0] == "short entry"
+    assert "tokens cut]" in fitted["log"][1] and fitted["log"][1].startswith("long")
+    assert sum(count_tokens(item) + 1 for item in fitted["log"]) <= 800
+    assert cuts[0]["dropped_items"] == 0
+    print("✅ even log trimming")
+
+
+def test_truncate_and_windows():
+    text = "alpha " * 500
+    assert truncate_tokens(text, 10_000) is text
+    assert count_tokens(truncate_tokens(text, 50, keep="middle")) <= 50
+    assert truncate_tokens("head and tail " * 100, 20, keep="tail").endswith("tail ")
+    assert context_window("gpt-4o-mini") == 128000 and context_window("gpt-4") == 8192
+    assert context_window("unknown-model") > 0 and context_window("gpt-4", {"context_window": 2048}) == 2048
+    print("✅ truncation + context windows")
+
+
+def test_hat_prompt_and_debrief_fit_the_window():
+    hat = {"name": "Tiny", "model": "gpt-4", "instructions": "Answer.", "context_window": 1800}
+    messages, cuts = prompts.build_hat_messages("please help " * 2000, hat, ["Bot (t): " + "old note " * 300] * 3)
+    budget = prompt_budget("gpt-4", hat)
+    assert sum(count_tokens(m["content"]) for m in messages) <= budget + 10
+    assert "named 'Tiny'" in messages[0]["content"] and "Instructions: Answer." in messages[0]["content"], "❌ Instructions were cut"
+    assert {cut["section"] for cut in cuts} >= {"prompt"}
+
+    analyst = {**flow.MISSION_ANALYST_HAT, "context_window": 3000}
+    log = [{"hat_name": f"Hat {i}", "input": "critic prompt " * 2000, "output": f"result {i} " * 400} for i in range(6)]
+    prompt, cuts = flow.build_debrief_prompt("🎖️ Mission Status: SUCCESS", log, analyst)
+    assert count_tokens(prompt) <= prompt_budget(analyst["model"], analyst)
+    assert all(f"Hat {i}" in prompt for i in range(6)), "❌ A hat vanished from the debrief log"
+    assert [cut["section"] for cut in cuts] == ["log"]
+    print("✅ hat prompt + debrief budgets")
+
+
+if __name__ == "__main__":
+    test_sections_share_the_budget()
+    test_even_mode_keeps_every_entry()
+    test_truncate_and_windows()
+    test_hat_prompt_and_debrief_fit_the_window()
@@ -0,0 +1,60 @@
+from embedding_cache import EmbeddingCache, CachedEmbeddingFunction
+import os
+import tempfile
+
+
+class CountingEmbedding:
+    """Fake embedding model that records every text it is asked to embed."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, input):
+        self.calls.append(list(input))
+        return [[float(len(text)), float(sum(map(ord, text)) % 97)] for text in input]
+
+
+def test_each_text_is_embedded_once():
+    with tempfile.TemporaryDirectory() as tmp:
+        base = CountingEmbedding()
+        embed = CachedEmbeddingFunction(base, EmbeddingCache(os.path.join(tmp, "cache.db")), model="counting")
+
+        first = embed(["hello", "world", "hello"])
+        assert base.calls == [["hello", "world"]], "❌ Duplicate text embedded twice in one call"
+        second = embed(["world", "again"])
+        assert base.calls[-1] == ["again"]
+        assert list(second[0]) == list(first[1])
+        assert (embed.hits, embed.misses) == (2, 3)
+
+        # A fresh process (new cache object on the same file) still hits
+        restarted = CachedEmbeddingFunction(base, EmbeddingCache(os.path.join(tmp, "cache.db")), model="counting")
+        restarted(["hello"])
+        assert len(base.calls) == 2, "❌ Persistent cache missed"
+
+        # A different model never shares vectors
+        CachedEmbeddingFunction(base, EmbeddingCache(os.path.join(tmp, "cache.db")), model="other")(["hello"])
+        assert base.calls[-1] == ["hello"]
+        print("✅ embedding cache hits")
+
+
+def test_least_recently_used_rows_are_evicted():
+    with tempfile.TemporaryDirectory() as tmp:
+        base = CountingEmbedding()
+        cache = EmbeddingCache(os.path.join(tmp, "cache.db"), max_entries=10, memory_entries=0)
+        embed = CachedEmbeddingFunction(base, cache, model="counting")
+
+        embed([f"text {i}" for i in range(10)])
+        embed(["text 0"])  # Touch the oldest entry so it survives eviction
+        embed(["overflow"])
+        assert len(cache) <= 10
+        base.calls.clear()
+        embed(["text 0"])
+        assert base.calls == [], "❌ Recently used entry was evicted"
+        embed(["text 1"])
+        assert base.calls == [["text 1"]], "❌ Least recently used entry was kept"
+        print("✅ embedding cache eviction")
+
+
+if __name__ == "__main__":
+    test_each_text_is_embedded_once()
+    test_least_recently_used_rows_are_evicted()
@@ -0,0 +1,140 @@
+import os
+os.environ.setdefault("OPENAI_API_KEY", "test-key")  # prompts builds its OpenAI clients at import
+
+import asyncio
+from types import SimpleNamespace
+from unittest import mock
+
+import flow
+from flow import build_flow_stages, merge_stage_outputs
+
+
+def test_build_flow_stages():
+    hats = [
+        {"hat_id": "planner", "flow_order": 1},
+        {"hat_id": "writer_b", "flow_order": 2},
+        {"hat_id": "critic_x", "flow_order": 2, "role": "critic"},
+        {"hat_id": "writer_a", "flow_order": 2},
+        {"hat_id": "final_critic", "flow_order": 3, "role": "critic"},
+    ]
+    stages = [[hat["hat_id"] for hat in stage] for stage in build_flow_stages(hats)]
+    assert stages == [["planner"], ["writer_a", "writer_b"], ["critic_x"], ["final_critic"]]
+    assert build_flow_stages([]) == []
+    print("✅ flow stages")
+
+
+def test_merge_stage_outputs():
+    assert merge_stage_outputs([({"name": "Solo"}, "only answer")]) == "only answer"
+    merged = merge_stage_outputs([({"name": "A"}, "first"), ({"hat_id": "b"}, "second")])
+    assert merged == "## A\nfirst\n\n## b\nsecond"
+    print("✅ stage output merge")
+
+
+class FakeMessage:
+    removed = []
+
+    def __init__(self, content=""):
+        self.content = content
+
+    async def stream_token(self, token):
+        self.content += token
+
+    async def send(self):
+        return self
+
+    async def remove(self):
+        FakeMessage.removed.append(self.content)
+
+
+def fake_chainlit(session):
+    return SimpleNamespace(
+        Message=FakeMessage,
+        user_session=SimpleNamespace(get=session.get, set=session.__setitem__),
+        make_async=lambda fn: lambda *args: asyncio.sleep(0, fn(*args)),
+    )
+
+
+def test_stage_is_recorded_before_qa_critic_pauses():
+    session = {}
+    memories = []
+    team = [
+        {"hat_id": "writer_a", "name": "A", "flow_order": 1, "qa_loop": True, "critics": ["qa"]},
+        {"hat_id": "writer_b", "name": "B", "flow_order": 1},
+    ]
+
+    async def run_stage(stage, stage_input, memory_scope=None):
+        return {hat["hat_id"]: f"{hat['hat_id']} draft" for hat in stage}
+
+    async def respond(prompt, hat, **kwargs):
+        return "#APPROVED"
+
+    with mock.patch.multiple(
+        flow, cl=fake_chainlit(session), list_hats_by_team=lambda team_id: team, run_flow_stage=run_stage,
+        generate_openai_response=respond, load_hat=lambda hat_id: {"hat_id": hat_id},
+        add_memory_to_hat=lambda hat_id, text, **kwargs: memories.append((hat_id, text)),
+    ):
+        asyncio.run(flow.run_team_flow("t1", "Write a plan"))
+
+    assert [entry["hat_id"] for entry in session["pending_conversation_log"]] == ["writer_a", "writer_b"], \
+        "❌ Sibling missing from the log when the QA critic paused the flow"
+    assert ("writer_b", "writer_b draft") in memories, "❌ Sibling response not remembered"
+    assert session["pending_critique_input"] == "## A\nwriter_a draft\n\n## B\nwriter_b draft"
+    print("✅ stage recorded before QA")
+
+
+def test_failed_debrief_stream_is_removed():
+    FakeMessage.removed = []
+
+    async def respond(prompt, hat, stream_to=None, **kwargs):
+        await stream_to.stream_token("Half a debr")
+        raise RuntimeError("stream dropped")
+
+    async def no_reflections(team_hats, **kwargs):
+        return []
+
+    log = [{"hat_name": "A", "hat_id": "a", "input": "goal", "output": "draft"}]
+    with mock.patch.multiple(
+        flow, cl=fake_chainlit({}), list_hats_by_team=lambda team_id: [], generate_openai_response=respond,
+        generate_reflections=no_reflections, archive_mission=lambda record: "mission.json",
+    ):
+        asyncio.run(flow.finalize_team_flow(log, True, False, "goal", "t1"))
+    assert len(FakeMessage.removed) == 1 and FakeMessage.removed[0].endswith("Half a debr"), "❌ Partial debrief left in the chat"
+    print("✅ failed debrief removed")
+
+
+def test_only_broken_streams_are_retried():
+    FakeMessage.removed = []
+    calls = []
+
+    async def respond(prompt, hat, stream_to=None, **kwargs):
+        calls.append(hat["hat_id"])
+        if hat["hat_id"] == "bad_request":
+            raise ValueError("invalid prompt")
+        if len(calls) == 1:
+            await stream_to.stream_token("Half")
+            raise ConnectionError("stream dropped")
+        return "full reply"
+
+    async def no_sleep(seconds):
+        pass
+
+    with mock.patch.multiple(flow, cl=fake_chainlit({}), generate_openai_response=respond), \
+            mock.patch.object(flow.asyncio, "sleep", no_sleep):
+        assert asyncio.run(flow.generate_with_retries("go", {"hat_id": "flaky"}, attempts=3)) == "full reply"
+        assert calls == ["flaky", "flaky"] and len(FakeMessage.removed) == 1
+        calls.clear()
+        try:
+            asyncio.run(flow.generate_with_retries("go", {"hat_id": "bad_request"}, attempts=3))
+            assert False, "❌ Error swallowed"
+        except ValueError:
+            pass
+        assert calls == ["bad_request"], "❌ Non-retryable error was retried"
+    print("✅ only broken streams retried")
+
+
+if __name__ == "__main__":
+    test_build_flow_stages()
+    test_merge_stage_outputs()
+    test_stage_is_recorded_before_qa_critic_pauses()
+    test_failed_debrief_stream_is_removed()
+    test_only_broken_streams_are_retried()
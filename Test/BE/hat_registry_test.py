@@ -0,0 +1,143 @@
+import hat_manager
+from hat_manager import HatRegistry, normalize_hat, compile_system_prompt, compile_system_prompt_parts
+from hat_store import SQLiteHatStore
+import json
+import os
+import tempfile
+from unittest import mock
+
+
+def _write(hat_dir, hat):
+    with open(os.path.join(hat_dir, f"{hat['hat_id']}.json"), "w", encoding="utf-8") as f:
+        json.dump(hat, f)
+
+
+def test_indexes_and_views():
+    with tempfile.TemporaryDirectory() as hat_dir:
+        _write(hat_dir, {"hat_id": "planner", "name": "Planner", "role": "planner"})
+        _write(hat_dir, {"hat_id": "planner_t1", "name": "P", "role": "planner", "team_id": "t1", "base_hat_id": "planner", "flow_order": 2})
+        _write(hat_dir, {"hat_id": "critic_t1", "name": "C", "role": "critic", "team_id": "t1", "base_hat_id": "critic", "flow_order": 1})
+        registry = HatRegistry(hat_dir)
+
+        assert registry.ids() == ["critic_t1", "planner", "planner_t1"]
+        assert [h["hat_id"] for h in registry.by_team("t1")] == ["critic_t1", "planner_t1"]
+        assert [h["hat_id"] for h in registry.by_base_id("planner")] == ["planner", "planner_t1"]
+        assert [h["hat_id"] for h in registry.by_role("critic")] == ["critic_t1"]
+        assert [h["hat_id"] for h in registry.templates()] == ["planner"]
+        assert registry.team_ids() == ["t1"]
+        print("✅ registry indexes")
+
+
+def test_invalidation_and_copies():
+    with tempfile.TemporaryDirectory() as hat_dir:
+        registry = HatRegistry(hat_dir, rescan_interval=0)
+        registry.put("summarizer", {"hat_id": "summarizer", "name": "Summarizer", "team_id": "t2"})
+
+        hat = registry.get("summarizer")
+        hat["tools"].append("mutated")
+        assert registry.get("summarizer")["tools"] == [], "❌ Registry leaked a mutable reference"
+
+        # Edited on disk behind the registry's back
+        _write(hat_dir, {"hat_id": "summarizer", "name": "Edited", "team_id": "t3"})
+        os.utime(os.path.join(hat_dir, "summarizer.json"), ns=(1, 1))
+        assert registry.get("summarizer")["name"] == "Edited"
+        assert registry.by_team("t2") == []
+        assert [h["hat_id"] for h in registry.by_team("t3")] == ["summarizer"]
+
+        registry.delete("summarizer")
+        assert registry.ids() == []
+        try:
+            registry.get("summarizer")
+            assert False, "❌ Deleted hat still loadable"
+        except FileNotFoundError:
+            pass
+        print("✅ registry invalidation")
+
+
+def test_batched_team_write():
+    with tempfile.TemporaryDirectory() as hat_dir:
+        registry = HatRegistry(hat_dir)
+        team = {f"hat{i}_t9": {"hat_id": f"hat{i}_t9", "name": f"Hat {i}", "team_id": "t9", "flow_order": i} for i in range(3)}
+        registry.put_many(team)
+
+        assert sorted(os.listdir(hat_dir)) == [f"hat{i}_t9.json" for i in range(3)], "❌ Temp files left behind"
+        assert [h["hat_id"] for h in registry.by_team("t9")] == list(team)
+        with open(os.path.join(hat_dir, "hat2_t9.json"), encoding="utf-8") as f:
+            assert json.load(f)["name"] == "Hat 2"
+
+        real_replace, renames = os.replace, []
+        def failing_replace(src, dst):
+            if renames:
+                raise OSError("disk full")
+            renames.append(dst)
+            real_replace(src, dst)
+
+        edited = {hat_id: dict(hat, name="Edited") for hat_id, hat in team.items()}
+        with mock.patch("hat_manager.os.replace", failing_replace):
+            try:
+                registry.put_many(edited)
+                assert False, "❌ Rename failure swallowed"
+            except OSError:
+                pass
+        assert sorted(os.listdir(hat_dir)) == [f"hat{i}_t9.json" for i in range(3)], "❌ Temp files leaked after a failed rename"
+        assert [registry.get(hat_id)["name"] for hat_id in team] == ["Edited", "Hat 1", "Hat 2"]
+        print("✅ batched team write")
+
+
+def test_sqlite_store_migration_and_queries():
+    with tempfile.TemporaryDirectory() as tmp:
+        hat_dir = os.path.join(tmp, "hats")
+        os.makedirs(hat_dir)
+        _write(hat_dir, {"hat_id": "planner", "name": "Planner", "role": "planner"})
+        _write(hat_dir, {"hat_id": "planner_t1", "name": "P", "role": "planner", "team_id": "t1", "base_hat_id": "planner", "flow_order": 2})
+        _write(hat_dir, {"hat_id": "critic_t1", "name": "C", "role": "critic", "team_id": "t1", "flow_order": 1})
+        _write(hat_dir, {"hat_id": "idle_t1", "name": "I", "team_id": "t1", "active": False})
+
+        store = SQLiteHatStore(os.path.join(tmp, "hats.db"), normalize=normalize_hat)
+        assert store.import_hat_dir(hat_dir) == 4
+
+        assert [h["hat_id"] for h in store.by_team("t1")] == ["critic_t1", "planner_t1"]
+        assert [h["hat_id"] for h in store.by_base_id("planner")] == ["planner", "planner_t1"]
+        assert [h["hat_id"] for h in store.templates()] == ["planner"]
+        assert store.team_ids() == ["t1"]
+        assert store.get("planner")["model"] == "gpt-3.5-turbo"
+
+        stamps = store.stamps(["critic_t1", "missing"])
+        assert stamps["critic_t1"] and stamps["missing"] is None
+        store.put("critic_t1", {"hat_id": "critic_t1", "name": "C2", "team_id": "t1"})
+        assert store.stamps(["critic_t1"])["critic_t1"] > stamps["critic_t1"]
+
+        store.delete("planner")
+        assert "planner" not in store.ids()
+        store.close()
+        print("✅ sqlite store")
+
+
+def test_compiled_system_prompt_tracks_related_hats():
+    original = hat_manager.hat_registry
+    with tempfile.TemporaryDirectory() as hat_dir:
+        registry = hat_manager.hat_registry = HatRegistry(hat_dir, rescan_interval=0)
+        try:
+            registry.put("helper_p", {"hat_id": "helper_p", "name": "Helper", "description": "finds sources"})
+            hat = {"hat_id": "lead_p", "name": "Lead", "instructions": "Plan", "relationships": ["helper_p", "ghost_p"]}
+
+            first = compile_system_prompt(hat)
+            assert "@helper_p = Helper: finds sources" in first and "@ghost_p: (Details not found)" in first
+            assert compile_system_prompt_parts(dict(hat)) is compile_system_prompt_parts(hat), "❌ Prompt was rebuilt without a change"
+
+            registry.put("helper_p", {"hat_id": "helper_p", "name": "Helper", "description": "checks facts"})
+            assert "checks facts" in compile_system_prompt(hat), "❌ Related hat change not picked up"
+            registry.put("ghost_p", {"hat_id": "ghost_p", "name": "Ghost"})
+            assert "@ghost_p = Ghost" in compile_system_prompt(hat), "❌ New related hat not picked up"
+            assert "Instructions: Review." in compile_system_prompt({**hat, "instructions": "Review"})
+        finally:
+            hat_manager.hat_registry = original
+    print("✅ compiled system prompt cache")
+
+
+if __name__ == "__main__":
+    test_indexes_and_views()
+    test_invalidation_and_copies()
+    test_batched_team_write()
+    test_sqlite_store_migration_and_queries()
+    test_compiled_system_prompt_tracks_related_hats()
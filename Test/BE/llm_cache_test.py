@@ -0,0 +1,92 @@
+import os
+os.environ.setdefault("OPENAI_API_KEY", "test-key")  # prompts builds its OpenAI clients at import
+
+import asyncio
+import tempfile
+import time
+from types import SimpleNamespace
+
+from llm_cache import ResponseCache, cache_key, llm_cache_policy, set_response_cache
+import prompts
+
+MESSAGES = [{"role": "system", "content": "You are terse."}, {"role": "user", "content": "Plan a launch"}]
+ENABLED = {"enabled": True, "ttl": 0, "sampled": False, "bypass": False}
+
+
+def test_keys_and_policies():
+    assert cache_key(ENABLED, "openai", "gpt-4", MESSAGES, 0) == cache_key(ENABLED, "openai", "gpt-4", [dict(m) for m in MESSAGES], 0)
+    assert cache_key(ENABLED, "openai", "gpt-4", MESSAGES, 0) != cache_key(ENABLED, "openai", "gpt-4", MESSAGES, 0, max_tokens=5)
+    assert cache_key(ENABLED, "openai", "gpt-4", MESSAGES, 0.7) is None, "❌ Sampled request cached by default"
+    assert cache_key({**ENABLED, "sampled": True}, "openai", "gpt-4", MESSAGES, 0.7) is not None
+    assert cache_key({**ENABLED, "bypass": True}, "openai", "gpt-4", MESSAGES, 0) is None
+
+    policy = llm_cache_policy({"llm_cache": {"enabled": True, "ttl": 60, "bypass": False}})
+    assert policy["enabled"] and policy["ttl"] == 60.0
+    assert llm_cache_policy({"llm_cache": {"bypass": True}})["bypass"]
+    print("✅ response cache keys and policies")
+
+
+def test_ttl_and_lru_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "llm.db")
+        cache = ResponseCache(path, max_entries=10, memory_entries=2)
+        cache.put("a", "answer a")
+        assert cache.get("a") == "answer a"
+        time.sleep(0.02)
+        assert cache.get("a", ttl=0.01) is None, "❌ Expired response served"
+        assert cache.get("a", ttl=60) == "answer a"
+
+        for i in range(12):
+            cache.put(f"k{i}", f"v{i}")
+        assert len(cache) <= 10
+        assert ResponseCache(path).get("k11") == "v11", "❌ Response not persisted"
+        assert ResponseCache(path).get("k0") is None, "❌ Least recently used row kept"
+        print("✅ response cache TTL + eviction")
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if kwargs.get("stream"):
+            async def chunks():
+                for token in ["Ship ", "it"]:
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+            return chunks()
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="Ship it"))])
+
+
+def test_async_calls_are_replayed_from_cache():
+    completions = FakeCompletions()
+    original_client = prompts.async_client
+    prompts.async_client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    set_response_cache(ResponseCache(":memory:"))
+    try:
+        async def run():
+            tokens = []
+
+            async def on_token(token):
+                tokens.append(token)
+
+            first = await prompts.call_openai_llm_async(MESSAGES, temperature=0, on_token=on_token, cache_policy=ENABLED)
+            replay = await prompts.call_openai_llm_async(MESSAGES, temperature=0, on_token=on_token, cache_policy=ENABLED)
+            assert first == replay == "Ship it" and tokens == ["Ship ", "it", "Ship it"]
+            assert completions.calls == 1, "❌ Identical request sent twice"
+
+            await prompts.call_openai_llm_async(MESSAGES, temperature=0.7, cache_policy=ENABLED)
+            await prompts.call_openai_llm_async(MESSAGES, temperature=0.7, cache_policy=ENABLED)
+            assert completions.calls == 3, "❌ Sampled request served from cache"
+
+        asyncio.run(run())
+    finally:
+        prompts.async_client = original_client
+        set_response_cache(None)
+    print("✅ cached async completions")
+
+
+if __name__ == "__main__":
+    test_keys_and_policies()
+    test_ttl_and_lru_eviction()
+    test_async_calls_are_replayed_from_cache()
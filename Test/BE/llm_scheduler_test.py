@@ -0,0 +1,116 @@
+import os
+os.environ.setdefault("OPENAI_API_KEY", "test-key")  # prompts builds its OpenAI clients at import
+
+import asyncio
+import threading
+import time
+
+from llm_scheduler import LLMScheduler, TokenBucket, parse_rate_limits
+
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_token_buckets_and_rate_limits():
+    bucket = TokenBucket(60, now=0)
+    assert bucket.wait_time(60, 0) == 0
+    bucket.take(60, 0)
+    assert bucket.wait_time(1, 0) == 1.0 and bucket.wait_time(1, 1.0) == 0
+    assert bucket.wait_time(1000, 1.0) == 59.0, "❌ Oversized request must only wait for a full bucket"
+    assert TokenBucket(0).wait_time(10**9, 0) == 0
+
+    assert parse_rate_limits("gpt-4=500/30000, bad, gpt-4o=5000/800000") == {"gpt-4": (500, 30000), "gpt-4o": (5000, 800000)}
+    scheduler = LLMScheduler(rate_limits={"gpt-4": (2, 0), "gpt-4o": (0, 0)})
+    for _ in range(2):
+        scheduler.release(scheduler.acquire("gpt-4-0613", 10), "ok")
+    assert scheduler._limits_for("gpt-4-0613").wait_time(10, time.monotonic()) > 20, "❌ RPM bucket not applied"
+    assert scheduler._limits_for("gpt-4o-mini").wait_time(10, time.monotonic()) == 0, "❌ Longest prefix should win"
+    print("✅ token buckets + per-model limits")
+
+
+def test_interactive_calls_are_admitted_first():
+    scheduler = LLMScheduler(max_concurrency=1)
+    held = scheduler.acquire("m", 1)
+    order = []
+
+    def call(priority):
+        ticket = scheduler.acquire("m", 1, priority)
+        order.append(priority)
+        scheduler.release(ticket)
+
+    background = threading.Thread(target=call, args=("background",))
+    background.start()
+    while scheduler.stats()["queued"] < 1:
+        time.sleep(0.001)
+    interactive = threading.Thread(target=call, args=("interactive",))
+    interactive.start()
+    while scheduler.stats()["queued"] < 2:
+        time.sleep(0.001)
+
+    scheduler.release(held)
+    background.join(2)
+    interactive.join(2)
+    assert order == ["interactive", "background"], f"❌ Admission order {order}"
+    assert scheduler.stats()["in_flight"] == 0
+    print("✅ priority admission")
+
+
+def test_backoff_and_adaptive_concurrency():
+    scheduler = LLMScheduler(max_concurrency=8, backoff_base=0.001, backoff_max=0.01)
+    failures = [FakeAPIError(429), FakeAPIError(503)]
+    calls = []
+
+    async def request():
+        calls.append(1)
+        if failures:
+            raise failures.pop(0)
+        return "done"
+
+    assert asyncio.run(scheduler.run_async(request, "m", 100)) == "done"
+    assert len(calls) == 3 and scheduler.retries == 2
+    assert 2 <= scheduler.limit < 3, f"❌ Limit should halve per throttle then grow: {scheduler.limit}"
+
+    for _ in range(20):
+        scheduler.run(lambda: "ok", "m", 100)
+    assert scheduler.limit > 4, "❌ Limit did not recover after successes"
+
+    async def bad_request():
+        calls.append(1)
+        raise FakeAPIError(400)
+
+    calls.clear()
+    try:
+        asyncio.run(scheduler.run_async(bad_request, "m", 100))
+        assert False, "❌ Client error swallowed"
+    except FakeAPIError:
+        assert len(calls) == 1, "❌ Client errors must not be retried"
+
+    async def broken_stream():
+        raise FakeAPIError(500)
+
+    try:
+        asyncio.run(scheduler.run_async(broken_stream, "m", 100, can_retry=lambda: False))
+        assert False, "❌ Vetoed retry happened"
+    except FakeAPIError:
+        pass
+    assert scheduler.stats()["in_flight"] == 0
+    print("✅ jittered backoff + AIMD concurrency")
+
+
+def test_burst_of_throttles_halves_once():
+    scheduler = LLMScheduler(max_concurrency=8)
+    tickets = [scheduler.acquire("m", 1) for _ in range(8)]
+    for ticket in tickets:
+        scheduler.release(ticket, "throttled")
+    assert scheduler.limit == 4, "❌ Concurrent 429s collapsed the limit"
+    print("✅ one decrease per burst")
+
+
+if __name__ == "__main__":
+    test_token_buckets_and_rate_limits()
+    test_interactive_calls_are_admitted_first()
+    test_backoff_and_adaptive_concurrency()
+    test_burst_of_throttles_halves_once()
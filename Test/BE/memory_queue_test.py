@@ -0,0 +1,63 @@
+from memory_queue import MemoryWriteQueue
+import time
+
+
+class FakeWriter:
+    """Stands in for upsert_memories; records each hat's batches of memory IDs."""
+
+    def __init__(self, fail_times=0):
+        self.writes = {}
+        self.fail_times = fail_times
+
+    def __call__(self, hat_id, entries):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("embedding backend down")
+        self.writes.setdefault(hat_id, []).append([memory_id for memory_id, _, _ in entries])
+
+
+def test_batches_per_hat_on_flush():
+    writer = FakeWriter()
+    queue = MemoryWriteQueue(writer, batch_size=100, flush_interval=60)
+    for i in range(3):
+        queue.put("planner", f"p{i}", f"doc {i}", {"role": "user"})
+    queue.put("critic", "c0", "review", {"role": "bot"})
+    assert queue.pending() == 4 and writer.writes == {}, "❌ put() wrote synchronously"
+
+    queue.flush("planner")
+    assert writer.writes["planner"] == [["p0", "p1", "p2"]], "❌ Expected a single batched write"
+    assert queue.pending("critic") == 1
+    queue.close()
+    assert writer.writes["critic"] == [["c0"]], "❌ close() did not flush"
+    print("✅ batched flush")
+
+
+def test_background_flush_on_size_and_time():
+    writer = FakeWriter()
+    queue = MemoryWriteQueue(writer, batch_size=2, flush_interval=0.2)
+    queue.put("a", "1", "x", {})
+    queue.put("a", "2", "y", {})
+    queue.put("b", "3", "z", {})
+    time.sleep(0.5)
+    assert writer.writes["a"] == [["1", "2"]]
+    assert writer.writes["b"] == [["3"]], "❌ Time-based flush did not run"
+    queue.close()
+    print("✅ background flush")
+
+
+def test_failed_batches_are_retried():
+    writer = FakeWriter(fail_times=1)
+    queue = MemoryWriteQueue(writer, batch_size=100, flush_interval=60)
+    queue.put("a", "1", "x", {})
+    queue.flush()
+    assert queue.pending("a") == 1
+    queue.flush()
+    assert writer.writes["a"] == [["1"]] and queue.pending() == 0
+    queue.close()
+    print("✅ retry on failure")
+
+
+if __name__ == "__main__":
+    test_batches_per_hat_on_flush()
+    test_background_flush_on_size_and_time()
+    test_failed_batches_are_retried()
@@ -0,0 +1,62 @@
+from hat_manager import add_memory_to_hat, flush_memories, get_vector_db_for_hat, set_chroma_client, set_embedding_function, clear_memory
+from memory_retention import enforce_retention
+from memory_test import LocalClient
+import datetime
+
+
+def _policy(**overrides):
+    policy = {"max_entries": 0, "max_age_days": 0, "keep_tags": ["pinned"], "compact": False}
+    policy.update(overrides)
+    return policy
+
+
+def test_cap_compacts_oldest_turns_and_spares_kept_tags():
+    set_chroma_client(LocalClient())
+    try:
+        add_memory_to_hat("hat_retention", "remember the api key location", tags=["pinned"])
+        for i in range(12):
+            add_memory_to_hat("hat_retention", f"turn {i}")
+        flush_memories()
+
+        summarized = []
+        report = enforce_retention(
+            "hat_retention", _policy(max_entries=10, compact=True),
+            summarize=lambda docs: summarized.append(docs) or f"summary of {len(docs)} turns"
+        )
+        assert report["evicted"] == 4 and report["summaries"] == 1
+        assert summarized == [["turn 0", "turn 1", "turn 2", "turn 3"]], "❌ Oldest turns should be compacted first"
+        docs = get_vector_db_for_hat("hat_retention").get()["documents"]
+        assert "remember the api key location" in docs and "summary of 4 turns" in docs
+        assert len(docs) == 10
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ retention cap with compaction")
+
+
+def test_max_age_and_chunked_clear():
+    set_chroma_client(LocalClient())
+    try:
+        add_memory_to_hat("hat_aging", "old news")
+        add_memory_to_hat("hat_aging", "old but pinned", tags=["pinned"])
+        flush_memories()
+        later = datetime.datetime.now() + datetime.timedelta(days=8)
+        assert enforce_retention("hat_aging", _policy(compact=True), now=later)["scanned"] == 0, "❌ Scanned with retention off"
+        report = enforce_retention("hat_aging", _policy(max_age_days=7), now=later)
+        assert report["expired"] == 1
+        assert get_vector_db_for_hat("hat_aging").get()["documents"] == ["old but pinned"]
+
+        for i in range(7):
+            add_memory_to_hat("hat_aging", f"note {i}")
+        flush_memories()
+        clear_memory("hat_aging", chunk_size=3)
+        assert get_vector_db_for_hat("hat_aging").count() == 0
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ retention max age and chunked clear")
+
+
+if __name__ == "__main__":
+    test_cap_compacts_oldest_turns_and_spares_kept_tags()
+    test_max_age_and_chunked_clear()
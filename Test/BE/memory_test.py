@@ -0,0 +1,407 @@
+import hat_manager
+from hat_manager import (
+    get_vector_db_for_hat, set_chroma_client, forget_collection, clear_memory,
+    add_memory_to_hat, search_memory, tag_memory, migrate_memory_metadata, flush_memories, list_memories,
+    set_embedding_function, set_keyword_index, upsert_memories, memory_id_for,
+    set_memory_layout, migrate_memory_layout, memory_hat_ids, search_across_hats, HatRegistry, normalize_hat
+)
+from keyword_index import KeywordIndex
+import chromadb
+from chromadb import EmbeddingFunction
+import hashlib
+import datetime
+import tempfile
+from unittest import mock
+
+
+class HashEmbedding(EmbeddingFunction):
+    """Deterministic offline embeddings so tests don't download a model."""
+
+    def __init__(self):
+        pass
+
+    def __call__(self, input):
+        return [[b / 255 for b in hashlib.sha256(text.encode("utf-8")).digest()[:16]] for text in input]
+
+
+class LocalClient:
+    """In-memory Chroma client whose collections (and hat_manager's embeddings) use HashEmbedding."""
+
+    def __init__(self):
+        set_embedding_function(HashEmbedding())
+        set_keyword_index(KeywordIndex(":memory:"))
+        self.client = chromadb.EphemeralClient()
+        for collection in self.client.list_collections():
+            self.client.delete_collection(collection if isinstance(collection, str) else collection.name)
+
+    def get_or_create_collection(self, name, **kwargs):
+        kwargs["embedding_function"] = HashEmbedding()
+        return self.client.get_or_create_collection(name, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class FakeCollection:
+    def __init__(self, name):
+        self.name = name
+
+    def get(self, **kwargs):
+        return {"ids": []}
+
+    def count(self):
+        return 0
+
+
+class CountingClient:
+    def __init__(self):
+        self.opened = []
+
+    def get_or_create_collection(self, name, **kwargs):
+        self.opened.append(name)
+        return FakeCollection(name)
+
+
+def test_collection_handles_are_cached_and_evicted():
+    client = CountingClient()
+    set_chroma_client(client)
+    set_keyword_index(KeywordIndex(":memory:"))
+    original_size = hat_manager.CHROMA_COLLECTION_CACHE_SIZE
+    hat_manager.CHROMA_COLLECTION_CACHE_SIZE = 2
+    try:
+        first = get_vector_db_for_hat("planner")
+        assert get_vector_db_for_hat("planner") is first
+        assert client.opened == ["planner"], "❌ Handle was not cached"
+
+        get_vector_db_for_hat("critic")
+        get_vector_db_for_hat("planner")     # planner becomes most recent
+        get_vector_db_for_hat("researcher")  # evicts critic
+        get_vector_db_for_hat("critic")
+        assert client.opened == ["planner", "critic", "researcher", "critic"]
+
+        forget_collection("planner")
+        get_vector_db_for_hat("planner")
+        assert client.opened[-1] == "planner", "❌ forget_collection did not invalidate"
+
+        clear_memory("researcher")
+        get_vector_db_for_hat("researcher")
+        assert client.opened[-1] == "researcher", "❌ clear_memory did not invalidate"
+    finally:
+        hat_manager.CHROMA_COLLECTION_CACHE_SIZE = original_size
+        set_chroma_client(None)
+    print("✅ collection handle cache")
+
+
+def test_tag_filters_run_in_the_store():
+    set_chroma_client(LocalClient())
+    try:
+        add_memory_to_hat("hat_tags", "plan the launch", tags=["planning"])
+        add_memory_to_hat("hat_tags", "check the budget", tags=["planning", "finance"])
+        add_memory_to_hat("hat_tags", "random chatter")
+        flush_memories()
+
+        planning = search_memory("hat_tags", "launch", k=None, tag_filter="planning")
+        assert sorted(doc for doc, _ in planning) == ["check the budget", "plan the launch"]
+        assert [doc for doc, _ in search_memory("hat_tags", "x", k=5, tag_filter="finance")] == ["check the budget"]
+
+        # Legacy memory with CSV-only tags
+        get_vector_db_for_hat("hat_tags").add(ids=["legacy"], documents=["old note"], metadatas=[{"role": "user", "tags": "finance,old"}])
+        assert migrate_memory_metadata(["hat_tags"]) == 1
+        assert sorted(doc for doc, _ in search_memory("hat_tags", "x", k=None, tag_filter="old")) == ["old note"]
+
+        assert tag_memory("hat_tags", "legacy", "archived") == ["finance", "old", "archived"]
+        assert [doc for doc, _ in search_memory("hat_tags", "x", k=None, tag_filter="archived")] == ["old note"]
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ structured tag filters")
+
+
+def test_list_memories_pages_in_storage_order():
+    set_chroma_client(LocalClient())
+    try:
+        for i in range(7):
+            add_memory_to_hat("hat_pages", f"note {i}", tags=["even"] if i % 2 == 0 else None)
+        flush_memories()
+
+        pages, offset = [], 0
+        while offset is not None:
+            page, offset = list_memories("hat_pages", offset=offset, limit=3)
+            pages.append([doc for doc, _ in page])
+        assert pages == [["note 0", "note 1", "note 2"], ["note 3", "note 4", "note 5"], ["note 6"]]
+
+        page, next_offset = list_memories("hat_pages", limit=10, tag_filter="even")
+        assert [doc for doc, _ in page] == ["note 0", "note 2", "note 4", "note 6"] and next_offset is None
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ paginated memory listing")
+
+
+def test_repeated_memories_are_upserted():
+    set_chroma_client(LocalClient())
+    try:
+        add_memory_to_hat("hat_dedupe", "Ship the beta on Friday", role="bot")
+        add_memory_to_hat("hat_dedupe", "ship the beta  on friday", role="bot", tags=["launch"])  # Same batch
+        flush_memories()
+        add_memory_to_hat("hat_dedupe", "Ship the beta on Friday", role="bot", tags=["qa"])  # Later batch
+        add_memory_to_hat("hat_dedupe", "Ship the beta on Friday", role="user")  # Different role, own entry
+        flush_memories()
+
+        collection = get_vector_db_for_hat("hat_dedupe")
+        assert collection.count() == 2, "❌ Repeated memory was stored twice"
+        bot = collection.get(ids=[hat_manager.memory_id_for("hat_dedupe", "bot", "Ship the beta on Friday")])["metadatas"][0]
+        assert bot["occurrences"] == 3 and bot["role"] == "bot"
+        assert bot["tags"] == "launch,qa" and bot["tag_qa"] is True
+        assert bot["first_seen"] <= bot["timestamp"]
+
+        assert len(search_memory("hat_dedupe", "beta", k=3)) == 1, "❌ Duplicate text returned twice"
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ content-addressed memory upserts")
+
+
+def test_retried_batch_does_not_merge_twice():
+    set_chroma_client(LocalClient())
+    embedding, failures = HashEmbedding(), [RuntimeError("embedding backend down")]
+
+    def flaky_embedding(texts):
+        if failures:
+            raise failures.pop()
+        return embedding(texts)
+
+    try:
+        add_memory_to_hat("hat_retry", "known fact")
+        flush_memories()
+        set_embedding_function(flaky_embedding)
+        add_memory_to_hat("hat_retry", "known fact", tags=["again"])  # Merged before the new row's embedding fails
+        add_memory_to_hat("hat_retry", "new fact")
+        flush_memories()
+        assert hat_manager.memory_queue.pending("hat_retry") == 2, "❌ Failed batch not re-queued"
+        flush_memories()
+
+        collection = get_vector_db_for_hat("hat_retry")
+        known = collection.get(ids=[memory_id_for("hat_retry", "user", "known fact")])["metadatas"][0]
+        assert known["occurrences"] == 2, f"❌ Retry merged the landed row again: {known['occurrences']}"
+        assert collection.count() == 2
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ retried batch merged once")
+
+
+def test_search_results_are_cached_until_memories_change():
+    client = LocalClient()
+    set_chroma_client(client)
+    queries = []
+    embedding = HashEmbedding()
+    set_embedding_function(lambda texts: queries.append(list(texts)) or embedding(texts))
+    try:
+        add_memory_to_hat("hat_cache", "the launch is on friday")
+        flush_memories()
+        queries.clear()
+
+        first = search_memory("hat_cache", "When is the launch?", k=3)
+        assert search_memory("hat_cache", "  when is the LAUNCH? ", k=3) == first
+        assert len(queries) == 1, "❌ Repeated query hit the vector store again"
+
+        add_memory_to_hat("hat_cache", "the launch is on friday")  # Re-run of the same turn
+        flush_memories()
+        search_memory("hat_cache", "When is the launch?", k=3)
+        assert len(queries) == 1, "❌ Re-storing a known memory invalidated the cache"
+
+        add_memory_to_hat("hat_cache", "the launch moved to monday")
+        flush_memories()
+        queries.clear()
+        assert len(search_memory("hat_cache", "When is the launch?", k=3)) == 2
+        assert len(queries) == 1
+
+        # Recency-weighted scores depend on the clock: reused within 1/16 of the half-life, recomputed after
+        queries.clear()
+        with mock.patch.object(hat_manager.time, "time", lambda: 1600.0):
+            search_memory("hat_cache", "When is the launch?", k=3, recency_half_life=160)
+        with mock.patch.object(hat_manager.time, "time", lambda: 1609.0):
+            search_memory("hat_cache", "When is the launch?", k=3, recency_half_life=160)
+        assert len(queries) == 1
+        with mock.patch.object(hat_manager.time, "time", lambda: 1610.0):
+            search_memory("hat_cache", "When is the launch?", k=3, recency_half_life=160)
+        assert len(queries) == 2, "❌ Recency-weighted results cached past their time bucket"
+
+        clear_memory("hat_cache")
+        assert search_memory("hat_cache", "When is the launch?", k=3) == []
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ retrieval cache")
+
+
+class RacingKeywordIndex(KeywordIndex):
+    """Runs a search in the middle of a write, like the write-behind thread racing a chat turn."""
+
+    def upsert(self, hat_id, entries):
+        if entries and getattr(self, "race", False):
+            self.race = False
+            search_memory(hat_id, "launch", k=3, mode="keyword")
+        return super().upsert(hat_id, entries)
+
+
+def test_search_racing_a_write_is_not_cached_as_fresh():
+    set_chroma_client(LocalClient())
+    index = RacingKeywordIndex(":memory:")
+    set_keyword_index(index)
+    try:
+        upsert_memories("hat_race", [(memory_id_for("hat_race", "user", "launch is friday"), "launch is friday", {"role": "user", "tags": ""})])
+        assert len(search_memory("hat_race", "launch", k=3, mode="keyword")) == 1
+
+        index.race = True
+        upsert_memories("hat_race", [(memory_id_for("hat_race", "user", "launch moved to monday"), "launch moved to monday", {"role": "user", "tags": ""})])
+        assert len(search_memory("hat_race", "launch", k=3, mode="keyword")) == 2, "❌ Result from mid-write search served after the write"
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ search racing a write")
+
+
+def test_hybrid_search_recalls_exact_terms():
+    set_chroma_client(LocalClient())
+    queries = []
+    embedding = HashEmbedding()
+    set_embedding_function(lambda texts: queries.append(list(texts)) or embedding(texts))
+    try:
+        for i in range(20):
+            add_memory_to_hat("hat_hybrid", f"routine standup note number {i}")
+        add_memory_to_hat("hat_hybrid", "Incident INC-4471 was caused by the cache", tags=["ops"])
+        flush_memories()
+        queries.clear()
+
+        keyword = search_memory("hat_hybrid", "inc-4471", k=3, mode="keyword")
+        assert keyword[0][0] == "Incident INC-4471 was caused by the cache"
+        assert queries == [], "❌ Keyword lookup embedded the query"
+        assert search_memory("hat_hybrid", "INC-4471", k=3, mode="keyword", tag_filter="missing") == []
+
+        hybrid = search_memory("hat_hybrid", "what happened in INC-4471?", k=3)
+        assert "Incident INC-4471 was caused by the cache" in [doc for doc, _ in hybrid], "❌ Exact term missing from hybrid results"
+        assert len(queries) == 1
+
+        # Collections written before the index existed are backfilled on first search
+        set_keyword_index(KeywordIndex(":memory:"))
+        assert search_memory("hat_hybrid", "INC-4471", k=1, mode="keyword")[0][1]["tags"] == "ops"
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ hybrid keyword + vector search")
+
+
+def test_time_window_and_mission_filters():
+    set_chroma_client(LocalClient())
+    now = datetime.datetime.now().timestamp()
+    try:
+        for text, age_days, mission in [("deploy plan v1", 30, "m_old"), ("deploy plan v2", 2, "m_new"), ("deploy plan v3", 0, "m_new")]:
+            upsert_memories("hat_time", [(memory_id_for("hat_time", "user", text), text, {
+                "role": "user", "ts": now - age_days * 86400, "mission_id": mission
+            })])
+        add_memory_to_hat("hat_time", "deploy plan draft", mission_id="m_other")
+        flush_memories()
+
+        for mode in ("vector", "keyword", "hybrid"):
+            recent = {doc for doc, _ in search_memory("hat_time", "deploy plan", k=10, mode=mode, since=datetime.timedelta(days=7))}
+            assert recent == {"deploy plan v2", "deploy plan v3", "deploy plan draft"}, f"❌ {mode} ignored `since`: {recent}"
+            scoped = {doc for doc, _ in search_memory("hat_time", "deploy plan", k=10, mode=mode, mission_id="m_new", until=now - 86400)}
+            assert scoped == {"deploy plan v2"}, f"❌ {mode} ignored mission/until: {scoped}"
+
+        # A short half-life pushes month-old memories to the bottom
+        ranked = [doc for doc, _ in search_memory("hat_time", "deploy plan", k=4, mode="keyword", recency_half_life=86400)]
+        assert ranked[-1] == "deploy plan v1"
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ time-window and mission-scoped retrieval")
+
+
+def test_shared_layout_partitions_hats():
+    client = LocalClient()
+    set_chroma_client(client)
+    try:
+        add_memory_to_hat("hat_alpha", "alpha likes graphs", tags=["viz"])
+        add_memory_to_hat("hat_beta", "beta likes tables")
+        flush_memories()
+
+        report = migrate_memory_layout("shared")
+        assert report == {"hats": 2, "memories": 2}
+        set_memory_layout("shared")
+        assert [c if isinstance(c, str) else c.name for c in client.list_collections()] == ["hat_memories"]
+        assert sorted(memory_hat_ids()) == ["hat_alpha", "hat_beta"]
+
+        alpha = search_memory("hat_alpha", "likes", k=5)
+        assert [doc for doc, _ in alpha] == ["alpha likes graphs"], "❌ Search leaked across hats"
+        assert "hat_id" not in alpha[0][1] and alpha[0][1]["tags"] == "viz"
+        assert search_memory("hat_alpha", "likes", k=5, mode="vector", tag_filter="viz")[0][0] == "alpha likes graphs"
+
+        add_memory_to_hat("hat_beta", "beta also likes charts")
+        flush_memories()
+        both = search_across_hats("likes", k=10, hat_ids=["hat_alpha", "hat_beta"])
+        assert sorted(hat_id for hat_id, _, _ in both) == ["hat_alpha", "hat_beta", "hat_beta"]
+
+        clear_memory("hat_beta")
+        assert get_vector_db_for_hat("hat_beta").count() == 0
+        assert list_memories("hat_alpha")[0][0][0] == "alpha likes graphs"
+    finally:
+        set_memory_layout("per_hat")
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ shared memory layout + migration")
+
+
+def test_team_partition_survives_reteaming():
+    client = LocalClient()
+    set_chroma_client(client)
+    original_registry = hat_manager.hat_registry
+    with tempfile.TemporaryDirectory() as hat_dir:
+        registry = hat_manager.hat_registry = HatRegistry(hat_dir, rescan_interval=0)
+        try:
+            set_memory_layout("per_team")
+            registry.put("hat_mover", {"hat_id": "hat_mover", "name": "Mover", "team_id": "t1"})
+            add_memory_to_hat("hat_mover", "mover knows the deploy steps")
+            add_memory_to_hat("analyst", "ad-hoc IDs have no hat file")
+            flush_memories()
+            assert registry.get("hat_mover")["memory_team_id"] == "t1"
+
+            registry.put("hat_mover", {**registry.get("hat_mover"), "team_id": "t2"})
+            forget_collection()
+            assert [doc for doc, _ in search_memory("hat_mover", "deploy", k=5)] == ["mover knows the deploy steps"], "❌ Re-teamed hat lost its memories"
+
+            # A keyword index rebuilt from scratch doesn't move the partition either
+            set_keyword_index(KeywordIndex(":memory:"))
+            forget_collection()
+            assert get_vector_db_for_hat("hat_mover").count() == 1
+
+            copy = normalize_hat(registry.get("hat_mover"), team_id="t3")
+            assert "memory_team_id" not in copy, "❌ Copy for another team shares the original's partition"
+
+            # Listing hats reads the pinned hat records and the keyword index instead of scanning Chroma rows
+            set_keyword_index(KeywordIndex(":memory:"))
+            add_memory_to_hat("analyst", "ad-hoc IDs have no hat file")
+            flush_memories()
+            client.get_collection = lambda name: (_ for _ in ()).throw(AssertionError("❌ memory_hat_ids scanned a collection"))
+            assert memory_hat_ids() == ["analyst", "hat_mover"]
+            del client.get_collection
+        finally:
+            hat_manager.hat_registry = original_registry
+            set_memory_layout("per_hat")
+            set_chroma_client(None)
+            set_embedding_function(None)
+    print("✅ per-team partition is pinned")
+
+if __name__ == "__main__":
+    test_collection_handles_are_cached_and_evicted()
+    test_tag_filters_run_in_the_store()
+    test_list_memories_pages_in_storage_order()
+    test_repeated_memories_are_upserted()
+    test_retried_batch_does_not_merge_twice()
+    test_search_results_are_cached_until_memories_change()
+    test_search_racing_a_write_is_not_cached_as_fresh()
+    test_hybrid_search_recalls_exact_terms()
+    test_time_window_and_mission_filters()
+    test_shared_layout_partitions_hats()
+    test_team_partition_survives_reteaming()
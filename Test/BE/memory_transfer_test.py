@@ -0,0 +1,112 @@
+from hat_manager import add_memory_to_hat, flush_memories, get_vector_db_for_hat, set_chroma_client, set_embedding_function, search_memory
+import memory_transfer
+from memory_transfer import export_memories, import_memories, export_path, export_file
+from memory_test import LocalClient, HashEmbedding
+import gzip
+import json
+import os
+import tempfile
+
+
+def test_export_and_resumable_import_reuse_embeddings():
+    set_chroma_client(LocalClient())
+    embedded = []
+    embedding = HashEmbedding()
+    set_embedding_function(lambda texts: embedded.extend(texts) or embedding(texts))
+    try:
+        for i in range(5):
+            add_memory_to_hat("hat_source", f"fact {i}", tags=["facts"])
+        flush_memories()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "hat_source.jsonl.gz")
+            assert export_memories(["hat_source"], path, page_size=2) == 5
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                assert header["type"] == "header"
+                assert len(f.readlines()) == 5
+
+            # Pretend an earlier run into hat_clone loaded the first 2 rows before it was interrupted
+            checkpoint = {"source": os.path.abspath(path), "target_hat_id": "hat_clone", "model": header["model"], "done": 2}
+            with open(path + ".checkpoint", "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f)
+            assert import_memories(path, target_hat_id="hat_other")["resumed_from"] == 0, "❌ Resumed another target's import"
+            assert get_vector_db_for_hat("hat_other").count() == 5
+            with open(path + ".checkpoint", "w", encoding="utf-8") as f:
+                json.dump(checkpoint, f)
+
+            embedded.clear()
+            result = import_memories(path, target_hat_id="hat_clone", batch_size=2)
+            assert result == {"imported": 3, "resumed_from": 2, "hats": ["hat_clone"]}
+            assert embedded == [], "❌ Import re-embedded stored vectors"
+            assert not os.path.exists(path + ".checkpoint")
+
+            assert import_memories(path, target_hat_id="hat_clone")["imported"] == 5
+            clone = get_vector_db_for_hat("hat_clone")
+            assert clone.count() == 5, "❌ Re-import duplicated memories"
+            assert sorted(clone.get()["documents"]) == [f"fact {i}" for i in range(5)]
+            assert len(search_memory("hat_clone", "fact 3", k=2, tag_filter="facts")) == 2
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ memory export/import")
+
+
+def test_team_export_with_shared_inputs_imports_into_one_hat():
+    set_chroma_client(LocalClient())
+    set_embedding_function(HashEmbedding())
+    try:
+        for hat_id in ("writer_a", "writer_b", "writer_c"):  # A parallel stage stores the same input for every hat
+            add_memory_to_hat(hat_id, "Write the launch plan", role="user")
+            add_memory_to_hat(hat_id, f"{hat_id} draft", role="bot")
+        flush_memories()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "team.jsonl.gz")
+            assert export_memories(["writer_a", "writer_b", "writer_c"], path) == 6
+            assert import_memories(path, target_hat_id="merged")["imported"] == 6
+            merged = get_vector_db_for_hat("merged").get()
+            assert len(merged["ids"]) == 4, "❌ Shared input not collapsed"
+            shared = merged["metadatas"][merged["documents"].index("Write the launch plan")]
+            assert shared["occurrences"] == 3
+            assert not os.path.exists(path + ".checkpoint")
+    finally:
+        set_chroma_client(None)
+        set_embedding_function(None)
+    print("✅ team export into one hat")
+
+
+def test_chat_paths_stay_in_the_export_dir():
+    original = memory_transfer.MEMORY_EXPORT_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        memory_transfer.MEMORY_EXPORT_DIR = os.path.join(tmp, "exports")
+        try:
+            path = export_path("hat_a")
+            assert os.path.dirname(path) == memory_transfer.MEMORY_EXPORT_DIR
+            for bad in ("../../x", "a/b", "..", "a\\b", ""):
+                try:
+                    export_path(bad)
+                    assert False, f"❌ Export name {bad!r} accepted"
+                except ValueError:
+                    pass
+
+            open(path, "wb").close()
+            assert export_file(os.path.basename(path)) == os.path.realpath(path)
+            assert export_file(path) == os.path.realpath(path)
+            outside = os.path.join(tmp, "secret.jsonl.gz")
+            open(outside, "wb").close()
+            for bad in (outside, os.path.join(memory_transfer.MEMORY_EXPORT_DIR, "..", "secret.jsonl.gz"), "missing.jsonl.gz"):
+                try:
+                    export_file(bad)
+                    assert False, f"❌ Import path {bad!r} accepted"
+                except ValueError:
+                    pass
+        finally:
+            memory_transfer.MEMORY_EXPORT_DIR = original
+    print("✅ export paths confined")
+
+
+if __name__ == "__main__":
+    test_export_and_resumable_import_reuse_embeddings()
+    test_team_export_with_shared_inputs_imports_into_one_hat()
+    test_chat_paths_stay_in_the_export_dir()
@@ -0,0 +1,64 @@
+from mentions import MentionEngine, find_mentions
+import asyncio
+import time
+
+
+def _engine(replies, delay=0.0, **limits):
+    calls = []
+
+    async def respond(caller, text, target):
+        calls.append((caller, target))
+        await asyncio.sleep(delay)
+        return replies.get(target)
+
+    return MentionEngine(respond, **limits), calls
+
+
+def test_find_mentions():
+    assert find_mentions("@a hi @b and @a again") == ["a", "b"]
+    assert find_mentions("no mentions") == []
+    assert find_mentions("mail a@example.com, (@b) or\n@c") == ["b", "c"], "❌ E-mail address read as a mention"
+    print("✅ find_mentions")
+
+
+def test_ping_pong_is_cut_by_cycle_detection():
+    engine, calls = _engine({"a": "ask @b", "b": "ask @a"}, max_depth=10, max_calls=10)
+    report = asyncio.run(engine.run("user", "@a start"))
+
+    assert calls == [("user", "a"), ("a", "b")], f"❌ Unexpected hops: {calls}"
+    assert ("b", "a", "cycle") in report["skipped"]
+    print("✅ cycle detection")
+
+
+def test_depth_and_budget_limits():
+    engine, calls = _engine({"a": "@b", "b": "@c", "c": "@d", "d": "done"}, max_depth=2, max_calls=10)
+    report = asyncio.run(engine.run("user", "@a"))
+    assert [target for _, target in calls] == ["a", "b"]
+    assert ("b", "c", "depth") in report["skipped"]
+
+    engine, calls = _engine({t: "ok" for t in "abcde"}, max_calls=3)
+    report = asyncio.run(engine.run("user", "@a @b @c @d @e"))
+    assert report["calls"] == 3 and len(calls) == 3
+    assert [reason for _, _, reason in report["skipped"]] == ["budget", "budget"]
+
+    engine, calls = _engine({t: "ok" for t in "ab"}, max_calls=2, known_ids=["a", "b"])
+    report = asyncio.run(engine.run("user", "@ghost @nobody @a @b"))
+    assert [target for _, target in calls] == ["a", "b"], "❌ Unknown handles used up the call budget"
+    assert [reason for _, _, reason in report["skipped"]] == ["unknown", "unknown"]
+    print("✅ depth and budget limits")
+
+
+def test_same_level_runs_concurrently():
+    engine, calls = _engine({t: "ok" for t in "abcd"}, delay=0.2, concurrency=4)
+    start = time.monotonic()
+    report = asyncio.run(engine.run("user", "@a @b @c @d"))
+    assert len(report["replies"]) == 4
+    assert time.monotonic() - start < 0.6, "❌ Mentions at one level ran sequentially"
+    print("✅ concurrent fan-out")
+
+
+if __name__ == "__main__":
+    test_find_mentions()
+    test_ping_pong_is_cut_by_cycle_detection()
+    test_depth_and_budget_limits()
+    test_same_level_runs_concurrently()
@@ -0,0 +1,87 @@
+import os
+os.environ.setdefault("OPENAI_API_KEY", "test-key")  # prompts builds its OpenAI clients at import
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ollama_client import OllamaClient, set_ollama_client
+import hat_manager
+import prompts
+
+HAT_JSON = json.dumps({"hat_id": "poet", "name": "Poet", "model": "gpt-3.5-turbo", "instructions": "Write poems."})
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is observable
+    requests_seen = []
+    connections = set()
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StubOllama.requests_seen.append((self.path, payload))
+        StubOllama.connections.add(self.client_address)
+
+        if payload.get("model") == "missing":
+            body = json.dumps({"error": "model 'missing' not found"}).encode()
+            self.send_response(404)
+        elif self.path == "/api/generate":
+            body = json.dumps({"model": payload["model"], "response": "", "done": True}).encode()
+            self.send_response(200)
+        else:
+            body = json.dumps({"message": {"role": "assistant", "content": HAT_JSON}, "done": True}).encode()
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub():
+    StubOllama.requests_seen, StubOllama.connections = [], set()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_pooled_chat_and_preload():
+    server, url = start_stub()
+    client = OllamaClient(url, keep_alive="-1")
+    try:
+        assert client.chat([{"role": "user", "content": "hi"}], "llama3:8b") == HAT_JSON
+        assert client.chat([{"role": "user", "content": "hi"}], "llama3:8b") == HAT_JSON
+        assert client.preload(["llama3:8b", "missing"]) == {"llama3:8b": True, "missing": False}
+
+        assert all(payload["keep_alive"] == -1 for _, payload in StubOllama.requests_seen), "❌ keep_alive not sent"
+        assert [path for path, _ in StubOllama.requests_seen[2:]] == ["/api/generate"] * 2
+        assert len(StubOllama.connections) <= 2, "❌ New connection per request"  # The 404 may close its socket
+        try:
+            client.chat([], "missing")
+            assert False, "❌ API error swallowed"
+        except Exception as e:
+            assert "404" in str(e)
+    finally:
+        client.close()
+        server.shutdown()
+    print("✅ pooled Ollama client")
+
+
+def test_hat_generation_uses_shared_client():
+    server, url = start_stub()
+    set_ollama_client(OllamaClient(url))
+    try:
+        assert hat_manager.ollama_llm("Make a poet")["hat_id"] == "poet"
+        assert prompts.call_ollama_llm("Make a poet")["hat_id"] == "poet"
+        assert len(StubOllama.connections) == 1, "❌ Hat generation opened a connection per call"
+    finally:
+        set_ollama_client(None)
+        server.shutdown()
+    print("✅ hat generation via shared Ollama client")
+
+
+if __name__ == "__main__":
+    test_pooled_chat_and_preload()
+    test_hat_generation_uses_shared_client()
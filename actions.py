@@ -3,7 +3,8 @@ import chainlit as cl
 from chainlit.action import Action
 import json
 
-from hat_manager import create_hat_from_prompt, load_hat, save_hat, normalize_hat
+from hat_manager import create_hat_from_prompt, load_hat, save_hat, save_hats, normalize_hat, flush_memories, list_memories
+from utils import format_memory_entry
 from ui import show_hat_sidebar, show_hat_selector
 
 # --- Schedule Actions ---
@@ -69,9 +70,8 @@ async def save_team_action(action: cl.Action):
         await cl.Message(content="❌ No team to save.").send()
         return
     
-    for hat in proposed_team:
-        save_hat(hat["hat_id"], normalize_hat(hat))
-    
+    save_hats([(hat["hat_id"], normalize_hat(hat)) for hat in proposed_team])
+
     await cl.Message(content="✅ Team saved successfully! You can now `wear <hat_id>` or `run team <team_id>`.").send()
     await show_hat_sidebar()
     await show_hat_selector()
@@ -123,6 +123,39 @@ async def save_hat_action_ui(action: Action):
     except Exception as e:
         await cl.Message(content=f"❌ Error saving hat '{hat_id}' from UI: {e}").send()
 
+# --- Memory Browser ---
+async def show_memory_page(hat_id: str, tag: str = None, offset: int = 0):
+    """Sends one page of a hat's memories, with a "more" button when another page exists."""
+    if offset == 0:
+        await cl.make_async(flush_memories)(hat_id)  # Include memories still in the write-behind queue
+    memories, next_offset = await cl.make_async(list_memories)(hat_id, offset=offset, tag_filter=tag)
+    tag_label = f" with tag `{tag}`" if tag else ""
+
+    if not memories:
+        if offset == 0:
+            await cl.Message(content=f"🧠 No memories stored for `{hat_id}`{tag_label}.").send()
+        return
+
+    formatted = "\n".join(format_memory_entry(doc, meta) for doc, meta in memories)
+    header = f"🧠 Memories for `{hat_id}`{tag_label}" + (f" ({offset + 1}–{offset + len(memories)})" if next_offset is not None or offset else "")
+    actions = []
+    if next_offset is not None:
+        actions.append(Action(
+            name="more_memories",
+            label="⬇️ More memories",
+            payload={"hat_id": hat_id, "tag": tag, "offset": next_offset}
+        ))
+    await cl.Message(content=f"{header}:\n{formatted}", actions=actions).send()
+
+@cl.action_callback("more_memories")
+async def more_memories_action(action: Action):
+    hat_id = action.payload.get("hat_id")
+    if not hat_id:
+        await cl.Message(content="❌ Error: Missing hat_id in memory page payload.").send()
+        return
+    await action.remove()  # One "more" button at a time
+    await show_memory_page(hat_id, action.payload.get("tag"), int(action.payload.get("offset", 0)))
+
 # --- Hat Prompt Handling ---
 async def ask_for_prompt():
     cl.user_session.set("awaiting_hat_prompt", True)
@@ -137,7 +170,7 @@ async def handle_prompt(message: cl.Message, ollama_llm):
         thinking_msg = cl.Message(content="⚙️ Creating Hat from your description...")
         await thinking_msg.send()
 
-        hat = create_hat_from_prompt(prompt_content, ollama_llm)
+        hat = await cl.make_async(create_hat_from_prompt)(prompt_content, ollama_llm)
 
         if not hat or not hat.get("hat_id") or not hat.get("name"):
             raise ValueError("LLM did not return a valid hat structure.")
@@ -14,13 +14,19 @@ from hat_manager import (
     list_hats,
     list_hats_by_team,
     load_hat,
+    load_all_hats,
     normalize_hat,
     save_hat,
+    save_hats,
+    delete_hat,
+    delete_memory_collection,
     ollama_llm,
     get_vector_db_for_hat,
     search_memory,
     add_memory_to_hat,
-    clear_memory
+    clear_memory,
+    flush_memories,
+    tag_memory
 )
 
 
@@ -33,12 +39,17 @@ from actions import (
     ask_for_prompt,
     handle_prompt,
     save_edited_json,
-    save_team_action
+    save_team_action,
+    show_memory_page
 )
 
 from flow import finalize_team_flow, run_team_flow
+from mentions import MentionEngine, find_mentions
+from memory_retention import enforce_retention, retention_worker
+from memory_transfer import export_memories, import_memories, export_path, export_file, team_hat_ids
+from ollama_client import preload_models_in_background
 
-from utils import format_tags_for_display, generate_unique_hat_id, current_timestamp, format_memory_entry, merge_tags
+from utils import format_tags_for_display, generate_unique_hat_id, current_timestamp, format_memory_entry
 
 load_dotenv()
 try:
@@ -62,6 +73,18 @@ except ImportError:
 def load_team_from_ids(hat_ids):
     return [load_hat(hat_id) for hat_id in hat_ids]
 
+@cl.on_app_startup
+async def startup():
+    """Start the background memory retention job and warm up the configured Ollama models."""
+    retention_worker.start()
+    preload_models_in_background()
+
+@cl.on_app_shutdown
+async def shutdown():
+    """Persist any memories still waiting in the write-behind queue."""
+    retention_worker.stop()
+    flush_memories()
+
 @cl.on_chat_start
 async def main():
     """
@@ -130,14 +153,17 @@ async def create_blank_hat():
 
 
 async def handle_hat_mention(trigger_hat_id, trigger_message, target_hat_id, hats_list):
+    """Answers a single @mention hop. Returns the target's reply, or None if it doesn't exist."""
     # Load target hat data
     target_hat = next((h for h in hats_list if h['hat_id'] == target_hat_id), None)
     if not target_hat:
         await cl.Message(content=f"❌ Hat `{target_hat_id}` not found.").send()
-        return False
+        return None
 
-    # Generate response
-    response = generate_openai_response(trigger_message, target_hat)
+    # Generate response (streamed into the chat as it arrives)
+    reply_msg = cl.Message(content=f"🧢 @{target_hat['name']} replied:\n")
+    response = await generate_openai_response(trigger_message, target_hat, stream_to=reply_msg)
+    await reply_msg.send()
     # Next Steps: Improve tagging for mentioned hats memories
     # NEW: Save the mentioned hat's reply into the memory of the trigger hat
     trigger_hat = next((h for h in hats_list if h['hat_id'] == trigger_hat_id), None)
@@ -155,38 +181,41 @@ async def handle_hat_mention(trigger_hat_id, trigger_message, target_hat_id, hat
     add_memory_to_hat(target_hat_id, trigger_message, role="user", tags=target_hat.get("memory_tags", []),session=cl.user_session)
     add_memory_to_hat(target_hat_id, response, role="bot", tags=target_hat.get("memory_tags", []), session=cl.user_session)
 
-    await cl.Message(content=f"🧢 @{target_hat['name']} replied:\n{response}").send()
-    await handle_multiple_mentions(
-        trigger_hat_id=target_hat_id,
-        trigger_message=response,
-        hats_list=hats_list
-    )
+    return response
 
-    return True
 async def handle_multiple_mentions(trigger_hat_id, trigger_message, hats_list):
     """
-    Finds and triggers all mentioned Hats in a message.
+    Finds and triggers all mentioned Hats in a message, then follows mentions in their replies.
     - trigger_hat_id: ID of the initiator (user or agent).
     - trigger_message: The full message containing @mentions.
-    - hats_list: List of all available hat IDs.
+    - hats_list: List of all available hats.
+    Fan-out is bounded by the MentionEngine (depth, call budget, dedupe, cycle detection).
     """
-    mentioned_hat_ids = re.findall(r"@(\w+)", trigger_message)
-    if not mentioned_hat_ids:
+    if not find_mentions(trigger_message):
         return False  # No mentions found
 
-    handled_any = False
-    for target_hat_id in set(mentioned_hat_ids):  # Avoid duplicate mentions
-        success = await handle_hat_mention(trigger_hat_id, trigger_message, target_hat_id, hats_list)
-        handled_any = handled_any or success  # Track if at least one was valid
+    engine = MentionEngine(
+        respond=lambda caller, text, target: handle_hat_mention(caller, text, target, hats_list),
+        known_ids=[hat['hat_id'] for hat in hats_list]
+    )
+    report = await engine.run(trigger_hat_id, trigger_message)
+
+    # Only the original message's unknown handles are reported; replies may quote arbitrary @names
+    for caller, target, reason in report["skipped"]:
+        if reason == "unknown" and caller == trigger_hat_id:
+            await cl.Message(content=f"❌ Hat `{target}` not found.").send()
 
-    return handled_any
+    stopped = [(caller, target, reason) for caller, target, reason in report["skipped"] if reason in ("depth", "budget")]
+    if stopped:
+        await cl.Message(content=f"⏹️ Stopped following {len(stopped)} mention(s) after {report['calls']} call(s) (depth/call limit reached).").send()
+
+    return bool(report["replies"])  # Track if at least one was valid
 
 async def handle_mentions_if_any(message: cl.Message, hats: list):
     content = message.content.strip()
-    mentioned = re.findall(r"@(\w+)", content)
-    hats_obj = [load_hat(hat_id) for hat_id in list_hats()]
+    mentioned = find_mentions(content)
     if mentioned:
-        await handle_multiple_mentions("user", content, hats_obj)
+        await handle_multiple_mentions("user", content, load_all_hats())
         return True  # Mentions handled
     return False  # No mentions found
 
@@ -337,11 +366,13 @@ async def handle_message(message: cl.Message):
             if len(filtered_hats) == len(hats):
                 await cl.Message(content=f"⚠️ No critic found in team `{team_id}`.").send()
             else:
-                path = f"./hats/{critic_id}.json"
-                if os.path.exists(path):
-                    os.remove(path)
+                try:
+                    # Critic IDs are reused per team, so a re-added critic must not inherit old memories.
+                    # Its memories go first: the hat record says which partition holds them.
+                    await cl.make_async(delete_memory_collection)(critic_id)
+                    delete_hat(critic_id)
                     await cl.Message(content=f"🗑️ Removed Critic Hat `{critic_id}` from disk.").send()
-                else:
+                except FileNotFoundError:
                     await cl.Message(content=f"⚠️ Critic file `{critic_id}.json` not found.").send()
 
             await show_hat_sidebar()
@@ -358,23 +389,97 @@ async def handle_message(message: cl.Message):
         if not hat_id:
             await cl.Message(content="❌ No active hat. Wear a hat first.").send()
         else:
-            memories = search_memory(hat_id, "", k=None, tag_filter=tag)
-            if memories:
-                formatted = "\n".join([format_memory_entry(doc, meta) for doc, meta in memories])
-                await cl.Message(content=f"🧠 Memories for `{hat_id}`{f' with tag `{tag}`' if tag else ''}:\n{formatted}").send()
-            else:
-                await cl.Message(content=f"🧠 No memories stored for `{hat_id}`{f' with tag `{tag}`' if tag else ''}.").send()
+            await show_memory_page(hat_id, tag)
     
+    elif content_lower.startswith("find memories "):
+        terms = content.split(" ", 2)[2].strip()
+        hat_id = current_hat.get('hat_id') if current_hat else None
+        if not hat_id:
+            await cl.Message(content="❌ No active hat. Wear a hat first.").send()
+        else:
+            matches = await cl.make_async(search_memory)(hat_id, terms, k=10, read_your_writes=True, mode="keyword")
+            if matches:
+                formatted = "\n".join(format_memory_entry(doc, meta) for doc, meta in matches)
+                await cl.Message(content=f"🔎 Keyword matches for `{terms}` in `{hat_id}`:\n{formatted}").send()
+            else:
+                await cl.Message(content=f"🔎 No memories in `{hat_id}` mention `{terms}`.").send()
+
     elif content_lower.startswith("clear memories"):
         hat_id = current_hat.get('hat_id') if current_hat else None
         if not hat_id:
             await cl.Message(content="❌ No active hat. Wear a hat first.").send()
         else:
-            clear_memory(hat_id)
+            await cl.make_async(clear_memory)(hat_id)
             await cl.Message(content=f"🧹 Cleared all memories for `{hat_id}`.").send()
+
+    elif content_lower.startswith("export memories"):
+        # export memories | export memories <hat_id> | export memories team <team_id>
+        args = content.split()[2:]
+        if args[:1] == ["team"] and len(args) > 1:
+            name, hat_ids = args[1], team_hat_ids(args[1])
+        else:
+            hat_id = args[0] if args else (current_hat.get('hat_id') if current_hat else None)
+            name, hat_ids = hat_id, [hat_id] if hat_id else []
+        if not hat_ids:
+            await cl.Message(content="❌ Nothing to export. Wear a hat or use `export memories <hat_id>` / `export memories team <team_id>`.").send()
+        else:
+            try:
+                path = export_path(name)
+            except ValueError as e:
+                await cl.Message(content=f"❌ {e}").send()
+                return
+            count = await cl.make_async(export_memories)(hat_ids, path)
+            await cl.Message(
+                content=f"📦 Exported {count} memories from {len(hat_ids)} hat(s) to `{path}`.",
+                elements=[cl.File(name=os.path.basename(path), path=path, display="inline")]
+            ).send()
+
+    elif content_lower.startswith("import memories"):
+        # import memories [<path>] [as <hat_id>] — without a path, asks for an upload
+        args = content.split()[2:]
+        target_hat_id = None
+        if "as" in args[:-1]:
+            target_hat_id = args[args.index("as") + 1]
+            args = args[:args.index("as")]
+        path = None
+        if args:
+            try:
+                path = export_file(args[0])  # Chat may only name files in MEMORY_EXPORT_DIR
+            except ValueError as e:
+                await cl.Message(content=f"❌ {e}").send()
+                return
+        else:
+            files = await cl.AskFileMessage(
+                content="📥 Upload a memory export (`.jsonl.gz`).",
+                accept={"application/gzip": [".gz"]},
+                max_size_mb=500
+            ).send()
+            path = files[0].path if files else None
+        if not path:
+            await cl.Message(content="❌ No export file given.").send()
+        else:
+            try:
+                result = await cl.make_async(import_memories)(path, target_hat_id=target_hat_id)
+                resumed = f" (resumed after {result['resumed_from']} already loaded)" if result["resumed_from"] else ""
+                await cl.Message(content=f"📥 Imported {result['imported']} memories into {', '.join(f'`{h}`' for h in result['hats']) or 'no hats'}{resumed}.").send()
+            except Exception as e:
+                await cl.Message(content=f"❌ Import failed: {e}. Run the same command again to resume.").send()
+
+    elif content_lower == "compact memories":
+        hat_id = current_hat.get('hat_id') if current_hat else None
+        if not hat_id:
+            await cl.Message(content="❌ No active hat. Wear a hat first.").send()
+        else:
+            report = await cl.make_async(enforce_retention)(hat_id)
+            await cl.Message(content=(
+                f"🧹 Retention applied to `{hat_id}`: {report['scanned']} memories scanned, "
+                f"{report['expired']} expired, {report['evicted']} evicted "
+                f"({report['compacted']} turns compacted into {report['summaries']} summaries)."
+            )).send()
     
     elif content_lower == "debug memories":
         hat_id = current_hat.get('hat_id')
+        await cl.make_async(flush_memories)(hat_id)
         collection = get_vector_db_for_hat(hat_id)
         all_data = collection.get(include=["documents", "metadatas"])
         print("DEBUG COLLECTION DATA:", all_data)
@@ -450,8 +555,10 @@ async def handle_message(message: cl.Message):
         critic_hat = normalize_hat(critic_hat, team_id=team_id, flow_order=2)
         critic_hat["qa_loop"] = True
 
-        save_hat(storyteller_hat["hat_id"], storyteller_hat)
-        save_hat(critic_hat["hat_id"], critic_hat)
+        save_hats([
+            (storyteller_hat["hat_id"], storyteller_hat),
+            (critic_hat["hat_id"], critic_hat)
+        ])
 
         await cl.Message(content=f"✨ Created new Story Team: `{team_id}`.\n\n**Mission:** {story_prompt}").send()
         await run_team_flow(team_id, story_prompt)
@@ -546,8 +653,7 @@ async def handle_message(message: cl.Message):
         if not proposed_team:
             await cl.Message(content="❌ No team proposal found. Use `create team` first.").send()
         else:
-            for hat in proposed_team:
-                save_hat(hat["hat_id"], normalize_hat(hat))
+            save_hats([(hat["hat_id"], normalize_hat(hat)) for hat in proposed_team])
             await cl.Message(content="✅ Team saved! Use `wear <hat_id>` to activate a Hat, or `view schedule` to assign times.").send()
             await show_hat_sidebar()
             await show_hat_selector()
@@ -575,23 +681,10 @@ async def handle_message(message: cl.Message):
         last_memory_hat_id = cl.user_session.get("last_memory_hat_id")
 
         if last_memory_id and last_memory_hat_id:
-            collection = get_vector_db_for_hat(last_memory_hat_id)
+            await cl.make_async(flush_memories)(last_memory_hat_id)  # The memory may still be queued
             try:
-                memory_data = collection.get(ids=[last_memory_id], include=["metadatas"])
-                current_meta = memory_data["metadatas"][0]
-
-                # 💡 Use your utility here!
-                merged_tags = merge_tags(current_meta.get("tags", ""), tag)
-                merged_tags_csv = ",".join(merged_tags)
-
-                collection.update(
-                    ids=[last_memory_id],
-                    metadatas=[{
-                        "timestamp": current_meta.get("timestamp", datetime.now().isoformat()),
-                        "role": current_meta.get("role", "user"),
-                        "tags": merged_tags_csv  # ✅ CSV format
-                    }]
-                )
+                # Updates the CSV tags and the per-tag keys used by `view memories <tag>`
+                merged_tags = tag_memory(last_memory_hat_id, last_memory_id, tag)
                 formatted_tags = format_tags_for_display(merged_tags)
                 await cl.Message(content=f"🏷️ Memory tagged as `{tag}` in `{last_memory_hat_id}`! Now tagged: {formatted_tags}").send()
             except Exception as e:
@@ -643,14 +736,15 @@ async def handle_message(message: cl.Message):
                 current_hat = cl.user_session.get("current_hat")
 
 
-            response_text = generate_openai_response(message.content, current_hat)
+            response_msg = cl.Message(content="")
+            response_text = await generate_openai_response(message.content, current_hat, stream_to=response_msg)
+            await response_msg.send()
             # Save both user message and bot response into memory
             tags = current_hat.get("memory_tags", [])
             add_memory_to_hat(current_hat.get('hat_id'), message.content, role="user", tags=tags, session=cl.user_session)
             add_memory_to_hat(current_hat.get('hat_id'), response_text, role="bot", tags=tags, session=cl.user_session)
-            
-            await cl.Message(content=response_text).send()
 
-            await handle_multiple_mentions(trigger_hat_id=current_hat.get("hat_id"), trigger_message=response_text, hats_list=[load_hat(hid) for hid in list_hats()])
+            if find_mentions(response_text):
+                await handle_multiple_mentions(trigger_hat_id=current_hat.get("hat_id"), trigger_message=response_text, hats_list=load_all_hats())
         else:
             await cl.Message(content="No hat is currently active. Use `wear <hat_id>` or select one.").send()
\ No newline at end of file
@@ -0,0 +1,130 @@
+# benchmark_memory_layout.py
+"""
+Compares the per-hat and shared memory layouts at a given number of hats.
+
+    python benchmark_memory_layout.py                      # 1k and 10k hats, both layouts
+    python benchmark_memory_layout.py --hats 1000 --memories 10
+
+Each (layout, hat count) runs in its own process against a fresh Chroma directory, so peak RSS
+and open file counts are not polluted by the previous run. Embeddings are deterministic
+384-dim vectors derived from the text (no model download).
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+
+DIM = 384
+
+
+class HashEmbedding:
+    def __call__(self, input):
+        return [np.random.default_rng(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)).random(DIM, dtype=np.float32)
+                for text in input]
+
+
+def directory_size(path):
+    """Bytes actually allocated (Chroma pre-sizes HNSW files sparsely, so apparent sizes overstate it)."""
+    return sum(os.stat(os.path.join(root, name)).st_blocks * 512 for root, _, names in os.walk(path) for name in names)
+
+
+def open_files():
+    try:
+        return len(os.listdir(f"/proc/{os.getpid()}/fd"))
+    except OSError:
+        return None
+
+
+def run_one(layout, hats, memories, queries):
+    """Writes `memories` per hat for `hats` hats, then times per-hat searches. Prints one JSON line."""
+    import chromadb
+    import hat_manager
+    from keyword_index import KeywordIndex
+
+    path = tempfile.mkdtemp(prefix=f"bench_{layout}_")
+    try:
+        hat_manager.set_memory_layout(layout)
+        hat_manager.set_chroma_client(chromadb.PersistentClient(path=path))
+        hat_manager.set_embedding_function(HashEmbedding())
+        hat_manager.set_keyword_index(KeywordIndex(":memory:"))
+        hat_manager.MEMORY_SEARCH_CACHE_SIZE = 0
+        hat_ids = [f"bench_hat_{i:05d}" for i in range(hats)]
+
+        start = time.perf_counter()
+        for hat_id in hat_ids:
+            hat_manager.upsert_memories(hat_id, [
+                (hat_manager.memory_id_for(hat_id, "user", text), text, {"role": "user", "ts": time.time(), "occurrences": 1, "tags": ""})
+                for text in (f"{hat_id} note {n} about topic {n % 7}" for n in range(memories))
+            ])
+        write_seconds = time.perf_counter() - start
+
+        rng = np.random.default_rng(0)
+        latencies = []
+        for i in range(queries):
+            hat_id = hat_ids[int(rng.integers(hats))]
+            start = time.perf_counter()
+            hat_manager.search_memory(hat_id, f"topic {i % 7}", k=3, mode="vector")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        hat_manager.search_across_hats("topic 3", k=10, hat_ids=hat_ids[:50])
+        across_ms = (time.perf_counter() - start) * 1000
+
+        print(json.dumps({
+            "layout": layout,
+            "hats": hats,
+            "collections": len(hat_manager.get_chroma_client().list_collections()),
+            "write_s": round(write_seconds, 2),
+            "search_p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "search_p95_ms": round(float(np.percentile(latencies, 95)), 2),
+            "across_50_hats_ms": round(across_ms, 2),
+            "disk_mb": round(directory_size(path) / 1024 / 1024, 1),
+            "open_files": open_files(),
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the per-hat vs shared memory layouts.")
+    parser.add_argument("--hats", type=int, action="append", help="Number of hats (repeatable; default 1000 and 10000).")
+    parser.add_argument("--memories", type=int, default=5, help="Memories per hat.")
+    parser.add_argument("--queries", type=int, default=200, help="Searches to time.")
+    parser.add_argument("--layout", choices=["per_hat", "shared"], action="append", help="Layout (repeatable; default both).")
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)  # Internal: run one case in this process
+    args = parser.parse_args()
+
+    if args.single:
+        run_one(args.layout[0], args.hats[0], args.memories, args.queries)
+        sys.exit(0)
+
+    rows = []
+    for hats in args.hats or [1000, 10000]:
+        for layout in args.layout or ["per_hat", "shared"]:
+            print(f"⏱️ {layout} layout, {hats} hats x {args.memories} memories...", flush=True)
+            out = subprocess.run(
+                [sys.executable, __file__, "--single", "--layout", layout, "--hats", str(hats),
+                 "--memories", str(args.memories), "--queries", str(args.queries)],
+                capture_output=True, text=True
+            )
+            lines = [line for line in out.stdout.splitlines() if line.startswith("{")]
+            if out.returncode != 0 or not lines:
+                print(f"❌ {layout}/{hats} failed:\n{out.stderr[-2000:]}")
+                continue
+            rows.append(json.loads(lines[-1]))
+
+    if rows:
+        columns = list(rows[0])
+        print("\n| " + " | ".join(columns) + " |")
+        print("|" + "---|" * len(columns))
+        for row in rows:
+            print("| " + " | ".join(str(row[c]) for c in columns) + " |")
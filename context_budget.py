@@ -0,0 +1,183 @@
+# context_budget.py
+import os
+import math
+
+# -----------------------------
+# Context-Window Budgeter
+# -----------------------------
+# Fits the sections of a prompt (instructions, relationships, memories, logs, ...) into a model's
+# context window. Tokens are counted with tiktoken when it is installed and estimated at about
+# four characters per token otherwise, which is close enough for budgeting.
+
+CONTEXT_WINDOW_DEFAULT = int(os.getenv("CONTEXT_WINDOW_DEFAULT", "8192"))
+CONTEXT_RESPONSE_TOKENS = int(os.getenv("CONTEXT_RESPONSE_TOKENS", "1000"))  # Reserved for the reply (the default max_tokens)
+CONTEXT_SAFETY_TOKENS = int(os.getenv("CONTEXT_SAFETY_TOKENS", "256"))      # Message framing + estimation error
+
+# Longest matching prefix wins; a hat can set "context_window" to override.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "llama3": 8192,
+    "llama3.1": 131072,
+    "mistral": 32768,
+}
+
+CHARS_PER_TOKEN = 4
+MIN_PARTIAL_ITEM_TOKENS = 32  # Smaller remainders aren't worth a truncated item
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _cut_marker(cut):
+    return f"\n…[{cut} tokens cut]…\n"
+
+
+def truncate_tokens(text, max_tokens, keep="head"):
+    """
+    Shortens `text` to about `max_tokens`. keep="head" keeps the start, "tail" the end,
+    "middle" the start and end around a marker saying how much was cut.
+    """
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    if _encoding is not None:
+        tokens = _encoding.encode(text, disallowed_special=())
+        piece = lambda start, end: _encoding.decode(tokens[start:end])
+    else:
+        piece = lambda start, end: text[start * CHARS_PER_TOKEN:None if end is None else end * CHARS_PER_TOKEN]
+        total = math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    if keep == "tail":
+        return piece(total - max_tokens, None)
+    if keep == "middle":
+        marker = _cut_marker(total - max_tokens)
+        kept = max(max_tokens - count_tokens(marker), 0)  # The marker counts against the allowance
+        head = kept // 2
+        return piece(0, head) + marker + piece(total - (kept - head), None)
+    return piece(0, max_tokens)
+
+
+def context_window(model, hat=None):
+    if hat and hat.get("context_window"):
+        return int(hat["context_window"])
+    matches = [name for name in MODEL_CONTEXT_WINDOWS if (model or "").startswith(name)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else CONTEXT_WINDOW_DEFAULT
+
+
+def prompt_budget(model, hat=None, response_tokens=CONTEXT_RESPONSE_TOKENS):
+    """Tokens available for the prompt: the model window minus the reply reservation and a safety margin."""
+    return max(context_window(model, hat) - response_tokens - CONTEXT_SAFETY_TOKENS, 0)
+
+
+def _allocate(demands, weights, budget):
+    """Water-filling: sections needing less than their weighted share keep it all and free the rest for others."""
+    allocation = {}
+    active = {name for name, demand in demands.items() if demand > 0}
+    allocation.update({name: 0 for name in demands if name not in active})
+    while active:
+        total_weight = sum(weights[name] for name in active)
+        shares = {name: budget * weights[name] / total_weight for name in active}
+        satisfied = {name for name in active if demands[name] <= shares[name]}
+        if not satisfied:
+            allocation.update({name: int(shares[name]) for name in active})
+            break
+        for name in satisfied:
+            allocation[name] = demands[name]
+            budget -= demands[name]
+        active -= satisfied
+    return allocation
+
+
+def _fit_items(items, budget, mode):
+    """
+    mode="drop": keeps items in order (most relevant first) while they fit, shortens the first one that
+      doesn't if a useful amount of space is left, and drops the rest.
+    mode="even": keeps every item, shortening the longest ones to an equal share (middle cut).
+    """
+    sizes = [count_tokens(item) + 1 for item in items]  # +1 for the separator
+    if mode == "drop":
+        kept, used = [], 0
+        for item, size in zip(items, sizes):
+            if used + size > budget:
+                if budget - used > MIN_PARTIAL_ITEM_TOKENS:
+                    kept.append(truncate_tokens(item, budget - used - 1))
+                break
+            kept.append(item)
+            used += size
+        return kept
+    allocation = _allocate(dict(enumerate(sizes)), {i: 1 for i in range(len(items))}, budget)
+    return [truncate_tokens(item, allocation[i] - 1, keep="middle") for i, item in enumerate(items)]
+
+
+def fit_sections(sections, budget):
+    """
+    Fits prompt sections into `budget` tokens. Each section is a dict with:
+    - "name"; "text" (a string) or "items" (a list, joined by the caller);
+    - "share": relative weight when space runs out (sections with no share are never cut);
+    - "keep" for text ("head", "tail", "middle") or "mode" for items ("drop", "even").
+    Returns ({name: text or items}, cuts) where cuts lists {"section", "tokens", "kept_tokens", "dropped_items"}
+    for every section that had to be shortened (empty when everything fit).
+    """
+    demands = {}
+    for section in sections:
+        if "items" in section:
+            demands[section["name"]] = sum(count_tokens(item) + 1 for item in section["items"])
+        else:
+            demands[section["name"]] = count_tokens(section.get("text") or "")
+
+    fitted = {section["name"]: section.get("items", section.get("text")) for section in sections}
+    if sum(demands.values()) <= budget:
+        return fitted, []
+
+    fixed = [section for section in sections if not section.get("share")]
+    flexible = [section for section in sections if section.get("share")]
+    remaining = max(budget - sum(demands[section["name"]] for section in fixed), 0)
+    allocation = _allocate(
+        {section["name"]: demands[section["name"]] for section in flexible},
+        {section["name"]: section["share"] for section in flexible},
+        remaining
+    )
+
+    cuts = []
+    for section in flexible:
+        name = section["name"]
+        if demands[name] <= allocation[name]:
+            continue
+        if "items" in section:
+            fitted[name] = _fit_items(section["items"], allocation[name], section.get("mode", "drop"))
+            kept_tokens = sum(count_tokens(item) + 1 for item in fitted[name])
+            dropped = len(section["items"]) - len(fitted[name])
+        else:
+            fitted[name] = truncate_tokens(section.get("text") or "", allocation[name], keep=section.get("keep", "head"))
+            kept_tokens = count_tokens(fitted[name])
+            dropped = 0
+        cuts.append({"section": name, "tokens": demands[name], "kept_tokens": kept_tokens, "dropped_items": dropped})
+    return fitted, cuts
+
+
+def describe_cuts(cuts):
+    """One-line summary of fit_sections' cuts, e.g. "memories 5200→1800 tokens (3 dropped); log 9000→4000 tokens"."""
+    return "; ".join(
+        f"{cut['section']} {cut['tokens']}→{cut['kept_tokens']} tokens"
+        + (f" ({cut['dropped_items']} dropped)" if cut["dropped_items"] else "")
+        for cut in cuts
+    )
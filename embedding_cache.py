@@ -0,0 +1,189 @@
+# embedding_cache.py
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# -----------------------------
+# Content-Hash Embedding Cache
+# -----------------------------
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+EMBEDDING_CACHE_MAX_MB = float(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_CACHE_MEMORY_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MEMORY_ENTRIES", "2048"))
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"  # What chromadb's DefaultEmbeddingFunction runs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key       TEXT PRIMARY KEY,
+    vector    BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used);
+"""
+
+
+def content_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding store keyed by content hash.
+    - A small in-process LRU sits in front of a SQLite file shared by every hat.
+    - The file is bounded by entry count and size; the least recently used rows are evicted first.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 max_bytes=int(EMBEDDING_CACHE_MAX_MB * 1024 * 1024), memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()  # key -> vector, least recently used first
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._count, self._bytes = self._totals()
+
+    def _totals(self):
+        count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()
+        return count, size
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                else:
+                    missing.append(key)
+
+            for start in range(0, len(missing), 500):  # Stay under SQLite's bound-parameter limit
+                chunk = missing[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs and evicts old rows if the cache grew past its bounds."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for key, vector in items:
+                vector = np.asarray(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes(), now))
+            if not rows:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                before = self._conn.total_changes
+                self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?)", rows)
+                inserted = self._conn.total_changes - before
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._count += inserted
+            self._bytes += inserted * (sum(len(blob) for _, blob, _ in rows) // len(rows))  # Approximate; evict() recounts
+            if self._count > self.max_entries or self._bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Drops least recently used rows until the cache is back under 90% of both bounds."""
+        with self._lock:
+            self._count, self._bytes = self._totals()  # Other processes may share the file
+            if self._count <= self.max_entries and self._bytes <= self.max_bytes:
+                return 0
+            average = self._bytes / max(self._count, 1)
+            target = min(int(self.max_entries * 0.9), int(self.max_bytes * 0.9 / max(average, 1)))
+            excess = self._count - target
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._memory.clear()
+            self._count, self._bytes = self._totals()
+            return excess
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddingFunction:
+    """
+    Wraps a Chroma embedding function so each distinct (model, text) is embedded once.
+    Misses from one call are embedded together in a single call to the wrapped function.
+    """
+
+    def __init__(self, base=None, cache=None, model=None):
+        self._base = base
+        self._cache = cache
+        self.model = model or getattr(base, "MODEL_NAME", None) or (type(base).__name__ if base else DEFAULT_EMBEDDING_MODEL)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def base(self):
+        if self._base is None:
+            from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+            self._base = DefaultEmbeddingFunction()
+        return self._base
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = EmbeddingCache()
+        return self._cache
+
+    def __call__(self, input):
+        texts = [input] if isinstance(input, str) else list(input)
+        keys = [content_key(self.model, text) for text in texts]
+        cached = self.cache.get_many(set(keys))
+
+        missing = {}  # key -> text, each distinct text embedded once
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+
+        if missing:
+            vectors = self.base(list(missing.values()))
+            fresh = list(zip(missing, vectors))
+            self.cache.put_many(fresh)
+            cached.update((key, np.asarray(vector, dtype=np.float32)) for key, vector in fresh)
+
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        return [cached[key] for key in keys]
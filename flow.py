@@ -1,9 +1,13 @@
 import datetime
 import re
+import asyncio
+import itertools
 import json
-from hat_manager import list_hats_by_team, add_memory_to_hat, load_hat, search_memory
+from hat_manager import list_hats_by_team, add_memory_to_hat, load_hat, search_memory, compile_system_prompt
 from prompts import generate_openai_response, generate_openai_response_with_system
 from utils import generate_unique_hat_id
+from context_budget import fit_sections, prompt_budget, truncate_tokens, count_tokens, describe_cuts
+from llm_scheduler import is_retryable
 
 import chainlit as cl
 import openai
@@ -13,115 +17,249 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-async def finalize_team_flow(conversation_log, mission_success, revision_required, goal_description, team_id):
-    log_text = "\n\n".join([
-        f"🧢 **{entry['hat_name']}**\n**Input:** {entry['input']}\n**Output:** {entry['output']}"
-        for entry in conversation_log
-    ])
-    await cl.Message(content=f"📜 **Full Team Conversation Log:**\n\n{log_text}").send()
-    await cl.Message(content="✅ **Team flow completed successfully!**").send()
+REFLECTION_CONCURRENCY = int(os.getenv("REFLECTION_CONCURRENCY", "4"))
+MISSIONS_DIR = "./missions"
+# "all": hats recall their whole history during a team run; "mission" (opt-in): only memories written in that mission.
+# Mission scoping hides memories from earlier runs, including a `retry` of the same goal (it gets a new mission_id).
+MISSION_MEMORY_SCOPE = os.getenv("MISSION_MEMORY_SCOPE", "all")
+MISSION_ANALYST_HAT = {"name": "Mission Analyst", "model": "gpt-3.5-turbo", "instructions": ""}
+# Each hat's input in the debrief log is capped first (critic inputs repeat whole outputs)
+DEBRIEF_LOG_INPUT_TOKENS = int(os.getenv("DEBRIEF_LOG_INPUT_TOKENS", "300"))
 
-    try:
-        # Calculate mission status
-        if mission_success and not revision_required:
-            mission_status = "🎖️ Mission Status: SUCCESS"
-        elif mission_success and revision_required:
-            mission_status = "⚠️ Mission Status: PARTIAL SUCCESS (after revisions)"
-        else:
-            mission_status = "❌ Mission Status: FAILED"
-
-        mission_debrief_prompt = (
-            f"{mission_status}\n\n"
-            f"You are an AI mission analyst.\n\n"
-            f"Based on the following team conversation log, generate a clear, professional mission debrief.\n\n"
-            f"Focus on:\n"
-            f"- Goal Achievement\n"
-            f"- Teamwork dynamics (Storyteller, Critic)\n"
-            f"- Any improvements or challenges encountered\n"
-            f"- Overall mission outcome.\n\n"
-            f"Here is the conversation log:\n\n"
-            f"{log_text}\n\n"
-            f"Respond in a formal but friendly tone. Keep it concise."
+
+def mission_memory_scope(mission_id):
+    """search_memory filters for a hat working on `mission_id` (None = unscoped)."""
+    return {"mission_id": mission_id} if mission_id and MISSION_MEMORY_SCOPE == "mission" else None
+
+
+def build_awards_text(conversation_log):
+    """MVP / runner-up announcement based on how often each hat contributed to the log."""
+    agent_contributions = {}
+    for entry in conversation_log:
+        hat_name = entry.get('hat_name', 'Unknown')
+        agent_contributions[hat_name] = agent_contributions.get(hat_name, 0) + 1
+
+    if not agent_contributions:
+        return None
+
+    mvp_agent = max(agent_contributions.items(), key=lambda x: x[1])[0]
+    awards_text = (
+        "🎉 **Agent Awards Ceremony** 🎉\n\n"
+        f"🏆 **MVP (Most Valuable Agent):** {mvp_agent}\n"
+    )
+    if len(agent_contributions) > 1:
+        sorted_agents = sorted(agent_contributions.items(), key=lambda x: x[1], reverse=True)
+        runner_up = sorted_agents[1][0]
+        awards_text += f"🥈 **Outstanding Contributor:** {runner_up}\n"
+
+    awards_text += "\n🎖️ Thanks to all agents for their teamwork!"
+    return awards_text
+
+
+def archive_mission(mission_record):
+    """Writes the complete mission record to missions/mission_<timestamp>.json and returns the path."""
+    if not os.path.exists(MISSIONS_DIR):
+        os.makedirs(MISSIONS_DIR)
+
+    filename = os.path.join(MISSIONS_DIR, f"mission_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(mission_record, f, indent=2, ensure_ascii=False)
+    return filename
+
+
+async def generate_reflections(team_hats, limit=REFLECTION_CONCURRENCY, memory_scope=None):
+    """Asks every hat for its reflection concurrently (at most `limit` in flight). Failed hats map to their exception."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def reflect(hat):
+        hat_name = hat.get('name', 'Unnamed Hat')
+        reflection_prompt = (
+            f"You are {hat_name}. The mission has completed.\n\n"
+            f"Write a short (1-2 sentences) personal reflection about your experience during this mission.\n"
+            f"Be professional but friendly. Highlight anything you enjoyed or found challenging."
         )
+        async with semaphore:
+            return await generate_openai_response(reflection_prompt, hat, memory_scope=memory_scope, priority="background")
+
+    return await asyncio.gather(*[reflect(hat) for hat in team_hats], return_exceptions=True)
+
+
+def format_log_entry(entry, input_tokens=None):
+    """One conversation log entry; `input_tokens` caps the (often long, prompt-like) input."""
+    hat_input = truncate_tokens(entry['input'], input_tokens, keep="middle") if input_tokens else entry['input']
+    return f"🧢 **{entry['hat_name']}**\n**Input:** {hat_input}\n**Output:** {entry['output']}"
+
+
+def build_debrief_prompt(mission_status, conversation_log, analyst_hat):
+    """
+    Mission debrief prompt with the conversation log fitted to the analyst's context window:
+    inputs are capped first, then every entry is shortened evenly. Returns (prompt, cuts).
+    """
+    header = (
+        f"{mission_status}\n\n"
+        f"You are an AI mission analyst.\n\n"
+        f"Based on the following team conversation log, generate a clear, professional mission debrief.\n\n"
+        f"Focus on:\n"
+        f"- Goal Achievement\n"
+        f"- Teamwork dynamics (Storyteller, Critic)\n"
+        f"- Any improvements or challenges encountered\n"
+        f"- Overall mission outcome.\n\n"
+        f"Here is the conversation log:\n\n"
+    )
+    footer = "\n\nRespond in a formal but friendly tone. Keep it concise."
+    fitted, cuts = fit_sections([
+        {"name": "instructions", "text": header + footer},
+        {"name": "log", "items": [format_log_entry(entry, DEBRIEF_LOG_INPUT_TOKENS) for entry in conversation_log], "share": 1, "mode": "even"},
+    ], prompt_budget(analyst_hat["model"], analyst_hat) - count_tokens(compile_system_prompt(analyst_hat)))
+    return header + "\n\n".join(fitted["log"]) + footer, cuts
 
-        debrief_summary = generate_openai_response(mission_debrief_prompt, hat={"name": "Mission Analyst", "model": "gpt-3.5-turbo", "instructions": ""})
-        await cl.Message(content=f"📜 **Mission Debrief:**\n\n{debrief_summary}").send()
 
-        # Awards Ceremony
-        try:
-            agent_contributions = {}
-            for entry in conversation_log:
-                hat_name = entry.get('hat_name', 'Unknown')
-                agent_contributions[hat_name] = agent_contributions.get(hat_name, 0) + 1
-
-            if agent_contributions:
-                mvp_agent = max(agent_contributions.items(), key=lambda x: x[1])[0]
-                awards_text = (
-                    "🎉 **Agent Awards Ceremony** 🎉\n\n"
-                    f"🏆 **MVP (Most Valuable Agent):** {mvp_agent}\n"
-                )
-                if len(agent_contributions) > 1:
-                    sorted_agents = sorted(agent_contributions.items(), key=lambda x: x[1], reverse=True)
-                    runner_up = sorted_agents[1][0]
-                    awards_text += f"🥈 **Outstanding Contributor:** {runner_up}\n"
+async def finalize_team_flow(conversation_log, mission_success, revision_required, goal_description, team_id):
+    log_text = "\n\n".join([format_log_entry(entry) for entry in conversation_log])
+    await cl.Message(content=f"📜 **Full Team Conversation Log:**\n\n{log_text}").send()
+    await cl.Message(content="✅ **Team flow completed successfully!**").send()
 
-                awards_text += "\n🎖️ Thanks to all agents for their teamwork!"
-                await cl.Message(content=awards_text).send()
-        except Exception as e:
-            await cl.Message(content=f"⚠️ Failed to generate Agent Awards: {e}").send()
+    # Calculate mission status
+    if mission_success and not revision_required:
+        mission_status = "🎖️ Mission Status: SUCCESS"
+    elif mission_success and revision_required:
+        mission_status = "⚠️ Mission Status: PARTIAL SUCCESS (after revisions)"
+    else:
+        mission_status = "❌ Mission Status: FAILED"
+
+    mission_debrief_prompt, debrief_cuts = build_debrief_prompt(mission_status, conversation_log, MISSION_ANALYST_HAT)
+    if debrief_cuts:
+        print(f"✂️ [context] Mission debrief: {describe_cuts(debrief_cuts)}")
 
-    except Exception as e:
-        await cl.Message(content=f"⚠️ Failed to generate Mission Debrief: {e}").send()
     cl.user_session.set("pending_conversation_log", None)
     cl.user_session.set("pending_mission_success", None)
     cl.user_session.set("pending_revision_required", None)
     cl.user_session.set("pending_goal_description", None)
-    # 🎤 Final Agent Reflections
+    team_id = team_id or cl.user_session.get("pending_team_id")
+    team_hats = list_hats_by_team(team_id)  # Re-load team hats
+    mission_id = cl.user_session.get("mission_id")
+
+    # Debrief (streamed) and every hat's reflection are generated at the same time
+    debrief_header = "📜 **Mission Debrief:**\n\n"
+    debrief_msg = cl.Message(content=debrief_header)
+    debrief_result, reflection_results = await asyncio.gather(
+        generate_openai_response(mission_debrief_prompt, hat=MISSION_ANALYST_HAT, stream_to=debrief_msg, priority="background"),
+        generate_reflections(team_hats, memory_scope=mission_memory_scope(mission_id)),
+        return_exceptions=True
+    )
+
+    debrief_summary = None
+    if isinstance(debrief_result, Exception):
+        if debrief_msg.content != debrief_header:  # Drop the partly streamed debrief
+            await debrief_msg.remove()
+        await cl.Message(content=f"⚠️ Failed to generate Mission Debrief: {debrief_result}").send()
+    else:
+        debrief_summary = debrief_result
+        await debrief_msg.send()
+
+    # Awards Ceremony
     try:
+        awards_text = build_awards_text(conversation_log)
+        if awards_text:
+            await cl.Message(content=awards_text).send()
+    except Exception as e:
+        await cl.Message(content=f"⚠️ Failed to generate Agent Awards: {e}").send()
+
+    # 🎤 Final Agent Reflections
+    agent_reflections = {}
+    if isinstance(reflection_results, Exception):
+        await cl.Message(content=f"⚠️ Failed to generate agent reflections: {reflection_results}").send()
+    else:
         await cl.Message(content="🎤 **Final Agent Reflections:**").send()
-        team_id = cl.user_session.get("pending_team_id")
-        
-        agent_reflections = {}
-        team_hats = list_hats_by_team(team_id)  # Re-load team hats
-        for hat in team_hats:
+        for hat, reflection_response in zip(team_hats, reflection_results):
             hat_name = hat.get('name', 'Unnamed Hat')
-
-            reflection_prompt = (
-                f"You are {hat_name}. The mission has completed.\n\n"
-                f"Write a short (1-2 sentences) personal reflection about your experience during this mission.\n"
-                f"Be professional but friendly. Highlight anything you enjoyed or found challenging."
-            )
-
-            reflection_response = generate_openai_response(reflection_prompt, hat)
+            if isinstance(reflection_response, Exception):
+                await cl.Message(content=f"⚠️ {hat_name} could not reflect: {reflection_response}").send()
+                continue
             agent_reflections[hat_name] = reflection_response  # 🧠 Save reflection
-            try:
-                mission_record = {
-                    "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    "goal_description": goal_description,
-                    "mission_status": mission_status,
-                    "conversation_log": conversation_log,
-                    "debrief_summary": debrief_summary,
-                    "agent_reflections": agent_reflections
-                }
-
-                MISSIONS_DIR = "./missions"
-                if not os.path.exists(MISSIONS_DIR):
-                    os.makedirs(MISSIONS_DIR)
-
-                filename = os.path.join(MISSIONS_DIR, f"mission_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.json")
-
-                with open(filename, "w", encoding="utf-8") as f:
-                    json.dump(mission_record, f, indent=2, ensure_ascii=False)
-
-                await cl.Message(content=f"🗂️ Mission archived successfully to `{filename}`.").send()
-
-            except Exception as e:
-                await cl.Message(content=f"⚠️ Failed to archive mission: {e}").send()
-
             await cl.Message(content=f"🧢 **{hat_name}**: {reflection_response}").send()
 
+    # Archive the mission once, with every reflection
+    try:
+        mission_record = {
+            "mission_id": mission_id,
+            "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "goal_description": goal_description,
+            "mission_status": mission_status,
+            "conversation_log": conversation_log,
+            "debrief_summary": debrief_summary,
+            "debrief_context_cuts": debrief_cuts,
+            "agent_reflections": agent_reflections
+        }
+        filename = await cl.make_async(archive_mission)(mission_record)
+        await cl.Message(content=f"🗂️ Mission archived successfully to `{filename}`.").send()
     except Exception as e:
-        await cl.Message(content=f"⚠️ Failed to generate agent reflections: {e}").send()
+        await cl.Message(content=f"⚠️ Failed to archive mission: {e}").send()
+
+
+HAT_CALL_ATTEMPTS = int(os.getenv("HAT_CALL_ATTEMPTS", "2"))
+
+
+def build_flow_stages(team_hats):
+    """
+    Groups flow-ordered hats into stages.
+    - Non-critic hats sharing a flow_order form one stage (ordered by hat_id).
+    - Critics always get a stage of their own, after the hats of their flow_order.
+    """
+    stages = []
+    for _, group in itertools.groupby(team_hats, key=lambda h: h.get("flow_order") or 0):
+        group = list(group)
+        workers = sorted([h for h in group if h.get("role") != "critic"], key=lambda h: h.get("hat_id", ""))
+        if workers:
+            stages.append(workers)
+        stages.extend([critic] for critic in group if critic.get("role") == "critic")
+    return stages
+
+
+async def generate_with_retries(prompt, hat, attempts=HAT_CALL_ATTEMPTS, memory_scope=None):
+    """
+    Runs one hat, streaming its reply into its own chat message.
+    - The LLM scheduler already retries transient errors, except once tokens have been streamed; only
+      such a broken stream is retried here, after removing the partial message.
+    - Any other error (or the last attempt's) is raised.
+    """
+    header = f"🧢 **{hat.get('name', 'Unnamed Hat')}** responded:\n"
+    for attempt in range(attempts):
+        msg = cl.Message(content=header)
+        try:
+            response_text = await generate_openai_response(prompt, hat, stream_to=msg, memory_scope=memory_scope)
+            await msg.send()
+            return response_text
+        except Exception as e:
+            print(f"⚠️ `{hat.get('hat_id')}` attempt {attempt + 1}/{attempts} failed: {e}")
+            streamed = msg.content != header
+            if streamed:
+                await msg.remove()
+            if not (streamed and is_retryable(e)) or attempt + 1 == attempts:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+
+async def run_flow_stage(stage, stage_input, memory_scope=None):
+    """Runs (and streams) every hat of a stage concurrently. Returns hat_id -> response text (or the exception it raised)."""
+    results = await asyncio.gather(
+        *[generate_with_retries(stage_input, hat, memory_scope=memory_scope) for hat in stage],
+        return_exceptions=True
+    )
+    return {hat.get("hat_id"): result for hat, result in zip(stage, results)}
+
+
+def merge_stage_outputs(stage_outputs):
+    """
+    Deterministic merge of a stage's (hat, response) pairs into the next stage's input.
+    A single response passes through unchanged; several are concatenated in stage order under each hat's name.
+    """
+    if len(stage_outputs) == 1:
+        return stage_outputs[0][1]
+    return "\n\n".join(
+        f"## {hat.get('name', hat.get('hat_id'))}\n{response_text}"
+        for hat, response_text in stage_outputs
+    )
 
 
 async def run_team_flow(team_id, goal_description):
@@ -140,116 +278,142 @@ async def run_team_flow(team_id, goal_description):
         if hat.get("role") == "critic" and not hat.get("flow_order"):
             print(f"⚠️ QA-only critic `{hat['hat_id']}` will be excluded from flow.")
 
-    team_hats = sorted(team_hats, key=lambda h: h.get("flow_order", 0))
+    team_hats = sorted(team_hats, key=lambda h: h.get("flow_order") or 0)
 
     current_input = goal_description
     conversation_log = []
     retry_counts = {}
+    # Memories written during this run carry the mission ID, so retrieval can be scoped to it
+    mission_id = f"{team_id}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+    cl.user_session.set("mission_id", mission_id)
+    memory_scope = mission_memory_scope(mission_id)
     await cl.Message(
     content=f"🎯 **Mission Briefing:**\n\n> {goal_description}\n\n🧠 Deploying team agents to complete the mission..."
 ).send()
 
-    for hat in team_hats:
-        hat_name = hat.get("name", "Unnamed Hat")
-        hat_id = hat.get("hat_id")
-        qa_loop = hat.get("qa_loop", False)
-        retry_limit = hat.get("retry_limit", 0)
-
-        # --- Run the hat's response ---
-        if hat.get('role') == 'critic':
-            critic_input = (
-                f"## Goal\n"
-                f"{goal_description}\n\n"
-                f"## Critic Review Target\n"
-                f"{current_input}\n\n"
-                f"## Instructions\n"
-                "First, rate the output across three categories from 1 to 10:\n"
-                "- 🎯 Goal Coverage\n"
-                "- 🧹 Language Clarity\n"
-                "- 💡 Creativity\n\n"
-                "Format your scores like this:\n"
-                "Goal Coverage: X/10\nLanguage Clarity: Y/10\nCreativity: Z/10\n\n"
-                "Then, briefly summarize if and how the output satisfies the goal.\n"
-                "Finally, respond with one of these tags at the start of a new paragraph:\n"
-                "- #APPROVED (excellent overall)\n"
-                "- #REVISION_REQUIRED (minor improvements needed)\n"
-                "- #REJECTED (major issues).\n\n"
-                "Be strict: Only approve if Goal Coverage is 9/10 or higher, and other categories are reasonably strong (8+/10). Otherwise, request revision."
-                "--- End of Instructions ---\n\n"
-                "🧑‍⚖️ Critic Output:"
-            )
-            response_text = generate_openai_response(critic_input, hat)
-            await cl.Message(content=f"🧢 **{hat_name}** reviewed:\n{response_text}").send()#comment out if you want to remove critic response
-            conversation_log.append({ #logs critic response
+    for stage in build_flow_stages(team_hats):
+        # Hats sharing a flow_order run concurrently; critics always run on their own
+        stage_responses = {}
+        if stage[0].get('role') != 'critic':
+            stage_responses = await run_flow_stage(stage, current_input, memory_scope)
+        stage_outputs = []
+        log_positions = {}
+
+        for hat in stage:
+            hat_name = hat.get("name", "Unnamed Hat")
+            hat_id = hat.get("hat_id")
+
+            # --- Run the hat's response ---
+            if hat.get('role') == 'critic':
+                critic_input = (
+                    f"## Goal\n"
+                    f"{goal_description}\n\n"
+                    f"## Critic Review Target\n"
+                    f"{current_input}\n\n"
+                    f"## Instructions\n"
+                    "First, rate the output across three categories from 1 to 10:\n"
+                    "- 🎯 Goal Coverage\n"
+                    "- 🧹 Language Clarity\n"
+                    "- 💡 Creativity\n\n"
+                    "Format your scores like this:\n"
+                    "Goal Coverage: X/10\nLanguage Clarity: Y/10\nCreativity: Z/10\n\n"
+                    "Then, briefly summarize if and how the output satisfies the goal.\n"
+                    "Finally, respond with one of these tags at the start of a new paragraph:\n"
+                    "- #APPROVED (excellent overall)\n"
+                    "- #REVISION_REQUIRED (minor improvements needed)\n"
+                    "- #REJECTED (major issues).\n\n"
+                    "Be strict: Only approve if Goal Coverage is 9/10 or higher, and other categories are reasonably strong (8+/10). Otherwise, request revision."
+                    "--- End of Instructions ---\n\n"
+                    "🧑‍⚖️ Critic Output:"
+                )
+                review_msg = cl.Message(content=f"🧢 **{hat_name}** reviewed:\n")
+                response_text = await generate_openai_response(critic_input, hat, stream_to=review_msg, memory_scope=memory_scope)
+                await review_msg.send()#comment out if you want to remove critic response
+                conversation_log.append({ #logs critic response
+                    "hat_name": hat_name,
+                    "hat_id": hat_id,
+                    "input": critic_input,
+                    "output": response_text
+                })
+                if "#APPROVED" in response_text:
+                    mission_success = True
+                    await cl.Message(content="✅ Critic approved!").send()
+                    await cl.Message(content="🧑‍⚖️ Approve or Retry? Type `approve` or `retry`.").send()
+                    cl.user_session.set("awaiting_user_approval", True)
+                    cl.user_session.set("pending_critique_input", current_input)
+                    cl.user_session.set("pending_team_id", team_id)
+                    cl.user_session.set("pending_conversation_log", conversation_log)
+                    cl.user_session.set("pending_mission_success", mission_success)
+                    cl.user_session.set("pending_revision_required", revision_required)
+                    cl.user_session.set("pending_goal_description", goal_description)
+                    return  # ⛔ Pause flow for user decision
+                elif "#REVISION_REQUIRED" in response_text:
+                    revision_required = True
+                    await cl.Message(content="🔁 Final Critic requested revision. Awaiting your decision.").send()
+                    await cl.Message(content="🧑‍⚖️ Approve or Retry? Type `approve` or `retry`.").send()
+                    cl.user_session.set("awaiting_user_approval", True)
+                    cl.user_session.set("pending_critique_input", current_input)
+                    cl.user_session.set("pending_team_id", team_id)
+                    cl.user_session.set("pending_conversation_log", conversation_log)
+                    cl.user_session.set("pending_mission_success", mission_success)
+                    cl.user_session.set("pending_revision_required", revision_required)
+                    cl.user_session.set("pending_goal_description", goal_description)
+                    return
+                else:
+                    await cl.Message(content="⚠️ Final Critic did not tag properly. No user input prompted.").send()
+                        
+            else:
+                response_text = stage_responses[hat_id]
+                if isinstance(response_text, Exception):
+                    await cl.Message(content=f"⚠️ **{hat_name}** failed after retries: {response_text}").send()
+                    continue
+
+            # Save memory (input and output separately)
+            add_memory_to_hat(hat_id, current_input, role="user", mission_id=mission_id)
+            add_memory_to_hat(hat_id, response_text, role="bot", mission_id=mission_id)
+
+            # Show the response in the chat (stage hats were already streamed)
+            if hat_id not in stage_responses:
+                await cl.Message(content=f"🧢 **{hat_name}** responded:\n{response_text}").send()
+
+            # Log the conversation
+            conversation_log.append({
                 "hat_name": hat_name,
                 "hat_id": hat_id,
-                "input": critic_input,
+                "input": current_input,
                 "output": response_text
             })
-            if "#APPROVED" in response_text:
-                mission_success = True
-                await cl.Message(content="✅ Critic approved!").send()
-                await cl.Message(content="🧑‍⚖️ Approve or Retry? Type `approve` or `retry`.").send()
-                cl.user_session.set("awaiting_user_approval", True)
-                cl.user_session.set("pending_critique_input", current_input)
-                cl.user_session.set("pending_team_id", team_id)
-                cl.user_session.set("pending_conversation_log", conversation_log)
-                cl.user_session.set("pending_mission_success", mission_success)
-                cl.user_session.set("pending_revision_required", revision_required)
-                cl.user_session.set("pending_goal_description", goal_description)
-                return  # ⛔ Pause flow for user decision
-            elif "#REVISION_REQUIRED" in response_text:
-                revision_required = True
-                await cl.Message(content="🔁 Final Critic requested revision. Awaiting your decision.").send()
-                await cl.Message(content="🧑‍⚖️ Approve or Retry? Type `approve` or `retry`.").send()
-                cl.user_session.set("awaiting_user_approval", True)
-                cl.user_session.set("pending_critique_input", current_input)
-                cl.user_session.set("pending_team_id", team_id)
-                cl.user_session.set("pending_conversation_log", conversation_log)
-                cl.user_session.set("pending_mission_success", mission_success)
-                cl.user_session.set("pending_revision_required", revision_required)
-                cl.user_session.set("pending_goal_description", goal_description)
-                return
-            else:
-                await cl.Message(content="⚠️ Final Critic did not tag properly. No user input prompted.").send()
-                        
-        else:
-            response_text = generate_openai_response(current_input, hat)
-
-        # Save memory (input and output separately)
-        add_memory_to_hat(hat_id, current_input, role="user")
-        add_memory_to_hat(hat_id, response_text, role="bot")
-
-        # Show the response in the chat
-        await cl.Message(content=f"🧢 **{hat_name}** responded:\n{response_text}").send()
-
-        # Log the conversation
-        conversation_log.append({
-            "hat_name": hat_name,
-            "hat_id": hat_id,
-            "input": current_input,
-            "output": response_text
-        })
-
-        # Handle QA loop if enabled
-        # If the current hat has QA enabled, run critic
-        if hat.get("qa_loop", False) and hat.get("critics"):
+
+            log_positions[hat_id] = len(conversation_log) - 1
+            stage_outputs.append((hat, response_text))
+
+        if not stage_outputs:
+            await cl.Message(content="❌ Every Hat in this stage failed. Stopping the mission.").send()
+            return
+        stage_output = merge_stage_outputs(stage_outputs)
+
+        # QA critics run once every hat of the stage is logged and remembered
+        for hat, response_text in stage_outputs:
+            hat_name = hat.get("name", "Unnamed Hat")
+            hat_id = hat.get("hat_id")
+            if not (hat.get("qa_loop", False) and hat.get("critics")):
+                continue
             critic_id = hat["critics"][0]
             critic_hat = load_hat(critic_id)
 
             critic_input = response_text
-            critic_response = generate_openai_response(critic_input, critic_hat)
-
-            await cl.Message(content=f"🧑‍⚖️ **Critic `{critic_id}` reviewing `{hat_name}` output:**\n{critic_response}").send()
+            critic_msg = cl.Message(content=f"🧑‍⚖️ **Critic `{critic_id}` reviewing `{hat_name}` output:**\n")
+            critic_response = await generate_openai_response(critic_input, critic_hat, stream_to=critic_msg, memory_scope=memory_scope)
+            await critic_msg.send()
 
-            add_memory_to_hat(critic_id, critic_input, role="user")
-            add_memory_to_hat(critic_id, critic_response, role="bot")
+            add_memory_to_hat(critic_id, critic_input, role="user", mission_id=mission_id)
+            add_memory_to_hat(critic_id, critic_response, role="bot", mission_id=mission_id)
             if "#APPROVED" in critic_response:
                 mission_success = True
                 await cl.Message(content="✅ Critic approved!").send()
                 await cl.Message(content="🧑‍⚖️ Approve or Retry? Type `approve` or `retry`.").send()
                 cl.user_session.set("awaiting_user_approval", True)
-                cl.user_session.set("pending_critique_input", response_text)
+                cl.user_session.set("pending_critique_input", stage_output)
                 cl.user_session.set("pending_team_id", team_id)
                 cl.user_session.set("pending_conversation_log", conversation_log)
                 cl.user_session.set("pending_mission_success", mission_success)
@@ -259,8 +423,9 @@ async def run_team_flow(team_id, goal_description):
             elif "#REVISION_REQUIRED" in critic_response:
                 revision_required = True
                 await cl.Message(content="🔁 Critic requested revision. Retrying...").send()
+                # The QA loop treats the last log entry as the reviewed output, as when hats ran one at a time
                 handled = await handle_qa_loop(
-                    hat, team_hats, conversation_log, retry_counts, retry_limit, team_id
+                    hat, team_hats, conversation_log[:log_positions[hat_id] + 1], retry_counts, hat.get("retry_limit", 0), team_id
                 )
                 if handled:
                     cl.user_session.set("pending_conversation_log", conversation_log)
@@ -272,12 +437,12 @@ async def run_team_flow(team_id, goal_description):
             else:
                 await cl.Message(content="⚠️ Critic did not tag properly. Manual review required.").send()
                 cl.user_session.set("awaiting_user_approval", True)
-                cl.user_session.set("pending_critique_input", response_text)
+                cl.user_session.set("pending_critique_input", stage_output)
                 cl.user_session.set("pending_team_id", team_id)
                 return
 
-        # Pass the output to the next hat
-        current_input = response_text
+        # Pass the merged output to the next stage
+        current_input = stage_output
 
 
     await cl.Message(content="✅ **Team flow completed successfully!**").send()
@@ -292,6 +457,7 @@ async def run_team_flow(team_id, goal_description):
 
 async def handle_qa_loop(hat, team_hats, conversation_log, retry_counts, retry_limit, team_id):
     response_text = conversation_log[-1]['output']
+    mission_id = cl.user_session.get("mission_id")
 
     if "#REVISION_REQUIRED" in response_text:
         revision_required = True
@@ -313,29 +479,31 @@ async def handle_qa_loop(hat, team_hats, conversation_log, retry_counts, retry_l
                 )
 
                 # Generate new response using improved input
+                retry_msg = cl.Message(content=f"🧢 {prev_hat['name']} retry responded:\n")
                 retry_response = await generate_openai_response_with_system(
                     user_prompt=retry_target['input'],
                     system_prompt=f"Revision guidance: {response_text}",
-                    hat=prev_hat
+                    hat=prev_hat,
+                    stream_to=retry_msg
                 )
-                
+                await retry_msg.send()
+
                 await cl.Message(content="🧠 **This was an improved attempt based on Critic feedback.**\n\nLet's see if it passes review this time!").send()
                 prev_hat_tags = prev_hat.get('memory_tags', [])
-                add_memory_to_hat(prev_hat['hat_id'], improved_input, role="user", tags=prev_hat_tags, session=cl.user_session)
-                add_memory_to_hat(prev_hat['hat_id'], retry_response, role="bot", tags=prev_hat_tags, session=cl.user_session)
-                
-                await cl.Message(content=f"🧢 {prev_hat['name']} retry responded:\n{retry_response}").send()
+                add_memory_to_hat(prev_hat['hat_id'], improved_input, role="user", tags=prev_hat_tags, session=cl.user_session, mission_id=mission_id)
+                add_memory_to_hat(prev_hat['hat_id'], retry_response, role="bot", tags=prev_hat_tags, session=cl.user_session, mission_id=mission_id)
+
 
                 # Critic re-reviews the new retry
                 critic_id = hat["critics"][0]
                 critic_hat = load_hat(critic_id)
-                critic_response = generate_openai_response(retry_response, critic_hat)
+                review_msg = cl.Message(content=f"🧢 {hat['name']} re-reviewed:\n")
+                critic_response = await generate_openai_response(retry_response, critic_hat, stream_to=review_msg, memory_scope=mission_memory_scope(mission_id))
+                await review_msg.send()
 
                 qa_tags = hat.get('memory_tags', [])
-                add_memory_to_hat(hat['hat_id'], retry_response, role="user", tags=qa_tags, session=cl.user_session)
-                add_memory_to_hat(hat['hat_id'], critic_response, role="bot", tags=qa_tags, session=cl.user_session)
-
-                await cl.Message(content=f"🧢 {hat['name']} re-reviewed:\n{critic_response}").send()
+                add_memory_to_hat(hat['hat_id'], retry_response, role="user", tags=qa_tags, session=cl.user_session, mission_id=mission_id)
+                add_memory_to_hat(hat['hat_id'], critic_response, role="bot", tags=qa_tags, session=cl.user_session, mission_id=mission_id)
 
                 if "#APPROVED" in critic_response:
                     mission_success = True
@@ -1,12 +1,29 @@
-import os, json, requests, re
-import chromadb
-from chromadb.config import Settings
+import os, json, re
+import copy
+import hashlib
+import uuid
+import tempfile
+import threading
+import time
+import atexit
 import datetime
+from collections import OrderedDict
 
-import chainlit as cl
+from dotenv import load_dotenv
+
+from memory_queue import MemoryWriteQueue
+from embedding_cache import CachedEmbeddingFunction
+from keyword_index import KeywordIndex
+import llm_cache
+from ollama_client import get_ollama_client
+from memory_layout import (
+    LAYOUTS, PER_HAT, HatCollection, partition_collection_name, is_partition_collection, scope_where, strip_partition_keys
+)
 
 import json
 
+load_dotenv()
+
 # -----------------------------
 # Unified LLM Prompt Handlers
 # -----------------------------
@@ -34,6 +51,75 @@ Expected JSON format:
   "description": "Summarizes text into concise points."
 }"""
 
+# Hat system prompts: everything but the per-call memory context depends only on the hat and the hats
+# it can @mention, so it is compiled once per hat and rebuilt when the hat or a related hat changes.
+SYSTEM_PROMPT_CACHE_SIZE = int(os.getenv("SYSTEM_PROMPT_CACHE_SIZE", "256"))
+SYSTEM_PROMPT_FIELDS = ("name", "role", "tools", "instructions", "relationships")
+
+_system_prompt_cache = OrderedDict()  # hat_id -> (signature, (instructions, relationships)), least recently used first
+_system_prompt_lock = threading.Lock()
+
+def _build_system_prompt(hat, relationships):
+    hat_name = hat.get('name', 'Unnamed Agent')
+    tools = ", ".join(hat.get('tools', [])) or "none"
+    instructions = hat.get('instructions', '')
+    role = hat.get('role', 'agent')
+
+    relationship_context = ""
+    if relationships:
+        info = []
+        for rel in relationships:
+            try:
+                h = load_hat(rel)
+                info.append(
+                    f"- To call this helper, include `@{rel}` in your reply.\n"
+                    f"  • @{rel} = {h.get('name')}: {h.get('description', '...')} (Tools: {', '.join(h.get('tools', [])) or 'none'})"
+                )
+            except Exception:
+                info.append(f"- @{rel}: (Details not found)")
+        relationship_context = (
+            "\n\nYou can collaborate with the following agents by @mentioning their ID in your response:\n"
+            + "\n".join(info)
+        )
+
+    base = f"""
+You are a {role} agent named '{hat_name}'.
+Your tools: {tools}.
+Instructions: {instructions}.
+""".strip()
+    return base, relationship_context
+
+def compile_system_prompt(hat):
+    """A hat's system prompt without memory context (see compile_system_prompt_parts)."""
+    return "".join(compile_system_prompt_parts(hat))
+
+def compile_system_prompt_parts(hat):
+    """
+    (instructions, relationships) parts of a hat's system prompt, kept apart so they can be budgeted.
+    Cached per hat_id and keyed on the hat's prompt fields plus the stored versions of its related hats,
+    so edits to any of them rebuild it on the next call.
+    """
+    relationships = hat.get("relationships") or []
+    signature = (
+        json.dumps({field: hat.get(field) for field in SYSTEM_PROMPT_FIELDS}, sort_keys=True, default=str),
+        tuple(hat_stamps(relationships).items()) if relationships else ()
+    )
+    hat_id = hat.get("hat_id")
+    with _system_prompt_lock:
+        cached = _system_prompt_cache.get(hat_id)
+        if cached is not None and cached[0] == signature:
+            _system_prompt_cache.move_to_end(hat_id)
+            return cached[1]
+
+    parts = _build_system_prompt(hat, relationships)
+    if hat_id and SYSTEM_PROMPT_CACHE_SIZE > 0:
+        with _system_prompt_lock:
+            _system_prompt_cache[hat_id] = (signature, parts)
+            _system_prompt_cache.move_to_end(hat_id)
+            while len(_system_prompt_cache) > SYSTEM_PROMPT_CACHE_SIZE:
+                _system_prompt_cache.popitem(last=False)
+    return parts
+
 def normalize_hat(hat: dict, team_id: str = None, flow_order: int = None) -> dict:
     """
     Standardizes a Hat structure:
@@ -51,6 +137,8 @@ def normalize_hat(hat: dict, team_id: str = None, flow_order: int = None) -> dic
 
     # Update hat_id with team_id if applicable
     if team_id:
+        if hat.get("team_id") != team_id:
+            hat.pop("memory_team_id", None)  # A copy for another team gets its own memory partition
         hat["hat_id"] = f"{base_hat_id}_{team_id}"
         hat["team_id"] = team_id
     # Enforce non-empty model
@@ -80,15 +168,358 @@ def normalize_hat(hat: dict, team_id: str = None, flow_order: int = None) -> dic
 
     return hat
 
-# Persistent ChromaDB client setup
-chroma_client = chromadb.PersistentClient(path="./chromadb_data")
+# --- ChromaDB Client & Collection Handles ---
+
+CHROMA_PATH = os.getenv("CHROMA_PATH", "./chromadb_data")
+CHROMA_COLLECTION_CACHE_SIZE = int(os.getenv("CHROMA_COLLECTION_CACHE_SIZE", "128"))
+MEMORY_LAYOUT = os.getenv("MEMORY_LAYOUT", PER_HAT)  # "per_hat", "shared" or "per_team" (see memory_layout.py)
+
+_chroma_client = None
+_chroma_lock = threading.RLock()
+_collection_cache = OrderedDict()  # hat_id -> collection handle, least recently used first
+_partition_collections = {}        # collection name -> handle of a shared / per-team collection
+
+def get_chroma_client():
+    """Creates the persistent ChromaDB client on first use (importing chromadb is deferred too)."""
+    global _chroma_client
+    with _chroma_lock:
+        if _chroma_client is None:
+            import chromadb
+            _chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
+        return _chroma_client
+
+def set_chroma_client(client):
+    """Swaps the ChromaDB client (e.g. chromadb.EphemeralClient() in tests) and drops cached handles."""
+    global _chroma_client
+    with _chroma_lock:
+        _chroma_client = client
+        _collection_cache.clear()
+        _partition_collections.clear()
+
+def set_memory_layout(layout):
+    """Switches the memory layout for this process (e.g. in tests or after migrate_memory_layout)."""
+    global MEMORY_LAYOUT
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown memory layout: {layout} (expected one of {', '.join(LAYOUTS)})")
+    with _chroma_lock:
+        MEMORY_LAYOUT = layout
+        _collection_cache.clear()
+        _partition_collections.clear()
+
+def forget_collection(hat_id=None):
+    """Invalidates the cached handle for one hat (or all hats)."""
+    with _chroma_lock:
+        if hat_id is None:
+            _collection_cache.clear()
+            _partition_collections.clear()
+        else:
+            _collection_cache.pop(hat_id, None)
+
+# --- Embeddings ---
+# Memories and queries are embedded here and handed to Chroma as vectors, so every hat shares
+# one content-hash cache. (Chroma re-attaches a collection's persisted embedding function and
+# ignores the one passed to get_or_create_collection, so the wrapper can't live on the collection.)
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "true").lower() in ("1", "true", "yes")
+
+_embedding_function = None
+
+def get_embedding_function():
+    global _embedding_function
+    with _chroma_lock:
+        if _embedding_function is None:
+            if EMBEDDING_CACHE:
+                _embedding_function = CachedEmbeddingFunction()
+            else:
+                from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+                _embedding_function = DefaultEmbeddingFunction()
+        return _embedding_function
+
+def set_embedding_function(embedding_function):
+    """Swaps the embedding function (e.g. a deterministic one in tests)."""
+    global _embedding_function
+    with _chroma_lock:
+        _embedding_function = embedding_function
+
+def embed_texts(texts):
+    return get_embedding_function()(list(texts))
+
+# --- Keyword Index ---
+# BM25 index kept next to the vector store by every memory write path below. Hats whose
+# collections predate the index are backfilled the first time they are searched.
+_keyword_index = None
+_keyword_indexed = set()  # hat_ids checked against their collection in this process
+
+def get_keyword_index():
+    global _keyword_index
+    with _chroma_lock:
+        if _keyword_index is None:
+            _keyword_index = KeywordIndex()
+        return _keyword_index
+
+def set_keyword_index(index):
+    """Swaps the keyword index (e.g. KeywordIndex(":memory:") in tests)."""
+    global _keyword_index
+    with _chroma_lock:
+        _keyword_index = index
+        _keyword_indexed.clear()
+
+def ensure_keyword_index(hat_id, page_size=1000):
+    """Rebuilds a hat's keyword index from its collection if the two disagree on the number of memories."""
+    if hat_id in _keyword_indexed:
+        return
+    index = get_keyword_index()
+    collection = get_vector_db_for_hat(hat_id)
+    if index.count(hat_id) != collection.count():
+        index.clear(hat_id)
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                break
+            index.upsert(hat_id, zip(page["ids"], page["documents"], page["metadatas"]))
+            offset += len(page["ids"])
+    _keyword_indexed.add(hat_id)
 
 # --- Memory Functions ---
 
-def get_vector_db_for_hat(hat_id):
-    return chroma_client.get_or_create_collection(hat_id)
+def _hat_team_id(hat_id):
+    """
+    Team whose partition holds a hat's memories in the "shared" / "per_team" layouts.
+    - Pinned in the hat record (`memory_team_id`) the first time its memories are opened, so moving
+      the hat to another team doesn't strand them.
+    - Ad-hoc IDs (e.g. the mission analyst) have no hat file and use the team-less partition.
+    """
+    try:
+        hat = load_hat(hat_id)
+    except FileNotFoundError:
+        return None
+    if "memory_team_id" not in hat:
+        hat["memory_team_id"] = hat.get("team_id")
+        save_hat(hat_id, hat)
+    return hat["memory_team_id"]
+
+def _partition_collection(name):
+    collection = _partition_collections.get(name)
+    if collection is None:
+        collection = _partition_collections[name] = get_chroma_client().get_or_create_collection(name)
+    return collection
 
-def add_memory_to_hat(hat_id, memory_text, role="user", tags=None, session=None):
+def get_vector_db_for_hat(hat_id, layout=None):
+    """
+    A hat's memory collection. In the "shared" and "per_team" layouts this is a HatCollection view
+    over the collection it shares with other hats; callers use both the same way.
+    """
+    layout = layout or MEMORY_LAYOUT
+    with _chroma_lock:
+        if layout == MEMORY_LAYOUT:
+            collection = _collection_cache.get(hat_id)
+            if collection is not None:
+                _collection_cache.move_to_end(hat_id)
+                return collection
+
+    team_id = _hat_team_id(hat_id) if layout != PER_HAT else None  # May write the hat record, so outside the lock
+    with _chroma_lock:
+        if layout == PER_HAT:
+            collection = get_chroma_client().get_or_create_collection(hat_id)
+        else:
+            collection = HatCollection(_partition_collection(partition_collection_name(layout, team_id)), hat_id, team_id)
+        if layout == MEMORY_LAYOUT:
+            _collection_cache[hat_id] = collection
+            while len(_collection_cache) > CHROMA_COLLECTION_CACHE_SIZE:
+                _collection_cache.popitem(last=False)
+        return collection
+
+def memory_hat_ids(layout=None):
+    """
+    IDs of every hat with stored memories (for jobs that sweep all hats).
+    In the partitioned layouts these are the hats with a pinned memory partition plus any ad-hoc IDs in the
+    keyword index, so no collection is scanned; a listed hat may have no memories left.
+    """
+    layout = layout or MEMORY_LAYOUT
+    if layout == PER_HAT:
+        names = [c if isinstance(c, str) else c.name for c in get_chroma_client().list_collections()]
+        return [name for name in names if not is_partition_collection(name)]
+    pinned = [hat["hat_id"] for hat in load_all_hats() if "memory_team_id" in hat]
+    return sorted(set(pinned) | set(get_keyword_index().hat_ids()))
+
+def delete_memory_collection(hat_id):
+    """Drops a hat's whole memory collection (or its partition of a shared one)."""
+    memory_queue.discard(hat_id)
+    collection = get_vector_db_for_hat(hat_id) if MEMORY_LAYOUT != PER_HAT else None
+    forget_collection(hat_id)
+    get_keyword_index().clear(hat_id)
+    try:
+        if collection is not None:
+            collection.delete()
+        else:
+            get_chroma_client().delete_collection(hat_id)
+    except Exception as e:
+        print(f"⚠️ [delete_memory_collection] Could not delete collection for {hat_id}: {e}")
+    bump_memory_generation(hat_id)
+
+# Write-behind queue: add_memory_to_hat only enqueues; batches are embedded and written off the request path.
+MEMORY_WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+memory_queue = MemoryWriteQueue(
+    lambda hat_id, entries: upsert_memories(hat_id, entries),
+    batch_size=int(os.getenv("MEMORY_BATCH_SIZE", "32")),
+    flush_interval=float(os.getenv("MEMORY_FLUSH_INTERVAL", "1.0"))
+)
+atexit.register(memory_queue.close)
+
+def flush_memories(hat_id=None):
+    """Writes queued memories (for one hat, or all) before returning."""
+    memory_queue.flush(hat_id)
+
+# Retrieval cache: search results keyed by (hat, memory generation, normalized query, k, tag).
+# Writes that add, delete or re-tag a hat's memories bump its generation, so stale results are never
+# served. Re-storing a known memory only updates its counters and keeps the cache warm.
+MEMORY_SEARCH_CACHE_SIZE = int(os.getenv("MEMORY_SEARCH_CACHE_SIZE", "512"))  # 0 disables the cache
+
+_memory_generation = {}      # hat_id -> int
+_search_cache = OrderedDict()  # least recently used first
+_search_cache_lock = threading.Lock()
+
+def bump_memory_generation(hat_id):
+    with _search_cache_lock:
+        _memory_generation[hat_id] = _memory_generation.get(hat_id, 0) + 1
+
+def memory_generation(hat_id):
+    with _search_cache_lock:
+        return _memory_generation.get(hat_id, 0)
+
+# Tags are stored twice: the CSV "tags" field for display, and one boolean "tag_<name>"
+# key per tag so tag filters run as a `where` clause inside the store.
+TAG_KEY_PREFIX = "tag_"
+
+def parse_tags(tags):
+    """Accepts a list, a CSV string or a JSON list string and returns a clean list of tags."""
+    if isinstance(tags, str):
+        tags_str = tags.strip()
+        if tags_str.startswith("["):
+            try:
+                tags = json.loads(tags_str)
+            except ValueError:
+                tags = tags_str.strip("[]").split(",")
+        else:
+            tags = tags_str.split(",")
+    elif not isinstance(tags, list):
+        tags = []
+    return [str(t).strip().strip('"\'') for t in tags if str(t).strip().strip('"\'')]
+
+def tag_metadata(tags):
+    """Metadata entries for a list of tags: the CSV field plus one boolean key per tag."""
+    tags = parse_tags(tags)
+    metadata = {"tags": ",".join(tags)}
+    metadata.update({f"{TAG_KEY_PREFIX}{tag}": True for tag in tags})
+    return metadata
+
+def tag_where(tag):
+    return {f"{TAG_KEY_PREFIX}{tag.strip()}": True}
+
+def to_epoch(value):
+    """Epoch seconds from an epoch number, a datetime, or a timedelta meaning "that long ago"."""
+    if isinstance(value, datetime.timedelta):
+        return time.time() - value.total_seconds()
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    return float(value)
+
+def memory_where(tag_filter=None, since=None, until=None, mission_id=None, session_id=None):
+    """Chroma `where` clause for the given filters (None when there are none)."""
+    clauses = []
+    if tag_filter:
+        clauses.append(tag_where(tag_filter))
+    if since is not None:
+        clauses.append({"ts": {"$gte": to_epoch(since)}})
+    if until is not None:
+        clauses.append({"ts": {"$lte": to_epoch(until)}})
+    if mission_id:
+        clauses.append({"mission_id": mission_id})
+    if session_id:
+        clauses.append({"session_id": session_id})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def memory_ts(metadata):
+    """Epoch time of a memory; falls back to the ISO timestamp for memories written before `ts` existed."""
+    if "ts" in metadata:
+        return metadata["ts"]
+    try:
+        return datetime.datetime.fromisoformat(metadata.get("timestamp")).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def memory_id_for(hat_id, role, memory_text):
+    """Content-addressed memory ID: the same text from the same role in the same hat always maps to one entry."""
+    normalized = " ".join((memory_text or "").split()).casefold()
+    return hashlib.sha256(f"{hat_id}\0{role}\0{normalized}".encode("utf-8")).hexdigest()
+
+def merge_memory_metadata(existing, incoming):
+    """
+    Metadata for a memory seen again: bumps the occurrence counter, keeps first_seen, unions the tags,
+    and moves the time/mission/session stamps to the latest sighting.
+    """
+    merged = {
+        "timestamp": max(existing.get("timestamp") or "", incoming.get("timestamp") or ""),
+        "first_seen": existing.get("first_seen") or existing.get("timestamp") or incoming.get("timestamp"),
+        "occurrences": int(existing.get("occurrences") or 1) + int(incoming.get("occurrences") or 1),
+        **tag_metadata(list(dict.fromkeys(parse_tags(existing.get("tags", "")) + parse_tags(incoming.get("tags", "")))))
+    }
+    if "ts" in existing or "ts" in incoming:
+        merged["ts"] = max(existing.get("ts", 0), incoming.get("ts", 0))
+    for key in ("mission_id", "session_id", "write_id"):  # Chroma rejects None, so only carry keys that are set
+        if incoming.get(key):
+            merged[key] = incoming[key]
+    return merged
+
+def upsert_memories(hat_id, entries):
+    """
+    Writes [(memory_id, document, metadata)] to a hat's collection.
+    - New IDs are embedded and added; IDs already stored only get their metadata merged (no re-embedding).
+    - A row whose `write_id` is already stored landed in an earlier attempt of the same batch and is not
+      merged again, so a retried batch doesn't count a sighting twice.
+    """
+    merged = {}  # memory_id -> [document, metadata]; repeats inside one batch collapse first
+    for memory_id, document, metadata in entries:
+        if memory_id in merged:
+            merged[memory_id][1] = {**merged[memory_id][1], **merge_memory_metadata(merged[memory_id][1], metadata)}
+        else:
+            merged[memory_id] = [document, dict(metadata)]
+
+    collection = get_vector_db_for_hat(hat_id)
+    existing = collection.get(ids=list(merged), include=["metadatas"])
+    known = dict(zip(existing["ids"], existing["metadatas"]))
+
+    landed = {memory_id for memory_id, (_, metadata) in merged.items()
+              if memory_id in known and metadata.get("write_id") and (known[memory_id] or {}).get("write_id") == metadata["write_id"]}
+    updates = [(memory_id, merge_memory_metadata(known[memory_id] or {}, metadata))
+               for memory_id, (_, metadata) in merged.items() if memory_id in known and memory_id not in landed]
+    new = [(memory_id, document, metadata) for memory_id, (document, metadata) in merged.items() if memory_id not in known]
+
+    if updates:
+        collection.update(ids=[memory_id for memory_id, _ in updates], metadatas=[metadata for _, metadata in updates])
+    if new:
+        documents = [document for _, document, _ in new]
+        collection.add(
+            ids=[memory_id for memory_id, _, _ in new],
+            documents=documents,
+            embeddings=embed_texts(documents),
+            metadatas=[metadata for _, _, metadata in new]
+        )
+    get_keyword_index().upsert(hat_id, new + [
+        (memory_id, merged[memory_id][0], {**(known[memory_id] or {}), **metadata}) for memory_id, metadata in updates
+    ] + [(memory_id, merged[memory_id][0], known[memory_id] or {}) for memory_id in landed])
+    # Re-seen memories only bump counters; cached searches stay valid unless the set of documents or tags changed.
+    # The bump comes after the writes, so a search racing them can't cache old results under the new generation.
+    if new or any(metadata["tags"] != (known[memory_id] or {}).get("tags", "") for memory_id, metadata in updates):
+        bump_memory_generation(hat_id)
+
+def add_memory_to_hat(hat_id, memory_text, role="user", tags=None, session=None, mission_id=None, session_id=None):
+    """
+    Stores a memory for a hat. Metadata carries the ISO `timestamp` for display and an epoch `ts`
+    for time-range filters, plus the mission/session it was written in when known.
+    """
     if tags is None:
         tags = []
     elif isinstance(tags, str):
@@ -96,82 +527,579 @@ def add_memory_to_hat(hat_id, memory_text, role="user", tags=None, session=None)
     elif not isinstance(tags, list):
         tags = []
 
-    # Convert to CSV string for Chroma
-    tag_string = ",".join(tags) if tags else ""
+    now = datetime.datetime.now()
+    timestamp = now.isoformat()
+    memory_id = memory_id_for(hat_id, role, memory_text)
+    metadata = {"timestamp": timestamp, "ts": now.timestamp(), "first_seen": timestamp, "occurrences": 1, "role": role, **tag_metadata(tags)}
+    metadata["write_id"] = uuid.uuid4().hex  # Lets a retried batch recognise rows that already landed
+    session_id = session_id or (session.get("id") if session else None)
+    if mission_id:
+        metadata["mission_id"] = mission_id
+    if session_id:
+        metadata["session_id"] = session_id
 
-    collection = get_vector_db_for_hat(hat_id)
-    timestamp = datetime.datetime.now().isoformat()
-    memory_id = str(hash(memory_text + timestamp))
-
-    collection.add(
-        documents=[memory_text],
-        ids=[memory_id],
-        metadatas=[{"timestamp": timestamp, "role": role, "tags": tag_string}]
-    )
+    if MEMORY_WRITE_BEHIND:
+        memory_queue.put(hat_id, memory_id, memory_text, metadata)
+    else:
+        upsert_memories(hat_id, [(memory_id, memory_text, metadata)])
 
     if session:
         session.set("last_memory_id", memory_id)
         session.set("last_memory_hat_id", hat_id)
 
-def search_memory(hat_id, query, k=10, tag_filter=None):
-    collection = get_vector_db_for_hat(hat_id)
-    try:
-    # Get ALL memories if k is None
-        if k is None:
-            total_docs = collection.count()
-            if total_docs == 0:
-                return []
-            k = total_docs
-
-        results = collection.query(
-            query_texts=[query],
-            n_results=k,
-            include=["documents", "metadatas"]
-        )
+MEMORY_SEARCH_MODE = os.getenv("MEMORY_SEARCH_MODE", "hybrid")  # "hybrid", "vector" or "keyword"
+RRF_K = 60  # Reciprocal rank fusion constant: higher flattens the difference between top ranks
 
-        docs_list = results.get('documents', [[]])[0]
-        metas_list = results.get('metadatas', [[]])[0]
+def search_memory(hat_id, query, k=10, tag_filter=None, read_your_writes=False, mode=None,
+                  since=None, until=None, mission_id=None, session_id=None, recency_half_life=None):
+    """
+    Searches a hat's memories. Returns [(document, metadata)], best first.
+    - mode: "hybrid" fuses vector similarity and BM25 keyword ranks (reciprocal rank fusion),
+      "vector" is similarity only, "keyword" never embeds anything. Defaults to MEMORY_SEARCH_MODE.
+    - k=None returns every (matching) memory, ranked by vector similarity.
+    - tag_filter, since/until (epoch, datetime, or timedelta = "that long ago"), mission_id, session_id:
+      filters applied inside the stores.
+    - recency_half_life: seconds; scores are halved for every half-life of a memory's age.
+    - read_your_writes: flush this hat's queued memories first so they are searchable.
+    Results are cached until the hat's memories change (recency-weighted ones also expire every 1/16 half-life).
+    """
+    if read_your_writes:
+        flush_memories(hat_id)
+    mode = "vector" if k is None else (mode or MEMORY_SEARCH_MODE)
+    where = memory_where(tag_filter, since, until, mission_id, session_id)
+    # Recency scores drift with the clock, so they are only reused within a slice of the half-life
+    age_bucket = int(time.time() // (recency_half_life / 16)) if recency_half_life else None
+    key = (hat_id, memory_generation(hat_id), " ".join((query or "").split()).casefold(), k, mode,
+           json.dumps(where, sort_keys=True), recency_half_life, age_bucket)
+    with _search_cache_lock:
+        cached = _search_cache.get(key)
+        if cached is not None:
+            _search_cache.move_to_end(key)
+    if cached is not None:
+        return [(doc, dict(meta)) for doc, meta in cached]
+
+    results = _query_memory(hat_id, query, k, where, mode, recency_half_life)
+    if MEMORY_SEARCH_CACHE_SIZE > 0 and results is not None:
+        with _search_cache_lock:
+            _search_cache[key] = [(doc, dict(meta)) for doc, meta in results]
+            while len(_search_cache) > MEMORY_SEARCH_CACHE_SIZE:
+                _search_cache.popitem(last=False)
+    return results or []
 
-        if not docs_list or not metas_list:
+def _vector_hits(hat_id, query, k, where):
+    collection = get_vector_db_for_hat(hat_id)
+    # Get ALL (matching) memories if k is None
+    if k is None:
+        if where:
+            k = len(collection.get(where=where, include=[])["ids"])
+        else:
+            k = collection.count()
+        if k == 0:
             return []
+    else:
+        k *= 2  # Headroom for near-duplicates stored before IDs were content-addressed
 
-        # Manual filtering on CSV tags until manaul based
-        filtered_results = []
-        for doc, meta in zip(docs_list, metas_list):
-            tags_str = (meta or {}).get('tags', '')
-            tags_list = [t.strip() for t in tags_str.split(",") if t] if isinstance(tags_str, str) else []
+    results = collection.query(
+        query_embeddings=embed_texts([query]),
+        n_results=k,
+        where=where,
+        include=["documents", "metadatas"]
+    )
+    return list(zip(results["ids"][0], results.get("documents", [[]])[0], results.get("metadatas", [[]])[0]))
+
+def _query_memory(hat_id, query, k, where, mode, recency_half_life=None):
+    """Runs the lookups behind search_memory. Returns None on errors (so they aren't cached)."""
+    try:
+        rankings = []
+        if mode in ("vector", "hybrid"):
+            rankings.append(_vector_hits(hat_id, query, k, where))
+        if mode in ("keyword", "hybrid"):
+            ensure_keyword_index(hat_id)
+            rankings.append(get_keyword_index().search(hat_id, query, k * 2, where))
 
-            if tag_filter is None or tag_filter in tags_list:
-                filtered_results.append((doc, meta))
+        scores, hits = {}, {}
+        for ranking in rankings:
+            for rank, (memory_id, doc, meta) in enumerate(ranking):
+                scores[memory_id] = scores.get(memory_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+                hits.setdefault(memory_id, (doc, meta or {}))
+        if recency_half_life:
+            now = time.time()
+            for memory_id, (_, meta) in hits.items():
+                ts = memory_ts(meta)
+                age = max(now - ts, 0) if ts is not None else float("inf")
+                scores[memory_id] *= 0.5 ** (age / recency_half_life)
+        ranked = sorted(hits, key=lambda memory_id: -scores[memory_id])  # Stable: ties keep vector order
 
-        return filtered_results
+        # The same text stored under several IDs (older random IDs, or user/bot echoes) is returned once
+        unique = {}
+        for memory_id in ranked:
+            doc, meta = hits[memory_id]
+            unique.setdefault(" ".join((doc or "").split()).casefold(), (doc, meta))
+        results = list(unique.values())
+        return results if k is None else results[:k]
     except Exception as e:
         print(f"⚠️ [search_memory] No memory found or error during query for {hat_id}: {e}")
+        return None
+
+def search_across_hats(query, k=10, hat_ids=None, team_id=None, tag_filter=None, since=None, until=None, mission_id=None):
+    """
+    Vector search over several hats' memories at once (the given hats, or every hat of `team_id`).
+    Returns [(hat_id, document, metadata)], best first. In the shared / per-team layouts each collection
+    is queried once with a hat_id filter; per-hat collections are queried one by one and merged.
+    """
+    if hat_ids is None:
+        hat_ids = [hat["hat_id"] for hat in list_hats_by_team(team_id)] if team_id else []
+    where = memory_where(tag_filter, since, until, mission_id)
+    groups = {}  # id(collection) -> (collection, partitioned, [hat_id])
+    for hat_id in dict.fromkeys(hat_ids):
+        handle = get_vector_db_for_hat(hat_id)
+        partitioned = isinstance(handle, HatCollection)
+        collection = handle.collection if partitioned else handle
+        groups.setdefault(id(collection), (collection, partitioned, []))[2].append(hat_id)
+    if not groups:
         return []
 
-def clear_memory(hat_id):
+    query_embeddings = embed_texts([query])
+    hits = []  # (distance, hat_id, document, metadata)
+    for collection, partitioned, group in groups.values():
+        try:
+            results = collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=scope_where({"hat_id": {"$in": group}}, where) if partitioned else where,
+                include=["documents", "metadatas", "distances"]
+            )
+        except Exception as e:
+            print(f"⚠️ [search_across_hats] Query failed for {', '.join(group)}: {e}")
+            continue
+        for doc, meta, distance in zip(results["documents"][0], results["metadatas"][0], results["distances"][0]):
+            meta = meta or {}
+            hit_hat_id = meta.get("hat_id") if partitioned else group[0]
+            hits.append((distance, hit_hat_id, doc, strip_partition_keys([meta])[0]))
+    hits.sort(key=lambda hit: hit[0])
+    return [(hat_id, doc, meta) for _, hat_id, doc, meta in hits[:k]]
+
+MEMORY_PAGE_SIZE = int(os.getenv("MEMORY_PAGE_SIZE", "20"))
+
+def list_memories(hat_id, offset=0, limit=MEMORY_PAGE_SIZE, tag_filter=None):
+    """
+    One page of a hat's memories in the order they were stored (oldest first), without embedding anything.
+    Returns ([(document, metadata)], next_offset) where next_offset is None on the last page.
+    """
+    collection = get_vector_db_for_hat(hat_id)
+    where = tag_where(tag_filter) if tag_filter else None
+    try:
+        # Fetch one extra row to know whether another page exists
+        results = collection.get(where=where, limit=limit + 1, offset=offset, include=["documents", "metadatas"])
+    except Exception as e:
+        print(f"⚠️ [list_memories] Could not list memories for {hat_id}: {e}")
+        return [], None
+
+    page = list(zip(results.get("documents") or [], results.get("metadatas") or []))
+    if len(page) > limit:
+        return page[:limit], offset + limit
+    return page, None
+
+def tag_memory(hat_id, memory_id, tags):
+    """Adds tags to a stored memory (CSV field + per-tag keys). Returns the merged tag list."""
+    collection = get_vector_db_for_hat(hat_id)
+    current = collection.get(ids=[memory_id], include=["documents", "metadatas"])
+    current_meta = current["metadatas"][0] or {}
+    merged = list(dict.fromkeys(parse_tags(current_meta.get("tags", "")) + parse_tags(tags)))
+    collection.update(ids=[memory_id], metadatas=[tag_metadata(merged)])  # Chroma merges metadata keys
+    get_keyword_index().upsert(hat_id, [(memory_id, current["documents"][0], {**current_meta, **tag_metadata(merged)})])
+    bump_memory_generation(hat_id)
+    return merged
+
+def migrate_memory_metadata(hat_ids=None, page_size=500):
+    """
+    One-time migration for memories written by older versions: adds per-tag boolean keys to memories
+    that only carry CSV tags, and an epoch `ts` next to the ISO timestamp.
+    Runs over every collection unless `hat_ids` is given. Returns the number of memories updated.
+    """
+    flush_memories()
+    if hat_ids is None:
+        hat_ids = memory_hat_ids()
+
+    updated = 0
+    for hat_id in hat_ids:
+        collection = get_vector_db_for_hat(hat_id)
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                break
+            ids, metadatas, indexed = [], [], []
+            for memory_id, document, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                meta = meta or {}
+                tags = parse_tags(meta.get("tags", ""))
+                update = {}
+                if any(f"{TAG_KEY_PREFIX}{tag}" not in meta for tag in tags) or meta.get("tags") != ",".join(tags):
+                    update.update(tag_metadata(tags))
+                if "ts" not in meta and memory_ts(meta) is not None:
+                    update["ts"] = memory_ts(meta)
+                if update:
+                    ids.append(memory_id)
+                    metadatas.append(update)
+                    indexed.append((memory_id, document, {**meta, **update}))
+            if ids:
+                collection.update(ids=ids, metadatas=metadatas)
+                get_keyword_index().upsert(hat_id, indexed)
+                bump_memory_generation(hat_id)
+                updated += len(ids)
+            offset += len(page["ids"])
+    return updated
+
+def migrate_memory_layout(layout, hat_ids=None, page_size=500, drop_source=True):
+    """
+    Moves memories from per-hat collections into the "shared" or "per_team" layout, embeddings included
+    (nothing is re-embedded). Rows are upserted, so an interrupted migration can simply be run again;
+    each per-hat collection is dropped once copied unless drop_source=False.
+    Returns {"hats": int, "memories": int}. Set MEMORY_LAYOUT to `layout` afterwards.
+    """
+    if layout not in LAYOUTS or layout == PER_HAT:
+        raise ValueError(f"Can only migrate into a partitioned layout, not {layout}.")
+    flush_memories()
+    client = get_chroma_client()
+    if hat_ids is None:
+        hat_ids = memory_hat_ids(PER_HAT)
+
+    report = {"hats": 0, "memories": 0}
+    for hat_id in hat_ids:
+        try:
+            source = client.get_collection(hat_id)
+        except Exception:
+            continue  # Nothing stored per-hat for this hat
+        target = get_vector_db_for_hat(hat_id, layout)
+        offset = 0
+        while True:
+            page = source.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+            if not page["ids"]:
+                break
+            target.upsert(ids=page["ids"], documents=page["documents"], embeddings=page["embeddings"], metadatas=page["metadatas"])
+            report["memories"] += len(page["ids"])
+            offset += len(page["ids"])
+        if drop_source:
+            client.delete_collection(hat_id)
+        forget_collection(hat_id)
+        bump_memory_generation(hat_id)
+        report["hats"] += 1
+    return report
+
+MEMORY_DELETE_CHUNK = 500
+
+def delete_memory_ids(hat_id, memory_ids, chunk_size=MEMORY_DELETE_CHUNK):
+    """Deletes memories by ID in chunks."""
     collection = get_vector_db_for_hat(hat_id)
-    all_docs = collection.get()
-    if 'ids' in all_docs and all_docs['ids']:
-        collection.delete(ids=all_docs['ids'])
+    for start in range(0, len(memory_ids), chunk_size):
+        collection.delete(ids=memory_ids[start:start + chunk_size])
+    get_keyword_index().delete(hat_id, memory_ids)
+    bump_memory_generation(hat_id)
+
+def clear_memory(hat_id, chunk_size=MEMORY_DELETE_CHUNK):
+    """Deletes all of a hat's memories one chunk of IDs at a time."""
+    memory_queue.discard(hat_id)
+    collection = get_vector_db_for_hat(hat_id)
+    while True:
+        ids = collection.get(limit=chunk_size, include=[])["ids"]
+        if not ids:
+            break
+        collection.delete(ids=ids)
+    get_keyword_index().clear(hat_id)
+    bump_memory_generation(hat_id)
+    forget_collection(hat_id)
 
 # --- Hat Management Functions ---
 
 HAT_DIR = "./hats"
+HAT_STORE = os.getenv("HAT_STORE", "json")  # "json" (one file per hat) or "sqlite"
+HAT_DB_PATH = os.getenv("HAT_DB_PATH", "./hats.db")
+
+class HatRegistry:
+    """
+    In-process cache of the hats stored in a hat directory.
+    - Keeps every hat parsed (raw + normalized) keyed by hat_id.
+    - Maintains secondary indexes by team_id, base_hat_id and role.
+    - Uses the directory mtime as a change stamp and per-file mtimes to
+      re-read only hats that were added or modified on disk.
+    """
+
+    def __init__(self, hat_dir=HAT_DIR, rescan_interval=2.0):
+        self.hat_dir = hat_dir
+        self.rescan_interval = rescan_interval  # Catch in-place edits made outside this process
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._entries = {}  # hat_id -> {"mtime": int, "raw": dict, "hat": dict}
+        self._by_team = {}
+        self._by_base = {}
+        self._by_role = {}
+        self._dir_stamp = None
+        self._last_scan = 0.0
+
+    def _path(self, hat_id):
+        return os.path.join(self.hat_dir, f"{hat_id}.json")
+
+    # --- Index maintenance ---
+
+    def _index_keys(self, hat_id, raw):
+        return (
+            (self._by_team, raw.get("team_id")),
+            (self._by_base, raw.get("base_hat_id") or hat_id),
+            (self._by_role, raw.get("role", "agent")),
+        )
+
+    def _store(self, hat_id, raw, mtime):
+        self._drop(hat_id)
+        self._entries[hat_id] = {"mtime": mtime, "raw": raw, "hat": normalize_hat(raw)}
+        for index, key in self._index_keys(hat_id, raw):
+            index.setdefault(key, set()).add(hat_id)
+
+    def _drop(self, hat_id):
+        entry = self._entries.pop(hat_id, None)
+        if entry is None:
+            return
+        for index, key in self._index_keys(hat_id, entry["raw"]):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(hat_id)
+                if not ids:
+                    del index[key]
+
+    def _read(self, hat_id, path, mtime):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ [HatRegistry] Skipping unreadable hat file {path}: {e}")
+            self._drop(hat_id)
+            return
+        self._store(hat_id, raw, mtime)
+
+    # --- Change detection ---
+
+    def refresh(self, force=False):
+        """Re-syncs with disk when the directory changed or the rescan interval elapsed."""
+        with self._lock:
+            try:
+                dir_stamp = os.stat(self.hat_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._reset()
+                return
+
+            now = time.monotonic()
+            if not force and dir_stamp == self._dir_stamp and now - self._last_scan < self.rescan_interval:
+                return
+
+            seen = set()
+            with os.scandir(self.hat_dir) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json") or not entry.is_file():
+                        continue
+                    hat_id = entry.name[:-len(".json")]
+                    seen.add(hat_id)
+                    mtime = entry.stat().st_mtime_ns
+                    cached = self._entries.get(hat_id)
+                    if cached is None or cached["mtime"] != mtime:
+                        self._read(hat_id, entry.path, mtime)
+
+            for hat_id in set(self._entries) - seen:
+                self._drop(hat_id)
+
+            self._dir_stamp = dir_stamp
+            self._last_scan = now
+
+    def invalidate(self, hat_id=None):
+        """Forgets one hat (or everything) so the next access re-reads it from disk."""
+        with self._lock:
+            if hat_id is None:
+                self._reset()
+            else:
+                self._drop(hat_id)
+                self._dir_stamp = None
+
+    # --- Reads ---
+
+    def stamps(self, hat_ids):
+        """Change stamps (file mtimes) of hats, None for missing ones. Reads and stats no hat files."""
+        with self._lock:
+            self.refresh()
+            return {hat_id: self._entries[hat_id]["mtime"] if hat_id in self._entries else None for hat_id in hat_ids}
+
+    def get(self, hat_id):
+        """Returns a normalized copy of a hat. Raises FileNotFoundError if it doesn't exist."""
+        with self._lock:
+            self.refresh()
+            path = self._path(hat_id)
+            entry = self._entries.get(hat_id)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                self._drop(hat_id)
+                raise
+            if entry is None or entry["mtime"] != mtime:
+                with open(path, "r", encoding="utf-8") as f:  # Surface parse errors to the caller
+                    raw = json.load(f)
+                self._store(hat_id, raw, mtime)
+                entry = self._entries[hat_id]
+            return copy.deepcopy(entry["hat"])
+
+    def ids(self):
+        with self._lock:
+            self.refresh()
+            return sorted(self._entries)
+
+    def all(self):
+        with self._lock:
+            self.refresh()
+            return [copy.deepcopy(self._entries[hat_id]["hat"]) for hat_id in sorted(self._entries)]
+
+    def team_ids(self):
+        with self._lock:
+            self.refresh()
+            return sorted(team_id for team_id in self._by_team if team_id)
+
+    def by_team(self, team_id, active_only=True):
+        """Raw hats of a team, sorted by flow_order."""
+        with self._lock:
+            self.refresh()
+            hats = [
+                copy.deepcopy(self._entries[hat_id]["raw"])
+                for hat_id in sorted(self._by_team.get(team_id, ()))
+            ]
+        if active_only:
+            hats = [hat for hat in hats if hat.get("active", True)]
+        hats.sort(key=lambda h: h.get("flow_order") or 0)
+        return hats
+
+    def by_base_id(self, base_hat_id):
+        with self._lock:
+            self.refresh()
+            return [copy.deepcopy(self._entries[hat_id]["hat"]) for hat_id in sorted(self._by_base.get(base_hat_id, ()))]
+
+    def by_role(self, role):
+        with self._lock:
+            self.refresh()
+            return [copy.deepcopy(self._entries[hat_id]["hat"]) for hat_id in sorted(self._by_role.get(role, ()))]
+
+    def templates(self):
+        """Hats without a team whose base_hat_id is themselves."""
+        with self._lock:
+            self.refresh()
+            return [
+                copy.deepcopy(self._entries[hat_id]["hat"])
+                for hat_id in sorted(self._by_team.get(None, ()))
+                if (self._entries[hat_id]["raw"].get("base_hat_id") or hat_id) == hat_id
+            ]
+
+    # --- Writes ---
+
+    def put(self, hat_id, data):
+        self.put_many([(hat_id, data)])
+
+    def put_many(self, batch):
+        """
+        Writes a batch of hats ({hat_id: data} or (hat_id, data) pairs).
+        - Every hat is written to a temp file in HAT_DIR and fsynced before any rename.
+        - Temp files then replace their targets (atomic rename) and the directory is synced once.
+        Each file is atomic, the batch is not: readers never observe a half-written hat file, but a
+        failed rename leaves the hats before it saved and the rest unchanged (their temp files are removed).
+        """
+        batch = list(batch.items() if isinstance(batch, dict) else batch)
+        with self._lock:
+            staged = []
+            try:
+                for hat_id, data in batch:
+                    fd, tmp_path = tempfile.mkstemp(prefix=f".{hat_id}.", suffix=".tmp", dir=self.hat_dir)
+                    f = os.fdopen(fd, "w", encoding="utf-8")  # 💥 Force UTF-8
+                    staged.append((hat_id, data, tmp_path, f))
+                    json.dump(data, f, indent=2, ensure_ascii=False)  # 💥 Prevent ASCII-only
+                    f.flush()
+                for _, _, _, f in staged:
+                    os.fsync(f.fileno())
+                    f.close()
+            except Exception:
+                for _, _, tmp_path, f in staged:
+                    f.close()
+                    os.remove(tmp_path)
+                raise
+
+            replaced = 0
+            try:
+                for hat_id, data, tmp_path, _ in staged:
+                    os.chmod(tmp_path, 0o644)
+                    os.replace(tmp_path, self._path(hat_id))
+                    replaced += 1
+            except Exception:
+                for _, _, tmp_path, _ in staged[replaced:]:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                for hat_id, _, _, _ in staged[:replaced]:
+                    self.invalidate(hat_id)
+                raise
+            self._fsync_dir()
+
+            for hat_id, data, _, _ in staged:
+                self._store(hat_id, copy.deepcopy(data), os.stat(self._path(hat_id)).st_mtime_ns)
+
+    def _fsync_dir(self):
+        if not hasattr(os, "O_DIRECTORY"):  # Windows: directory handles can't be fsynced
+            return
+        fd = os.open(self.hat_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def delete(self, hat_id):
+        with self._lock:
+            os.remove(self._path(hat_id))
+            self._drop(hat_id)
+
+
+def create_hat_store(backend=None):
+    """Builds the hat backend selected by HAT_STORE. Both expose the HatRegistry interface."""
+    backend = backend or HAT_STORE
+    if backend == "sqlite":
+        from hat_store import SQLiteHatStore
+        return SQLiteHatStore(HAT_DB_PATH, normalize=normalize_hat)
+    if backend != "json":
+        print(f"⚠️ Unknown HAT_STORE '{backend}', falling back to json.")
+    return HatRegistry(HAT_DIR)
+
+hat_registry = create_hat_store()
 
 def load_hat(hat_id):
-    path = os.path.join(HAT_DIR, f"{hat_id}.json")
-    with open(path, "r", encoding="utf-8") as f:
-        hat = json.load(f)
-    return normalize_hat(hat)  # 💥 enforce hygiene on load
+    return hat_registry.get(hat_id)  # 💥 enforce hygiene on load (normalized in the registry)
+
+def hat_stamps(hat_ids):
+    """{hat_id: change stamp} for cache invalidation; the stamp changes whenever the stored hat does."""
+    return hat_registry.stamps(hat_ids)
+
 def save_hat(hat_id, data):
-    path = os.path.join(HAT_DIR, f"{hat_id}.json")
-    with open(path, "w", encoding="utf-8") as f:  # 💥 Force UTF-8
-        json.dump(data, f, indent=2, ensure_ascii=False)  # 💥 Prevent ASCII-only
+    hat_registry.put(hat_id, data)
 
+def save_hats(batch):
+    """
+    Saves a whole team. `batch` is {hat_id: data} or a list of (hat_id, data).
+    The SQLite store commits the batch in one transaction; the JSON store writes each file atomically.
+    """
+    hat_registry.put_many(batch)
+
+def delete_hat(hat_id):
+    hat_registry.delete(hat_id)
 
 def list_hats():
-    return [f.replace(".json", "") for f in os.listdir(HAT_DIR) if f.endswith(".json")]
+    return hat_registry.ids()
+
+def load_all_hats():
+    return hat_registry.all()
+
+def list_team_ids():
+    return hat_registry.team_ids()
 
 # --- LLM-Based Hat Creation ---
 
@@ -181,17 +1109,18 @@ def create_hat_from_prompt(prompt, llm):
     return ensure_schema_defaults(hat_data)
 
 def list_hats_by_team(team_id):
-    hats = []
-    for hat_file in os.listdir(HAT_DIR):
-        if hat_file.endswith(".json"):
-            hat_path = os.path.join(HAT_DIR, hat_file)
-            with open(hat_path, "r", encoding="utf-8") as f:  # 💥 Force UTF-8
-                hat_data = json.load(f)
-                if hat_data.get("team_id") == team_id and hat_data.get("active", True):
-                    hats.append(hat_data)
-    # Sort by flow_order
-    hats.sort(key=lambda h: h.get("flow_order", 0))
-    return hats
+    # Sorted by flow_order
+    return hat_registry.by_team(team_id)
+
+def list_hats_by_base_id(base_hat_id):
+    return hat_registry.by_base_id(base_hat_id)
+
+def list_templates():
+    """Base templates: hats without a team whose base_hat_id is their own hat_id."""
+    return hat_registry.templates()
+
+def list_hats_by_role(role):
+    return hat_registry.by_role(role)
 
 # --- Schema Enhancer ---
 
@@ -240,43 +1169,44 @@ Expected JSON format:
 }
 """
 
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt}
+    ]
+    # Replays come from the response cache when it is enabled for sampled requests (Ollama samples by default)
+    policy = llm_cache.llm_cache_policy()
+    key = llm_cache.cache_key(policy, "ollama", model, messages)
+    cached = llm_cache.lookup(key, policy)
+
     retries = 0
     while retries < max_retries:
-        response = requests.post("http://localhost:11434/api/chat", json={
-            "model": model,
-            "stream": False,
-            "messages": [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ]
-        })
-
-        if response.status_code == 200:
-            content = response.json()["message"]["content"]
+        if cached is not None:
+            content, cached = cached, None
+        else:
+            content = get_ollama_client().chat(messages, model)
             print("RAW RESPONSE TEXT:", content)
 
-            # Extract and validate JSON
-            try:
-                match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", content, re.DOTALL)
-                if match:
-                    cleaned_json = match.group(1)
-                else:
-                    cleaned_json = re.search(r"(\{.*\})", content, re.DOTALL).group(1)
-
-                hat_data = json.loads(cleaned_json)
-
-                # Quick schema check for critical fields
-                required_fields = ["hat_id", "name", "model", "instructions"]
-                if all(field in hat_data for field in required_fields):
-                    return hat_data  # Success
-                else:
-                    raise ValueError(f"Missing required fields: {required_fields}")
-
-            except Exception as e:
-                print(f"⚠️ JSON Parse/Validation Failed: {e}. Retrying...")
-                retries += 1
-        else:
-            raise Exception(f"Ollama API Error: {response.status_code} - {response.text}")
+        # Extract and validate JSON
+        try:
+            match = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", content, re.DOTALL)
+            if match:
+                cleaned_json = match.group(1)
+            else:
+                cleaned_json = re.search(r"(\{.*\})", content, re.DOTALL).group(1)
+
+            hat_data = json.loads(cleaned_json)
+
+            # Quick schema check for critical fields
+            required_fields = ["hat_id", "name", "model", "instructions"]
+            if all(field in hat_data for field in required_fields):
+                llm_cache.store(key, content)
+                return hat_data  # Success
+            else:
+                raise ValueError(f"Missing required fields: {required_fields}")
+
+        except Exception as e:
+            print(f"⚠️ JSON Parse/Validation Failed: {e}. Retrying...")
+            retries += 1
 
     raise Exception(f"Failed to get valid JSON after {max_retries} attempts.")
 
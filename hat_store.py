@@ -0,0 +1,185 @@
+# hat_store.py
+import os
+import json
+import sqlite3
+import threading
+import time
+import copy
+import argparse
+
+# -----------------------------
+# SQLite Hat Store
+# -----------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS hats (
+    hat_id      TEXT PRIMARY KEY,
+    team_id     TEXT,
+    base_hat_id TEXT NOT NULL,
+    role        TEXT,
+    active      INTEGER NOT NULL DEFAULT 1,
+    flow_order  INTEGER,
+    data        TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_hats_team ON hats (team_id, active, flow_order);
+CREATE INDEX IF NOT EXISTS idx_hats_base ON hats (base_hat_id);
+CREATE INDEX IF NOT EXISTS idx_hats_role ON hats (role);
+CREATE INDEX IF NOT EXISTS idx_hats_active ON hats (active);
+CREATE INDEX IF NOT EXISTS idx_hats_flow_order ON hats (flow_order);
+"""
+
+
+class SQLiteHatStore:
+    """
+    Single-file hat backend. Exposes the same interface as HatRegistry, but
+    team/template/base lookups are indexed queries instead of directory scans.
+    """
+
+    def __init__(self, db_path="./hats.db", normalize=None):
+        self.db_path = db_path
+        self.normalize = normalize or (lambda hat: hat)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _row(self, hat_id, data):
+        return (
+            hat_id,
+            data.get("team_id"),
+            data.get("base_hat_id") or hat_id,
+            data.get("role", "agent"),
+            0 if data.get("active", True) is False else 1,
+            data.get("flow_order") if isinstance(data.get("flow_order"), int) else None,
+            json.dumps(data, ensure_ascii=False),
+            time.time(),
+        )
+
+    def _select(self, where="", params=(), order="hat_id"):
+        with self._lock:
+            rows = self._conn.execute(f"SELECT data FROM hats {where} ORDER BY {order}", params).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    # --- Change detection (nothing cached in-process) ---
+
+    def refresh(self, force=False):
+        pass
+
+    def invalidate(self, hat_id=None):
+        pass
+
+    # --- Reads ---
+
+    def stamps(self, hat_ids):
+        """updated_at of hats (None for missing ones), in one query."""
+        hat_ids = list(hat_ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(hat_ids), 500):  # Stay under SQLite's bound-parameter limit
+                chunk = hat_ids[start:start + 500]
+                found.update(self._conn.execute(
+                    f"SELECT hat_id, updated_at FROM hats WHERE hat_id IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall())
+        return {hat_id: found.get(hat_id) for hat_id in hat_ids}
+
+    def get(self, hat_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM hats WHERE hat_id = ?", (hat_id,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Hat '{hat_id}' not found in {self.db_path}")
+        return self.normalize(json.loads(row[0]))
+
+    def ids(self):
+        with self._lock:
+            return [hat_id for (hat_id,) in self._conn.execute("SELECT hat_id FROM hats ORDER BY hat_id")]
+
+    def all(self):
+        return [self.normalize(hat) for hat in self._select()]
+
+    def team_ids(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT team_id FROM hats WHERE team_id IS NOT NULL AND team_id != '' ORDER BY team_id"
+            ).fetchall()
+        return [team_id for (team_id,) in rows]
+
+    def by_team(self, team_id, active_only=True):
+        """Raw hats of a team, sorted by flow_order."""
+        where = "WHERE team_id = ? AND active = 1" if active_only else "WHERE team_id = ?"
+        return self._select(where, (team_id,), order="COALESCE(flow_order, 0), hat_id")
+
+    def by_base_id(self, base_hat_id):
+        return [self.normalize(hat) for hat in self._select("WHERE base_hat_id = ?", (base_hat_id,))]
+
+    def by_role(self, role):
+        return [self.normalize(hat) for hat in self._select("WHERE role = ?", (role,))]
+
+    def templates(self):
+        """Hats without a team whose base_hat_id is themselves."""
+        return [self.normalize(hat) for hat in self._select("WHERE team_id IS NULL AND base_hat_id = hat_id")]
+
+    # --- Writes ---
+
+    def put(self, hat_id, data):
+        self.put_many([(hat_id, data)])
+
+    def put_many(self, batch):
+        """Writes a batch of hats ({hat_id: data} or (hat_id, data) pairs) in a single transaction."""
+        batch = batch.items() if isinstance(batch, dict) else batch
+        self._write_rows([self._row(hat_id, copy.deepcopy(data)) for hat_id, data in batch])
+
+    def _write_rows(self, rows):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO hats VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, hat_id):
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM hats WHERE hat_id = ?", (hat_id,))
+        if cursor.rowcount == 0:
+            raise FileNotFoundError(f"Hat '{hat_id}' not found in {self.db_path}")
+
+    # --- Migration ---
+
+    def import_hat_dir(self, hat_dir):
+        """Imports every <hat_id>.json file from a hat directory in a single transaction."""
+        rows = []
+        for name in sorted(os.listdir(hat_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(hat_dir, name)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    rows.append(self._row(name[:-len(".json")], json.load(f)))
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Skipping {path}: {e}")
+
+        self._write_rows(rows)
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hat store utilities.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    migrate = subcommands.add_parser("migrate", help="Import a hats/ directory into the SQLite store.")
+    migrate.add_argument("--hats", default="./hats", help="Directory of <hat_id>.json files.")
+    migrate.add_argument("--db", default=os.getenv("HAT_DB_PATH", "./hats.db"), help="SQLite database file.")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        store = SQLiteHatStore(args.db)
+        count = store.import_hat_dir(args.hats)
+        store.close()
+        print(f"✅ Imported {count} hat(s) from {args.hats} into {args.db}. Set HAT_STORE=sqlite to use it.")
@@ -3,7 +3,7 @@
 import os
 import json
 from datetime import datetime
-from hat_manager import load_hat, save_hat, list_hats,normalize_hat
+from hat_manager import load_hat, save_hat, normalize_hat, list_hats_by_base_id, list_templates
 #continue polishing base templates designs.
 def register_template(hat_id):
     """
@@ -19,12 +19,7 @@ def list_hat_templates():
     """
     Lists all Hats that are considered base templates (no team_id or base_hat_id == hat_id).
     """
-    templates = []
-    for hat_id in list_hats():
-        hat = load_hat(hat_id)
-        if hat.get("team_id") is None and hat.get("base_hat_id") == hat.get("hat_id"):
-            templates.append(hat)
-    return templates
+    return list_templates()
 
 
 def clone_hat_template(base_hat_id, new_suffix=None, team_id=None, flow_order=None):
@@ -44,6 +39,7 @@ def clone_hat_template(base_hat_id, new_suffix=None, team_id=None, flow_order=No
     cloned_hat["hat_id"] = cloned_id
     cloned_hat["name"] = f"{base_hat['name']} Clone"
     cloned_hat["base_hat_id"] = base_hat_id
+    cloned_hat.pop("memory_team_id", None)  # The clone's memories get their own partition
 
     save_hat(cloned_id, cloned_hat)
     return cloned_hat
@@ -53,12 +49,7 @@ def find_hats_by_base_id(base_id):
     """
     Finds all Hats cloned from a given base_hat_id.
     """
-    hats = []
-    for hat_id in list_hats():
-        hat = load_hat(hat_id)
-        if hat.get("base_hat_id") == base_id:
-            hats.append(hat)
-    return hats
+    return list_hats_by_base_id(base_id)
 
 if __name__ == "__main__":
     print("🧪 Running Hat Templates Tests...")
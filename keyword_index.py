@@ -0,0 +1,156 @@
+# keyword_index.py
+import os
+import re
+import json
+import sqlite3
+import threading
+
+# -----------------------------
+# Keyword (BM25) Memory Index
+# -----------------------------
+# One SQLite FTS5 index for all hats' memories, kept in step with the Chroma collections.
+# `memories` holds the rows (unique per hat + memory ID); `memories_fts` indexes their text
+# and tags and ranks matches with FTS5's built-in bm25().
+
+KEYWORD_INDEX_PATH = os.getenv("KEYWORD_INDEX_PATH", "./keyword_index.db")
+
+TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS memories (
+    rowid     INTEGER PRIMARY KEY,
+    hat_id    TEXT NOT NULL,
+    memory_id TEXT NOT NULL,
+    document  TEXT NOT NULL,
+    tags      TEXT NOT NULL DEFAULT '',
+    metadata  TEXT NOT NULL DEFAULT '{}',
+    UNIQUE (hat_id, memory_id)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5(
+    document, tags, content='memories', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS memories_ai AFTER INSERT ON memories BEGIN
+    INSERT INTO memories_fts (rowid, document, tags) VALUES (new.rowid, new.document, new.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_ad AFTER DELETE ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, document, tags) VALUES ('delete', old.rowid, old.document, old.tags);
+END;
+CREATE TRIGGER IF NOT EXISTS memories_au AFTER UPDATE OF document, tags ON memories BEGIN
+    INSERT INTO memories_fts (memories_fts, rowid, document, tags) VALUES ('delete', old.rowid, old.document, old.tags);
+    INSERT INTO memories_fts (rowid, document, tags) VALUES (new.rowid, new.document, new.tags);
+END;
+"""
+
+
+OPERATORS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def where_sql(where):
+    """
+    Translates the subset of Chroma `where` syntax used for memories ({key: value}, {key: {"$op": value}},
+    {"$and": [...]}, {"$or": [...]}) into SQL over the stored metadata JSON. Returns (sql, params).
+    """
+    clauses, params = [], []
+    for key, condition in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(sub) for sub in condition]
+            clauses.append("(" + f" {key[1:].upper()} ".join(f"({sql})" for sql, _ in parts) + ")")
+            params += [p for _, sub_params in parts for p in sub_params]
+            continue
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op not in OPERATORS:
+                raise ValueError(f"Unsupported where operator: {op}")
+            clauses.append(f"json_extract(m.metadata, ?) {OPERATORS[op]} ?")
+            params += [f'$."{key}"', int(value) if isinstance(value, bool) else value]
+    return " AND ".join(clauses), params
+
+
+def match_expression(query):
+    """FTS5 query matching any term of `query` (terms are quoted, so user text can't inject syntax)."""
+    terms = dict.fromkeys(term.casefold() for term in TERM_PATTERN.findall(query or ""))
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+class KeywordIndex:
+    """BM25 keyword index over hat memories, updated incrementally alongside the vector store."""
+
+    def __init__(self, path=KEYWORD_INDEX_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, statements):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, rows in statements:
+                    self._conn.executemany(sql, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    # --- Writes ---
+
+    def upsert(self, hat_id, entries):
+        """Adds or replaces [(memory_id, document, metadata)] for a hat."""
+        rows = [
+            (hat_id, memory_id, document or "", (metadata or {}).get("tags", ""), json.dumps(metadata or {}, ensure_ascii=False))
+            for memory_id, document, metadata in entries
+        ]
+        self._transaction([(
+            "INSERT INTO memories (hat_id, memory_id, document, tags, metadata) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (hat_id, memory_id) DO UPDATE SET "
+            "document = excluded.document, tags = excluded.tags, metadata = excluded.metadata",
+            rows
+        )])
+
+    def delete(self, hat_id, memory_ids):
+        self._transaction([("DELETE FROM memories WHERE hat_id = ? AND memory_id = ?", [(hat_id, m) for m in memory_ids])])
+
+    def clear(self, hat_id):
+        self._transaction([("DELETE FROM memories WHERE hat_id = ?", [(hat_id,)])])
+
+    # --- Reads ---
+
+    def hat_ids(self):
+        with self._lock:
+            return [hat_id for hat_id, in self._conn.execute("SELECT DISTINCT hat_id FROM memories ORDER BY hat_id")]
+
+    def count(self, hat_id):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM memories WHERE hat_id = ?", (hat_id,)).fetchone()[0]
+
+    def search(self, hat_id, query, k=10, where=None):
+        """
+        Best keyword matches for `query` in one hat, best first, optionally filtered by a Chroma-style `where`.
+        Returns [(memory_id, document, metadata)]; nothing is embedded.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        sql = (
+            "SELECT m.memory_id, m.document, m.metadata FROM memories_fts "
+            "JOIN memories m ON m.rowid = memories_fts.rowid "
+            "WHERE memories_fts MATCH ? AND m.hat_id = ?"
+        )
+        params = [expression, hat_id]
+        if where:
+            where_clause, where_params = where_sql(where)
+            sql += f" AND {where_clause}"
+            params += where_params
+        sql += " ORDER BY bm25(memories_fts) LIMIT ?"
+        params.append(k)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [(memory_id, document, json.loads(metadata)) for memory_id, document, metadata in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,183 @@
+# llm_cache.py
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# -----------------------------
+# LLM Response Cache
+# -----------------------------
+# Opt-in (LLM_CACHE=true). Responses are keyed by provider, model, the full message list and the
+# sampling parameters, and kept in a size-bounded SQLite LRU with a small in-process LRU in front.
+# Sampled requests (temperature > 0, or no temperature for providers that sample by default) are
+# only cached with LLM_CACHE_SAMPLED=true: replaying them pins one of many possible answers.
+
+LLM_CACHE = os.getenv("LLM_CACHE", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_SAMPLED = os.getenv("LLM_CACHE_SAMPLED", "false").lower() in ("1", "true", "yes")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "0"))  # Seconds; 0 = never expire
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "./llm_cache.db")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "512"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key       TEXT PRIMARY KEY,
+    response  TEXT NOT NULL,
+    created   REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+"""
+
+
+def llm_cache_policy(hat=None):
+    """
+    Effective cache settings for a hat: env defaults plus the hat's "llm_cache" overrides
+    ({"enabled", "ttl", "sampled", "bypass"}). `bypass` skips the cache for the hat entirely.
+    """
+    overrides = (hat or {}).get("llm_cache") or {}
+    return {
+        "enabled": bool(overrides.get("enabled", LLM_CACHE)),
+        "ttl": float(overrides.get("ttl", LLM_CACHE_TTL) or 0),
+        "sampled": bool(overrides.get("sampled", LLM_CACHE_SAMPLED)),
+        "bypass": bool(overrides.get("bypass", False)),
+    }
+
+
+def cache_key(policy, provider, model, messages, temperature=None, **params):
+    """Content hash of a request, or None when `policy` doesn't allow caching it."""
+    if not policy["enabled"] or policy["bypass"]:
+        return None
+    if not policy["sampled"] and (temperature is None or temperature > 0):
+        return None
+    payload = json.dumps(
+        {"provider": provider, "model": model, "messages": messages, "temperature": temperature, "params": params},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent LLM response store.
+    - Reads hit an in-process LRU first, then the SQLite file.
+    - The file is bounded by entry count and size; the least recently used rows are evicted first.
+    - Entries older than the caller's TTL are treated as misses and overwritten by the next store.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, max_entries=LLM_CACHE_MAX_ENTRIES,
+                 max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024), memory_entries=LLM_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()  # key -> (response, created), least recently used first
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._count, self._bytes = self._totals()
+
+    def _totals(self):
+        return self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(response)), 0) FROM responses").fetchone()
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key, ttl=0):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+            else:
+                row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    entry = (row[0], row[1])
+                    self._remember(key, entry)
+                    self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            if entry is None or (ttl and time.time() - entry[1] > ttl):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._remember(key, (response, now))
+            replaced = self._conn.execute("SELECT 1 FROM responses WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, response, now, now))
+            if not replaced:
+                self._count += 1
+            self._bytes += len(response)  # Approximate; evict() recounts
+            if self._count > self.max_entries or self._bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Drops least recently used rows until the cache is back under 90% of both bounds."""
+        with self._lock:
+            self._count, self._bytes = self._totals()  # Other processes may share the file
+            if self._count <= self.max_entries and self._bytes <= self.max_bytes:
+                return 0
+            average = self._bytes / max(self._count, 1)
+            target = min(int(self.max_entries * 0.9), int(self.max_bytes * 0.9 / max(average, 1)))
+            excess = self._count - target
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used LIMIT ?)", (excess,)
+            )
+            self._memory.clear()
+            self._count, self._bytes = self._totals()
+            return excess
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._memory.clear()
+            self._count, self._bytes = 0, 0
+
+    def __len__(self):
+        with self._lock:
+            return self._count
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+def get_response_cache():
+    """The process-wide cache, opened on first use (nothing touches disk while caching is off)."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache()
+        return _response_cache
+
+def set_response_cache(cache):
+    """Swaps the response cache (e.g. ResponseCache(":memory:") in tests)."""
+    global _response_cache
+    with _response_cache_lock:
+        _response_cache = cache
+
+def lookup(key, policy):
+    """Cached response for a key from cache_key(), or None."""
+    if key is None:
+        return None
+    return get_response_cache().get(key, policy["ttl"])
+
+def store(key, response):
+    if key is not None and response is not None:
+        get_response_cache().put(key, response)
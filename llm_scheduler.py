@@ -0,0 +1,348 @@
+# llm_scheduler.py
+import os
+import time
+import random
+import asyncio
+import itertools
+import threading
+
+import openai
+
+from context_budget import count_tokens
+
+# -----------------------------
+# LLM Call Scheduler
+# -----------------------------
+# Every OpenAI completion in the process (all Chainlit sessions, team flows, reflections, retention
+# summaries) goes through one scheduler that:
+# - admits calls by priority class (interactive chat before background reflections/debriefs);
+# - keeps each model under its requests- and tokens-per-minute budget with token buckets;
+# - adapts the number of calls in flight (AIMD: +1 per window of successes, halved on 429/5xx);
+# - retries 429/5xx/connection failures with jittered exponential backoff, honouring Retry-After.
+# The OpenAI clients are created with max_retries=0 so failures surface here instead of being
+# retried blindly inside the SDK.
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))  # Ceiling for the adaptive limit
+LLM_MIN_CONCURRENCY = int(os.getenv("LLM_MIN_CONCURRENCY", "1"))
+LLM_RPM = int(os.getenv("LLM_RPM", "0"))  # Default per-model requests/minute (0 = unlimited)
+LLM_TPM = int(os.getenv("LLM_TPM", "0"))  # Default per-model tokens/minute (0 = unlimited)
+LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS", "")  # "gpt-4=500/30000,gpt-4o=500/300000" (longest prefix wins)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))  # Seconds
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30"))
+
+PRIORITIES = {"interactive": 0, "background": 1}
+MESSAGE_OVERHEAD_TOKENS = 4
+POLL_SECONDS = 1.0  # Upper bound on how long a queued call sleeps before re-checking
+
+
+def parse_rate_limits(spec):
+    """"model=rpm/tpm,..." -> {model_prefix: (rpm, tpm)}. Malformed entries are skipped with a warning."""
+    limits = {}
+    for entry in filter(None, (part.strip() for part in (spec or "").split(","))):
+        try:
+            model, values = entry.split("=", 1)
+            rpm, tpm = values.split("/", 1)
+            limits[model.strip()] = (int(rpm), int(tpm))
+        except ValueError:
+            print(f"⚠️ Ignoring malformed LLM_RATE_LIMITS entry: {entry!r}")
+    return limits
+
+
+def estimate_tokens(messages, max_tokens):
+    """What a request counts against TPM: its prompt tokens plus the max_tokens it may generate."""
+    prompt = sum(count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for message in messages)
+    return prompt + (max_tokens or 0)
+
+
+def retry_after(error):
+    """Seconds from a Retry-After / retry-after-ms header on an API error, or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def is_retryable(error):
+    """Rate limits, server errors and dropped connections are worth retrying; bad requests are not."""
+    if isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError)):
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """Refills `per_minute` units evenly over a minute, holding at most a minute's worth. per_minute <= 0 = unlimited."""
+
+    def __init__(self, per_minute, now=None):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (requests larger than the bucket only need it full)."""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount, now):
+        if self.capacity > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+
+class _ModelLimits:
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.paused_until = 0.0  # Set from Retry-After
+
+    def wait_time(self, tokens, now):
+        return max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now), 0.0)
+
+    def take(self, tokens, now):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+
+class _Ticket:
+    def __init__(self, model, tokens, priority, seq):
+        self.model = model
+        self.tokens = tokens
+        self.priority = PRIORITIES.get(priority, PRIORITIES["interactive"])
+        self.seq = seq
+        self.admitted = False
+        self.admitted_at = None
+        self.wake = lambda: None
+
+
+class LLMScheduler:
+    """
+    Process-wide admission control for LLM calls. Use run()/run_async() to execute a request under
+    the scheduler, or acquire()/release() around a call yourself.
+    - Queued calls are admitted highest priority first, then first come first served; a call held
+      back by its model's rate limit doesn't block calls to other models.
+    - The concurrency limit starts at `max_concurrency` and moves between the min and max (AIMD).
+    """
+
+    def __init__(self, max_concurrency=LLM_MAX_CONCURRENCY, min_concurrency=LLM_MIN_CONCURRENCY,
+                 rate_limits=None, default_rpm=LLM_RPM, default_tpm=LLM_TPM,
+                 max_retries=LLM_MAX_RETRIES, backoff_base=LLM_BACKOFF_BASE, backoff_max=LLM_BACKOFF_MAX):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.limit = float(self.max_concurrency)
+        self.rate_limits = parse_rate_limits(LLM_RATE_LIMITS) if rate_limits is None else rate_limits
+        self.default_rpm = default_rpm
+        self.default_tpm = default_tpm
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self.retries = 0
+        self.throttled = 0
+        self._models = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    # --- Admission ---
+
+    def _limits_for(self, model):
+        if model not in self._models:
+            matches = [prefix for prefix in self.rate_limits if model.startswith(prefix)]
+            rpm, tpm = self.rate_limits[max(matches, key=len)] if matches else (self.default_rpm, self.default_tpm)
+            self._models[model] = _ModelLimits(rpm, tpm)
+        return self._models[model]
+
+    def _dispatch(self):
+        """Admits queued calls that fit; returns how long the rest should sleep before checking again."""
+        admitted = []
+        next_check = POLL_SECONDS
+        with self._lock:
+            now = time.monotonic()
+            blocked_models = set()
+            for ticket in sorted(self._waiters, key=lambda t: (t.priority, t.seq)):
+                if self.in_flight >= int(self.limit):
+                    break
+                if ticket.model in blocked_models:
+                    continue  # Keep FIFO order within a model
+                limits = self._limits_for(ticket.model)
+                wait = limits.wait_time(ticket.tokens, now)
+                if wait > 0:
+                    blocked_models.add(ticket.model)
+                    next_check = min(next_check, wait)
+                    continue
+                limits.take(ticket.tokens, now)
+                ticket.admitted, ticket.admitted_at = True, now
+                self.in_flight += 1
+                admitted.append(ticket)
+            if admitted:
+                self._waiters = [ticket for ticket in self._waiters if not ticket.admitted]
+        for ticket in admitted:
+            ticket.wake()
+        return next_check
+
+    def _enqueue(self, model, tokens, priority):
+        ticket = _Ticket(model, tokens, priority, next(self._seq))
+        with self._lock:
+            self._waiters.append(ticket)
+        return ticket
+
+    def _abandon(self, ticket):
+        """A queued caller gave up (e.g. its task was cancelled): drop it, or free the slot it just got."""
+        with self._lock:
+            if not ticket.admitted:
+                self._waiters = [t for t in self._waiters if t is not ticket]
+                return
+        self.release(ticket, "error")
+
+    def acquire(self, model, tokens, priority="interactive"):
+        """Blocks the calling thread until the call may start. Returns a ticket for release()."""
+        ticket = self._enqueue(model, tokens, priority)
+        event = threading.Event()
+        ticket.wake = event.set
+        try:
+            while True:
+                wait = self._dispatch()
+                if ticket.admitted:
+                    return ticket
+                event.wait(wait)
+                event.clear()
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    async def acquire_async(self, model, tokens, priority="interactive"):
+        """Like acquire(), but waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        ticket = self._enqueue(model, tokens, priority)
+        try:
+            while True:
+                woken = loop.create_future()
+                ticket.wake = lambda: loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+                wait = self._dispatch()
+                if ticket.admitted:
+                    return ticket
+                try:
+                    await asyncio.wait_for(woken, wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._abandon(ticket)
+            raise
+
+    def release(self, ticket, outcome="ok", retry_after_seconds=None):
+        """
+        Frees the ticket's slot and adapts the concurrency limit:
+        - "ok": additive increase (about +1 per `limit` successes);
+        - "throttled" (429/5xx): halve the limit, once per burst of failures from calls started before the
+          last decrease, and pause the model for `retry_after_seconds` if the provider asked for it;
+        - "error": anything else, no adjustment.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if outcome == "ok":
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            elif outcome == "throttled":
+                self.throttled += 1
+                if ticket.admitted_at > self._last_decrease:
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    self._last_decrease = now
+                if retry_after_seconds:
+                    limits = self._limits_for(ticket.model)
+                    limits.paused_until = max(limits.paused_until, now + retry_after_seconds)
+        self._dispatch()
+
+    # --- Execution with retries ---
+
+    def backoff(self, attempt, retry_after_seconds=None):
+        """Full-jitter exponential backoff, never shorter than the provider's Retry-After."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        return max(delay, retry_after_seconds or 0)
+
+    def _failed(self, ticket, error, attempt, can_retry):
+        """Releases a failed call; returns the backoff delay, or None if the error should propagate."""
+        retryable = is_retryable(error)
+        delay_hint = retry_after(error) if retryable else None
+        self.release(ticket, "throttled" if retryable else "error", delay_hint)
+        if not retryable or attempt >= self.max_retries or (can_retry is not None and not can_retry()):
+            return None
+        self.retries += 1
+        delay = self.backoff(attempt, delay_hint)
+        print(f"⏳ [llm] {ticket.model}: {error.__class__.__name__}, retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+        return delay
+
+    def run(self, request, model, tokens, priority="interactive", can_retry=None):
+        """Calls `request()` under the scheduler, retrying transient failures. `can_retry()` can veto a retry."""
+        for attempt in itertools.count():
+            ticket = self.acquire(model, tokens, priority)
+            try:
+                result = request()
+            except Exception as e:
+                delay = self._failed(ticket, e, attempt, can_retry)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            self.release(ticket, "ok")
+            return result
+
+    async def run_async(self, request, model, tokens, priority="interactive", can_retry=None):
+        """Async run(): `request` is a coroutine function."""
+        for attempt in itertools.count():
+            ticket = await self.acquire_async(model, tokens, priority)
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                self.release(ticket, "error")
+                raise
+            except Exception as e:
+                delay = self._failed(ticket, e, attempt, can_retry)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.release(ticket, "ok")
+            return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "retries": self.retries,
+                "throttled": self.throttled,
+            }
+
+
+_llm_scheduler = None
+_llm_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler():
+    """The process-wide scheduler, created on first use."""
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        if _llm_scheduler is None:
+            _llm_scheduler = LLMScheduler()
+        return _llm_scheduler
+
+def set_llm_scheduler(scheduler):
+    """Swaps the scheduler (e.g. one with tiny backoffs in tests)."""
+    global _llm_scheduler
+    with _llm_scheduler_lock:
+        _llm_scheduler = scheduler
@@ -0,0 +1,93 @@
+# memory_layout.py
+import re
+
+# -----------------------------
+# Memory Collection Layouts
+# -----------------------------
+# "per_hat":  one Chroma collection per hat, named after the hat (the original layout).
+# "shared":   every hat's memories in one collection, partitioned by a `hat_id` metadata key.
+# "per_team": one collection per team (hats without a team share the "shared" collection).
+# In the partitioned layouts each memory is also stamped with its `team_id`, so several hats
+# (or a whole team) can be searched with a single query.
+
+PER_HAT = "per_hat"
+SHARED = "shared"
+PER_TEAM = "per_team"
+LAYOUTS = (PER_HAT, SHARED, PER_TEAM)
+
+SHARED_COLLECTION = "hat_memories"
+TEAM_COLLECTION_PREFIX = "team_memories_"
+PARTITION_KEYS = ("hat_id", "team_id")
+
+
+def partition_collection_name(layout, team_id=None):
+    """Name of the collection holding a hat's memories in a partitioned layout."""
+    if layout == PER_TEAM and team_id:
+        # Chroma names: 3-512 chars of [a-zA-Z0-9._-]
+        return (TEAM_COLLECTION_PREFIX + re.sub(r"[^a-zA-Z0-9._-]", "_", str(team_id)))[:512]
+    return SHARED_COLLECTION
+
+
+def is_partition_collection(name):
+    return name == SHARED_COLLECTION or name.startswith(TEAM_COLLECTION_PREFIX)
+
+
+def scope_where(scope, where=None):
+    return {"$and": [scope, where]} if where else scope
+
+
+def strip_partition_keys(metadatas):
+    """Drops hat_id/team_id from get() metadatas (a list) or query() metadatas (a list of lists)."""
+    if not metadatas:
+        return metadatas
+    if isinstance(metadatas[0], list):
+        return [strip_partition_keys(row) for row in metadatas]
+    return [{k: v for k, v in meta.items() if k not in PARTITION_KEYS} if meta else meta for meta in metadatas]
+
+
+class HatCollection:
+    """
+    One hat's slice of a partitioned collection, with the subset of the Chroma collection API memories use.
+    - Reads, counts and deletes are filtered to the hat; writes are stamped with hat_id/team_id.
+    - The partition keys are removed from returned metadata, so callers see the same rows as in the per-hat layout.
+    """
+
+    def __init__(self, collection, hat_id, team_id=None):
+        self.collection = collection
+        self.hat_id = hat_id
+        self.team_id = team_id
+        self.scope = {"hat_id": hat_id}
+
+    @property
+    def name(self):
+        return self.collection.name
+
+    def _stamp(self, ids, metadatas):
+        stamp = {"hat_id": self.hat_id, **({"team_id": self.team_id} if self.team_id else {})}
+        return [{**(meta or {}), **stamp} for meta in (metadatas or [None] * len(ids))]
+
+    def _strip(self, results):
+        results["metadatas"] = strip_partition_keys(results.get("metadatas"))
+        return results
+
+    def add(self, ids, documents=None, embeddings=None, metadatas=None):
+        return self.collection.add(ids=ids, documents=documents, embeddings=embeddings, metadatas=self._stamp(ids, metadatas))
+
+    def upsert(self, ids, documents=None, embeddings=None, metadatas=None):
+        return self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=self._stamp(ids, metadatas))
+
+    def update(self, ids, **kwargs):
+        # Chroma merges metadata keys on update, so the partition keys survive
+        return self.collection.update(ids=ids, **kwargs)
+
+    def get(self, ids=None, where=None, **kwargs):
+        return self._strip(self.collection.get(ids=ids, where=scope_where(self.scope, where), **kwargs))
+
+    def query(self, where=None, **kwargs):
+        return self._strip(self.collection.query(where=scope_where(self.scope, where), **kwargs))
+
+    def count(self):
+        return len(self.collection.get(where=self.scope, include=[])["ids"])
+
+    def delete(self, ids=None, where=None):
+        return self.collection.delete(ids=ids, where=scope_where(self.scope, where))
@@ -0,0 +1,114 @@
+# memory_queue.py
+import threading
+import time
+
+# -----------------------------
+# Write-Behind Memory Queue
+# -----------------------------
+
+class MemoryWriteQueue:
+    """
+    Write-behind buffer for hat memories.
+    - Memories are grouped per hat and handed to `write(hat_id, [(memory_id, document, metadata)])`
+      one batch at a time, so the whole batch is embedded in a single call.
+    - A hat's batch is flushed by a background thread once it holds `batch_size` entries or its
+      oldest entry is `flush_interval` seconds old, and synchronously by flush() / close().
+    - Failed batches are re-queued and retried up to `max_attempts` times.
+    """
+
+    def __init__(self, write, batch_size=32, flush_interval=1.0, max_attempts=3):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self._pending = {}  # hat_id -> [(memory_id, document, metadata, attempts)]
+        self._oldest = {}   # hat_id -> monotonic time of the oldest pending entry
+        self._lock = threading.Lock()        # Guards the buffers
+        self._flush_lock = threading.RLock()  # Serializes writes so flush(hat_id) waits for in-flight batches
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = None
+
+    def put(self, hat_id, memory_id, document, metadata):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Memory queue is closed.")
+            batch = self._pending.setdefault(hat_id, [])
+            if not batch:
+                self._oldest[hat_id] = time.monotonic()
+            batch.append((memory_id, document, metadata, 0))
+            full = len(batch) >= self.batch_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+                self._thread.start()
+        if full:
+            self._wake.set()
+
+    def pending(self, hat_id=None):
+        with self._lock:
+            if hat_id is not None:
+                return len(self._pending.get(hat_id, ()))
+            return sum(len(batch) for batch in self._pending.values())
+
+    def discard(self, hat_id):
+        """Drops a hat's unwritten memories (used when the hat's memory is cleared)."""
+        with self._flush_lock, self._lock:
+            self._pending.pop(hat_id, None)
+            self._oldest.pop(hat_id, None)
+
+    def flush(self, hat_id=None):
+        """Writes pending memories for one hat (or all hats) before returning."""
+        with self._flush_lock:
+            with self._lock:
+                hat_ids = [hat_id] if hat_id is not None else list(self._pending)
+            for pending_hat_id in hat_ids:
+                self._write(pending_hat_id)
+
+    def close(self):
+        """Stops the background thread and writes everything still pending."""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    # --- Internals ---
+
+    def _write(self, hat_id):
+        with self._lock:
+            batch = self._pending.pop(hat_id, None)
+            self._oldest.pop(hat_id, None)
+        if not batch:
+            return
+
+        try:
+            self.write(hat_id, [(memory_id, document, metadata) for memory_id, document, metadata, _ in batch])
+        except Exception as e:
+            retry = [(m, d, meta, attempts + 1) for m, d, meta, attempts in batch if attempts + 1 < self.max_attempts]
+            print(f"⚠️ [memory_queue] Failed to write {len(batch)} memories for {hat_id}: {e}"
+                  f"{' (will retry)' if retry else ' (dropped)'}")
+            if retry:
+                with self._lock:
+                    self._pending[hat_id] = retry + self._pending.get(hat_id, [])
+                    self._oldest[hat_id] = time.monotonic()
+
+    def _due(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                hat_id for hat_id, batch in self._pending.items()
+                if len(batch) >= self.batch_size or now - self._oldest.get(hat_id, now) >= self.flush_interval
+            ]
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=self.flush_interval / 2)
+            self._wake.clear()
+            with self._lock:
+                closed = self._closed
+            if closed:
+                return
+            for hat_id in self._due():
+                with self._flush_lock:
+                    self._write(hat_id)
@@ -0,0 +1,196 @@
+# memory_retention.py
+import os
+import datetime
+import threading
+
+from hat_manager import (
+    get_vector_db_for_hat,
+    memory_hat_ids,
+    flush_memories,
+    load_hat,
+    parse_tags,
+    tag_metadata,
+    upsert_memories,
+    memory_id_for,
+    memory_ts,
+    delete_memory_ids,
+)
+
+# -----------------------------
+# Memory Retention & Compaction
+# -----------------------------
+
+# Defaults; a hat can override any of them with a "memory_retention" object in its JSON.
+# Retention is opt-in: nothing is deleted or summarized (and no LLM calls are made) until a cap or TTL
+# is set, and the background job only runs with a MEMORY_RETENTION_INTERVAL.
+MEMORY_MAX_ENTRIES = int(os.getenv("MEMORY_MAX_ENTRIES", "0"))           # 0 = no cap
+MEMORY_MAX_AGE_DAYS = float(os.getenv("MEMORY_MAX_AGE_DAYS", "0"))       # 0 = never expire
+MEMORY_KEEP_TAGS = os.getenv("MEMORY_KEEP_TAGS", "pinned")               # Memories with these tags are never evicted
+MEMORY_COMPACT = os.getenv("MEMORY_COMPACT", "false").lower() in ("1", "true", "yes")  # Summarize evicted turns (LLM calls)
+MEMORY_COMPACT_GROUP = int(os.getenv("MEMORY_COMPACT_GROUP", "20"))      # Turns merged into one summary
+MEMORY_RETENTION_INTERVAL = float(os.getenv("MEMORY_RETENTION_INTERVAL", "0"))  # Seconds; 0 = no background job
+
+SUMMARY_ROLE = "summary"
+SCAN_PAGE_SIZE = 500
+
+
+def retention_policy(hat=None):
+    """Effective retention settings for a hat (env defaults + the hat's "memory_retention" overrides)."""
+    overrides = (hat or {}).get("memory_retention") or {}
+    return {
+        "max_entries": int(overrides.get("max_entries", MEMORY_MAX_ENTRIES) or 0),
+        "max_age_days": float(overrides.get("max_age_days", MEMORY_MAX_AGE_DAYS) or 0),
+        "keep_tags": parse_tags(overrides.get("keep_tags", MEMORY_KEEP_TAGS)),
+        "compact": bool(overrides.get("compact", MEMORY_COMPACT)),
+    }
+
+
+def summarize_memories(documents):
+    """Condenses a group of old turns into one memory. Falls back to an extract if the LLM is unavailable."""
+    try:
+        from prompts import call_openai_llm
+        return call_openai_llm([
+            {"role": "system", "content": "Summarize these past conversation turns into a short memory. Keep facts, decisions and open questions."},
+            {"role": "user", "content": "\n".join(f"- {doc}" for doc in documents)}
+        ], temperature=0.2, max_tokens=300, priority="background")
+    except Exception as e:
+        print(f"⚠️ [retention] Summarizer unavailable, keeping an extract instead: {e}")
+        return " | ".join(doc[:200] for doc in documents)[:2000]
+
+
+def _age_days(meta, now):
+    ts = memory_ts(meta)
+    return None if ts is None else (now.timestamp() - ts) / 86400
+
+
+def _scan(collection):
+    """(id, metadata) for every memory, read page by page without documents or embeddings."""
+    offset = 0
+    while True:
+        page = collection.get(limit=SCAN_PAGE_SIZE, offset=offset, include=["metadatas"])
+        ids = page.get("ids") or []
+        yield from zip(ids, page.get("metadatas") or [{}] * len(ids))
+        if len(ids) < SCAN_PAGE_SIZE:
+            return
+        offset += SCAN_PAGE_SIZE
+
+
+def enforce_retention(hat_id, policy=None, summarize=summarize_memories, now=None):
+    """
+    Applies a retention policy to one hat's memories:
+    - entries older than max_age_days are deleted;
+    - entries beyond max_entries are evicted, least repeated and oldest first; with compaction on,
+      evicted turns are first merged into summary memories in groups;
+    - memories carrying a keep tag are never touched.
+    With no cap and no TTL nothing can be evicted (compaction only acts on evicted turns), so nothing is read.
+    Returns {"scanned", "expired", "evicted", "compacted", "summaries"}.
+    """
+    if policy is None:
+        try:
+            policy = retention_policy(load_hat(hat_id))
+        except FileNotFoundError:
+            policy = retention_policy()
+    now = now or datetime.datetime.now()
+    report = {"scanned": 0, "expired": 0, "evicted": 0, "compacted": 0, "summaries": 0}
+    if not policy["max_entries"] and not policy["max_age_days"]:
+        return report
+
+    flush_memories(hat_id)
+    collection = get_vector_db_for_hat(hat_id)
+    keep_tags = set(policy["keep_tags"])
+
+    candidates = []  # (is_summary, occurrences, timestamp, memory_id)
+    expired = []
+    for memory_id, meta in _scan(collection):
+        meta = meta or {}
+        report["scanned"] += 1
+        if keep_tags & set(parse_tags(meta.get("tags", ""))):
+            continue
+        age = _age_days(meta, now)
+        if policy["max_age_days"] and age is not None and age > policy["max_age_days"]:
+            expired.append(memory_id)
+        else:
+            candidates.append((meta.get("role") == SUMMARY_ROLE, int(meta.get("occurrences") or 1), meta.get("timestamp") or "", memory_id))
+
+    evicted = []
+    remaining = report["scanned"] - len(expired)
+    if policy["max_entries"] and remaining > policy["max_entries"]:
+        # Trim to 90% of the cap so the summaries written below don't push the hat straight back over it
+        excess = remaining - int(policy["max_entries"] * 0.9)
+        candidates.sort()  # Raw turns before summaries, then least repeated, then oldest
+        evicted = [memory_id for _, _, _, memory_id in candidates[:excess]]
+
+    report["expired"], report["evicted"] = len(expired), len(evicted)
+    selected = expired + evicted
+    if not selected:
+        return report
+
+    if policy["compact"]:
+        # Only raw turns inside the age window are worth summarizing; expired data and old summaries just go
+        for start in range(0, len(evicted), MEMORY_COMPACT_GROUP):
+            group = collection.get(ids=evicted[start:start + MEMORY_COMPACT_GROUP], include=["documents", "metadatas"])
+            turns = [(doc, meta or {}) for doc, meta in zip(group["documents"], group["metadatas"])
+                     if (meta or {}).get("role") != SUMMARY_ROLE]
+            if not turns:
+                continue
+            summary = summarize([doc for doc, _ in turns])
+            timestamp = now.isoformat()
+            upsert_memories(hat_id, [(memory_id_for(hat_id, SUMMARY_ROLE, summary), summary, {
+                "timestamp": timestamp,
+                "ts": now.timestamp(),
+                "first_seen": min(meta.get("first_seen") or meta.get("timestamp") or timestamp for _, meta in turns),
+                "occurrences": 1,
+                "role": SUMMARY_ROLE,
+                "summarized_count": len(turns),
+                **tag_metadata(list(dict.fromkeys(tag for _, meta in turns for tag in parse_tags(meta.get("tags", "")))))
+            })])
+            report["compacted"] += len(turns)
+            report["summaries"] += 1
+
+    delete_memory_ids(hat_id, selected)
+    return report
+
+
+def enforce_all(hat_ids=None, summarize=summarize_memories):
+    """Runs enforce_retention over every hat with stored memories (or the given hats). Returns {hat_id: report}."""
+    if hat_ids is None:
+        hat_ids = memory_hat_ids()
+    reports = {}
+    for hat_id in hat_ids:
+        try:
+            reports[hat_id] = enforce_retention(hat_id, summarize=summarize)
+        except Exception as e:
+            print(f"⚠️ [retention] Could not apply retention to {hat_id}: {e}")
+    return reports
+
+
+class RetentionWorker:
+    """Background thread that applies retention to every hat every `interval` seconds."""
+
+    def __init__(self, interval=MEMORY_RETENTION_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="memory-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            reports = enforce_all()
+            trimmed = {hat_id: r for hat_id, r in reports.items() if r["expired"] or r["evicted"]}
+            for hat_id, r in trimmed.items():
+                print(f"🧹 [retention] {hat_id}: expired {r['expired']}, evicted {r['evicted']}, "
+                      f"compacted {r['compacted']} into {r['summaries']} summaries")
+
+
+retention_worker = RetentionWorker()
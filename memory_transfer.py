@@ -0,0 +1,245 @@
+# memory_transfer.py
+import os
+import gzip
+import json
+import base64
+import datetime
+import argparse
+
+import numpy as np
+
+from hat_manager import (
+    get_vector_db_for_hat,
+    get_embedding_function,
+    get_chroma_client,
+    flush_memories,
+    bump_memory_generation,
+    embed_texts,
+    list_hats_by_team,
+    memory_id_for,
+    merge_memory_metadata,
+    get_keyword_index,
+)
+from embedding_cache import DEFAULT_EMBEDDING_MODEL
+
+# -----------------------------
+# Memory Export / Import
+# -----------------------------
+# File format: gzip-compressed JSONL. The first line is a header, every other line is one memory:
+#   {"type": "header", "version": 1, "model": ..., "hats": [...], "exported_at": ...}
+#   {"hat_id": ..., "id": ..., "document": ..., "metadata": {...}, "embedding": <base64 float32>}
+
+EXPORT_VERSION = 1
+MEMORY_EXPORT_DIR = os.getenv("MEMORY_EXPORT_DIR", "./exports")
+MEMORY_EXPORT_PAGE_SIZE = int(os.getenv("MEMORY_EXPORT_PAGE_SIZE", "1000"))
+MEMORY_IMPORT_BATCH_SIZE = int(os.getenv("MEMORY_IMPORT_BATCH_SIZE", "5000"))
+
+
+def _embedding_model():
+    return getattr(get_embedding_function(), "model", None) or DEFAULT_EMBEDDING_MODEL
+
+
+def encode_embedding(vector):
+    return base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_embedding(text):
+    return np.frombuffer(base64.b64decode(text), dtype=np.float32)
+
+
+def _check_name(name):
+    """Hat/team IDs become file names; anything that could leave MEMORY_EXPORT_DIR is rejected."""
+    if not name or name in (".", "..") or "/" in name or "\\" in name or os.sep in name:
+        raise ValueError(f"Invalid hat or team ID for an export file name: {name!r}")
+    return name
+
+
+def export_path(name):
+    _check_name(name)
+    os.makedirs(MEMORY_EXPORT_DIR, exist_ok=True)
+    return os.path.join(MEMORY_EXPORT_DIR, f"{name}_{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}.jsonl.gz")
+
+
+def export_file(name):
+    """
+    Resolves an export named in chat: a bare file name is looked up in MEMORY_EXPORT_DIR, and any path
+    must resolve inside it. Raises ValueError otherwise (chat users can't read arbitrary server files).
+    """
+    export_dir = os.path.realpath(MEMORY_EXPORT_DIR)
+    candidate = name if os.path.dirname(name) else os.path.join(MEMORY_EXPORT_DIR, name)
+    path = os.path.realpath(candidate)
+    if os.path.commonpath([path, export_dir]) != export_dir:
+        raise ValueError(f"Only uploads or files in {MEMORY_EXPORT_DIR} can be imported from chat.")
+    if not os.path.isfile(path):
+        raise ValueError(f"No export named `{name}` in {MEMORY_EXPORT_DIR}.")
+    return path
+
+
+def export_memories(hat_ids, path, page_size=MEMORY_EXPORT_PAGE_SIZE):
+    """
+    Writes the memories of `hat_ids` (with their embeddings) to a gzip JSONL file,
+    reading each collection `page_size` rows at a time. Returns the number of memories written.
+    """
+    flush_memories()
+    written = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        f.write(json.dumps({
+            "type": "header",
+            "version": EXPORT_VERSION,
+            "model": _embedding_model(),
+            "hats": list(hat_ids),
+            "exported_at": datetime.datetime.now().isoformat()
+        }) + "\n")
+        for hat_id in hat_ids:
+            collection = get_vector_db_for_hat(hat_id)
+            offset = 0
+            while True:
+                page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas", "embeddings"])
+                ids = page.get("ids") or []
+                if not ids:
+                    break
+                embeddings = page.get("embeddings")
+                for i, memory_id in enumerate(ids):
+                    f.write(json.dumps({
+                        "hat_id": hat_id,
+                        "id": memory_id,
+                        "document": page["documents"][i],
+                        "metadata": page["metadatas"][i] or {},
+                        "embedding": encode_embedding(embeddings[i]) if embeddings is not None else None
+                    }, ensure_ascii=False) + "\n")
+                written += len(ids)
+                offset += len(ids)
+    return written
+
+
+def _checkpoint_identity(path, target_hat_id, header):
+    """What a checkpoint belongs to: resuming only makes sense for the same file, target hat and export."""
+    return {"source": os.path.abspath(path), "target_hat_id": target_hat_id, "model": header.get("model")}
+
+
+def _read_checkpoint(checkpoint_path, identity):
+    try:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        return checkpoint.get("done", 0) if all(checkpoint.get(key) == value for key, value in identity.items()) else 0
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_checkpoint(checkpoint_path, identity, done):
+    tmp_path = checkpoint_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({**identity, "done": done}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def import_memories(path, target_hat_id=None, batch_size=MEMORY_IMPORT_BATCH_SIZE, checkpoint_path=None):
+    """
+    Loads an export into the local store, reusing the stored embeddings.
+    - Rows are upserted in batches of `batch_size`, so re-running an import is safe.
+    - Progress is checkpointed after every batch; an interrupted import of the same file into the same
+      target resumes where it stopped (a checkpoint for another target is ignored).
+    - `target_hat_id` loads every memory into one hat (e.g. to clone a hat under a new ID).
+    Returns {"imported": int, "resumed_from": int, "hats": [hat_id]}.
+    """
+    checkpoint_path = checkpoint_path or path + ".checkpoint"
+    batch_size = min(batch_size, get_chroma_client().get_max_batch_size())
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline() or "{}")
+        if header.get("type") != "header" or header.get("version") != EXPORT_VERSION:
+            raise ValueError(f"{path} is not a memory export (version {EXPORT_VERSION}).")
+        identity = _checkpoint_identity(path, target_hat_id, header)
+        done = _read_checkpoint(checkpoint_path, identity)
+        report = {"imported": 0, "resumed_from": done, "hats": []}
+        reuse_embeddings = header.get("model") == _embedding_model()
+        if not reuse_embeddings:
+            print(f"⚠️ [import_memories] Export was embedded with {header.get('model')}, re-embedding for {_embedding_model()}.")
+
+        batch, position = [], 0
+        for line in f:
+            position += 1
+            if position <= done:
+                continue
+            batch.append(json.loads(line))
+            if len(batch) >= batch_size:
+                _ingest(batch, target_hat_id, reuse_embeddings, report)
+                _write_checkpoint(checkpoint_path, identity, position)
+                batch = []
+        if batch:
+            _ingest(batch, target_hat_id, reuse_embeddings, report)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return report
+
+
+def _ingest(records, target_hat_id, reuse_embeddings, report):
+    by_hat = {}
+    for record in records:
+        by_hat.setdefault(target_hat_id or record["hat_id"], []).append(record)
+
+    for hat_id, rows in by_hat.items():
+        documents = [row["document"] for row in rows]
+        if reuse_embeddings and all(row.get("embedding") for row in rows):
+            embeddings = [decode_embedding(row["embedding"]) for row in rows]
+        else:
+            embeddings = embed_texts(documents)
+        if target_hat_id:
+            # IDs are content-addressed per hat; re-address them so later writes to the clone dedupe
+            ids = [memory_id_for(hat_id, (row["metadata"] or {}).get("role", "user"), row["document"]) for row in rows]
+        else:
+            ids = [row["id"] for row in rows]
+
+        # Chroma rejects repeated IDs in one upsert; rows that land on the same ID (e.g. the same input
+        # stored by several hats of a team, re-addressed into one clone) are merged like repeated memories
+        merged = {}  # memory_id -> [document, metadata, embedding]
+        for memory_id, row, embedding in zip(ids, rows, embeddings):
+            metadata = row["metadata"] or {}
+            if memory_id in merged:
+                previous = merged[memory_id][1]
+                merged[memory_id][1] = {**previous, **merge_memory_metadata(previous, metadata)}
+            else:
+                merged[memory_id] = [row["document"], dict(metadata), embedding]
+
+        get_vector_db_for_hat(hat_id).upsert(
+            ids=list(merged),
+            documents=[document for document, _, _ in merged.values()],
+            embeddings=[embedding for _, _, embedding in merged.values()],
+            metadatas=[metadata or None for _, metadata, _ in merged.values()]
+        )
+        get_keyword_index().upsert(hat_id, [(memory_id, document, metadata) for memory_id, (document, metadata, _) in merged.items()])
+        bump_memory_generation(hat_id)
+        report["imported"] += len(rows)
+        if hat_id not in report["hats"]:
+            report["hats"].append(hat_id)
+
+
+def team_hat_ids(team_id):
+    return [hat["hat_id"] for hat in list_hats_by_team(team_id)]
+
+
+# --- CLI ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and import hat memories.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    export_cmd = subcommands.add_parser("export", help="Write memories (with embeddings) to a .jsonl.gz file.")
+    export_cmd.add_argument("--hat", action="append", default=[], help="Hat ID to export (repeatable).")
+    export_cmd.add_argument("--team", help="Export every hat of this team.")
+    export_cmd.add_argument("--out", help="Output file (default: MEMORY_EXPORT_DIR/<name>_<timestamp>.jsonl.gz).")
+    import_cmd = subcommands.add_parser("import", help="Load an export, resuming from its checkpoint if interrupted.")
+    import_cmd.add_argument("file", help="Export file to load.")
+    import_cmd.add_argument("--as-hat", help="Load every memory into this hat ID instead of the original ones.")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        hat_ids = args.hat + (team_hat_ids(args.team) if args.team else [])
+        if not hat_ids:
+            parser.error("Give at least one --hat or a --team.")
+        out = args.out or export_path(args.team or hat_ids[0])
+        count = export_memories(hat_ids, out)
+        print(f"✅ Exported {count} memories from {len(hat_ids)} hat(s) to {out}")
+    elif args.command == "import":
+        result = import_memories(args.file, target_hat_id=args.as_hat)
+        resumed = f" (resumed after {result['resumed_from']})" if result["resumed_from"] else ""
+        print(f"✅ Imported {result['imported']} memories into {', '.join(result['hats']) or 'no hats'}{resumed}")
@@ -0,0 +1,96 @@
+# mentions.py
+import asyncio
+import hashlib
+import os
+import re
+
+MENTION_PATTERN = re.compile(r"(?<!\w)@(\w+)")  # Not preceded by a word character, so e-mail addresses don't match
+
+MENTION_MAX_DEPTH = int(os.getenv("MENTION_MAX_DEPTH", "3"))
+MENTION_MAX_CALLS = int(os.getenv("MENTION_MAX_CALLS", "8"))
+MENTION_CONCURRENCY = int(os.getenv("MENTION_CONCURRENCY", "4"))
+
+
+def find_mentions(text):
+    """Unique @mentions in order of first appearance."""
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text or "")))
+
+
+class MentionEngine:
+    """
+    Breadth-first @mention fan-out.
+    - All mentions found at one depth level are answered concurrently (at most `concurrency` at once).
+    - Replies are scanned for the next level, up to `max_depth` levels and `max_calls` replies in total.
+    - Duplicate (caller, target, message) pairs are answered once.
+    - A hat already on the mention chain is never called again on that chain (cycle).
+    - Mentions of ids outside `known_ids` (when given) are skipped without using the call budget.
+
+    `respond(caller_id, message, target_id)` is awaited for each hop and returns the
+    target's reply, or None if the target doesn't exist.
+    """
+
+    def __init__(self, respond, max_depth=MENTION_MAX_DEPTH, max_calls=MENTION_MAX_CALLS, concurrency=MENTION_CONCURRENCY, known_ids=None):
+        self.respond = respond
+        self.known_ids = None if known_ids is None else set(known_ids)
+        self.max_depth = max_depth
+        self.max_calls = max_calls
+        self.concurrency = concurrency
+
+    async def run(self, caller_id, message):
+        """
+        Resolves every mention reachable from `message`. Returns a report:
+        {"calls": int, "replies": [(caller, target, reply)], "skipped": [(caller, target, reason)]}
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        report = {"calls": 0, "replies": [], "skipped": []}
+        seen = set()
+        frontier = [(caller_id, message, (caller_id,))]
+
+        async def hop(caller, target, text):
+            async with semaphore:
+                return await self.respond(caller, text, target)
+
+        for depth in range(self.max_depth + 1):
+            jobs = []
+            for caller, text, chain in frontier:
+                digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+                for target in find_mentions(text):
+                    if depth == self.max_depth:
+                        report["skipped"].append((caller, target, "depth"))
+                        continue
+                    key = (caller, target, digest)
+                    if key in seen:
+                        report["skipped"].append((caller, target, "duplicate"))
+                        continue
+                    seen.add(key)
+                    if target in chain:
+                        report["skipped"].append((caller, target, "cycle"))
+                        continue
+                    if self.known_ids is not None and target not in self.known_ids:
+                        report["skipped"].append((caller, target, "unknown"))
+                        continue
+                    if report["calls"] >= self.max_calls:
+                        report["skipped"].append((caller, target, "budget"))
+                        continue
+                    report["calls"] += 1
+                    jobs.append((caller, target, text, chain + (target,)))
+
+            if not jobs:
+                break
+
+            replies = await asyncio.gather(
+                *[hop(caller, target, text) for caller, target, text, _ in jobs],
+                return_exceptions=True
+            )
+
+            frontier = []
+            for (caller, target, _, chain), reply in zip(jobs, replies):
+                if isinstance(reply, Exception):
+                    print(f"⚠️ [mentions] @{target} failed to reply to {caller}: {reply}")
+                    report["skipped"].append((caller, target, "error"))
+                    continue
+                if reply:
+                    report["replies"].append((caller, target, reply))
+                    frontier.append((target, reply, chain))
+
+        return report
@@ -0,0 +1,11 @@
+import sys
+
+from hat_manager import migrate_memory_layout
+
+layout = sys.argv[1] if len(sys.argv) > 1 else "shared"
+
+print(f"🔧 Moving per-hat memory collections into the '{layout}' layout...")
+
+report = migrate_memory_layout(layout)
+
+print(f"🎉 Moved {report['memories']} memories from {report['hats']} hats. Set MEMORY_LAYOUT={layout} in your .env.")
@@ -0,0 +1,7 @@
+from hat_manager import migrate_memory_metadata
+
+print("🔧 Adding per-tag keys and epoch timestamps to stored memories...")
+
+updated = migrate_memory_metadata()
+
+print(f"🎉 Updated {updated} memories. Tag and time-range filters now run inside ChromaDB.")
@@ -0,0 +1,110 @@
+# ollama_client.py
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# -----------------------------
+# Shared Ollama Client
+# -----------------------------
+# One pooled requests.Session per process, so hat generation reuses TCP connections instead of
+# handshaking on every call. Each request carries Ollama's keep_alive so the model stays loaded
+# between calls, and OLLAMA_PRELOAD_MODELS are loaded at app start so the first hat isn't cold.
+
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434").rstrip("/")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")  # Duration ("30m", "1h"), seconds, or -1 to keep loaded
+OLLAMA_PRELOAD_MODELS = [m.strip() for m in os.getenv("OLLAMA_PRELOAD_MODELS", "").split(",") if m.strip()]
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "8"))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "300"))  # Read timeout for a whole reply
+
+
+def _keep_alive(value):
+    """Ollama takes a duration string or a number of seconds; env values like "-1" or "600" are numbers."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class OllamaClient:
+    """
+    Thin client for the Ollama HTTP API.
+    - All calls share one session with a bounded connection pool (safe to use from several threads).
+    - chat() returns the whole reply in one response.
+    - preload() loads models with keep_alive so later calls skip the cold start.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, keep_alive=OLLAMA_KEEP_ALIVE, pool_size=OLLAMA_POOL_SIZE,
+                 timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_TIMEOUT)):
+        self.host = host.rstrip("/")
+        self.keep_alive = _keep_alive(keep_alive)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _post(self, path, payload):
+        response = self.session.post(f"{self.host}{path}", json=payload, timeout=self.timeout)
+        if response.status_code != 200:
+            text = response.text
+            response.close()
+            raise Exception(f"Ollama API Error: {response.status_code} - {text}")
+        return response
+
+    def chat(self, messages, model, options=None):
+        """Returns the assistant's reply."""
+        payload = {
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "keep_alive": self.keep_alive,
+        }
+        if options:
+            payload["options"] = options
+        return self._post("/api/chat", payload).json()["message"]["content"]
+
+    def preload(self, models):
+        """Loads each model (an empty generate request) and returns {model: loaded?}. Failures are only logged."""
+        loaded = {}
+        for model in models:
+            try:
+                self._post("/api/generate", {"model": model, "keep_alive": self.keep_alive}).close()
+                loaded[model] = True
+                print(f"✅ Ollama model '{model}' loaded (keep_alive={self.keep_alive})")
+            except Exception as e:
+                loaded[model] = False
+                print(f"⚠️ Could not preload Ollama model '{model}': {e}")
+        return loaded
+
+    def close(self):
+        self.session.close()
+
+
+_ollama_client = None
+_ollama_client_lock = threading.Lock()
+
+def get_ollama_client():
+    """The process-wide client, created on first use."""
+    global _ollama_client
+    with _ollama_client_lock:
+        if _ollama_client is None:
+            _ollama_client = OllamaClient()
+        return _ollama_client
+
+def set_ollama_client(client):
+    """Swaps the shared client (e.g. one pointed at a stub server in tests)."""
+    global _ollama_client
+    with _ollama_client_lock:
+        _ollama_client = client
+
+def preload_models_in_background(models=None):
+    """Warms up OLLAMA_PRELOAD_MODELS on a daemon thread so app startup isn't blocked. Returns the thread, or None."""
+    models = OLLAMA_PRELOAD_MODELS if models is None else models
+    if not models:
+        return None
+    thread = threading.Thread(target=get_ollama_client().preload, args=(models,), name="ollama-preload", daemon=True)
+    thread.start()
+    return thread
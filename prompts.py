@@ -2,12 +2,17 @@ import openai
 import os
 import re
 import json
-import requests
+import httpx
 from datetime import datetime
 from dotenv import load_dotenv
 
-from hat_manager import build_hat_schema_prompt, ensure_schema_defaults, load_hat, normalize_hat, search_memory, save_hat
+from hat_manager import build_hat_schema_prompt, compile_system_prompt_parts, ensure_schema_defaults, load_hat, normalize_hat, search_memory, save_hat, save_hats
 import chainlit as cl
+import llm_cache
+from llm_cache import llm_cache_policy
+from ollama_client import get_ollama_client
+from llm_scheduler import get_llm_scheduler, estimate_tokens
+from context_budget import fit_sections, prompt_budget, describe_cuts
 
 load_dotenv()
 
@@ -15,8 +20,24 @@ load_dotenv()
 # LLM Clients
 # -----------------------------
 
-client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-
+# Retries are left to the LLM scheduler (backoff, rate limits and concurrency are shared process-wide)
+client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+# Async client for Chainlit handlers: pooled keep-alive connections shared by all sessions.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+async_client = openai.AsyncOpenAI(
+    api_key=os.getenv("OPENAI_API_KEY"),
+    timeout=LLM_TIMEOUT,
+    max_retries=0,
+    http_client=openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_CONNECTIONS,
+        )
+    ),
+)
 
 
 
@@ -42,35 +63,98 @@ def parse_llm_response_to_hat(content):
 
 def call_ollama_llm(prompt, model="llama3:8b", max_retries=3):
     system_message = build_hat_schema_prompt()
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt}
+    ]
+    # Ollama samples by default, so this is only cached with LLM_CACHE_SAMPLED
+    policy = llm_cache_policy()
+    key = llm_cache.cache_key(policy, "ollama", model, messages)
+    cached = llm_cache.lookup(key, policy)
+    if cached is not None:
+        return parse_llm_response_to_hat(cached)
 
     for _ in range(max_retries):
-        res = requests.post("http://localhost:11434/api/chat", json={
-            "model": model,
-            "stream": False,
-            "messages": [
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": prompt}
-            ]
-        })
-
-        if res.status_code == 200:
-            try:
-                return parse_llm_response_to_hat(res.json()["message"]["content"])
-            except Exception:
-                continue
-        else:
-            raise Exception(f"Ollama API Error: {res.status_code} - {res.text}")
+        content = get_ollama_client().chat(messages, model)  # Raises on API errors
+        try:
+            hat = parse_llm_response_to_hat(content)
+        except Exception:
+            continue
+        llm_cache.store(key, content)  # Only responses that parsed are worth replaying
+        return hat
 
     raise Exception("Failed to get valid response from Ollama after retries.")
 
 ##For use with Hat Generation
-def call_openai_llm(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000):
-    return client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens
-    ).choices[0].message.content
+def call_openai_llm(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000, cache_policy=None, priority="interactive"):
+    """
+    Blocking completion, admitted by the LLM scheduler at `priority` ("interactive" or "background").
+    Served from the response cache when `cache_policy` (default: env settings) allows it.
+    """
+    policy = cache_policy or llm_cache_policy()
+    key = llm_cache.cache_key(policy, "openai", model, messages, temperature, max_tokens=max_tokens)
+    cached = llm_cache.lookup(key, policy)
+    if cached is not None:
+        return cached
+
+    content = get_llm_scheduler().run(
+        lambda: client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens
+        ).choices[0].message.content,
+        model, estimate_tokens(messages, max_tokens), priority
+    )
+    llm_cache.store(key, content)
+    return content
+
+async def call_openai_llm_async(messages, model="gpt-3.5-turbo", temperature=0.7, max_tokens=1000, on_token=None, cache_policy=None, priority="interactive"):
+    """
+    Non-blocking variant of call_openai_llm for use inside Chainlit handlers.
+    If `on_token` is given, the completion is streamed and each text delta is awaited through it;
+    the full text is still returned. A cached response is delivered as a single token.
+    A stream that fails after its first token is not retried (the tokens are already shown).
+    """
+    policy = cache_policy or llm_cache_policy()
+    key = llm_cache.cache_key(policy, "openai", model, messages, temperature, max_tokens=max_tokens)
+    cached = llm_cache.lookup(key, policy)
+    if cached is not None:
+        if on_token is not None:
+            await on_token(cached)
+        return cached
+
+    parts = []
+
+    async def request():
+        if on_token is None:
+            response = await async_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            return response.choices[0].message.content
+
+        stream = await async_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True
+        )
+        async for chunk in stream:
+            token = chunk.choices[0].delta.content if chunk.choices else None
+            if token:
+                parts.append(token)
+                await on_token(token)
+        return "".join(parts)
+
+    content = await get_llm_scheduler().run_async(
+        request, model, estimate_tokens(messages, max_tokens), priority, can_retry=lambda: not parts
+    )
+    llm_cache.store(key, content)
+    return content
 
 
 def openai_hat_generator(prompt):
@@ -94,7 +178,7 @@ async def handle_prompt(message: cl.Message, ollama_llm):
     await thinking_msg.send()
 
     try:
-        hat = create_hat_from_prompt(prompt_content, ollama_llm)
+        hat = await cl.make_async(create_hat_from_prompt)(prompt_content, ollama_llm)
         if not hat or not hat.get("hat_id") or not hat.get("name"):
             raise ValueError("LLM did not return a valid hat structure.")
 
@@ -109,58 +193,64 @@ async def handle_prompt(message: cl.Message, ollama_llm):
         await cl.Message(content=f"❌ Failed to create Hat from prompt: {e}").send()
 
 
-def generate_openai_response(prompt: str, hat: dict):
-    hat_name = hat.get('name', 'Unnamed Agent')
+def build_hat_messages(prompt, hat, memories=()):
+    """
+    System + user messages for `hat`, fitted to its model's context window. Instructions, helper
+    directory, memories (most relevant first) and the prompt each get a share of the budget; the
+    ones that don't fit are cut. Returns (messages, cuts) where cuts is fit_sections' report.
+    """
+    instructions, relationships = compile_system_prompt_parts(hat)
+    fitted, cuts = fit_sections([
+        {"name": "instructions", "text": instructions, "share": 2},
+        {"name": "relationships", "text": relationships, "share": 1},
+        {"name": "memories", "items": list(memories), "share": 2, "mode": "drop"},
+        {"name": "prompt", "text": prompt, "share": 4, "keep": "middle"},
+    ], prompt_budget(hat.get("model", "gpt-3.5-turbo"), hat))
+    if cuts:
+        print(f"✂️ [context] {hat.get('name', 'Unnamed Agent')}: {describe_cuts(cuts)}")
+
+    memory_context = "\n\nRelevant Memories:\n" + "\n".join(fitted["memories"]) if fitted["memories"] else ""
+    return [
+        {"role": "system", "content": fitted["instructions"] + fitted["relationships"] + memory_context},
+        {"role": "user", "content": fitted["prompt"]}
+    ], cuts
+
+
+async def generate_openai_response(prompt: str, hat: dict, stream_to: cl.Message = None, memory_scope: dict = None, priority: str = "interactive"):
+    """
+    Answers `prompt` as `hat`. When `stream_to` is a cl.Message, tokens are streamed into it
+    as they arrive (the caller sends it afterwards to finalize). `memory_scope` holds extra
+    search_memory filters (e.g. {"mission_id": ...}); `priority` is the LLM scheduler class
+    ("background" for work nobody is waiting on). Returns the full response text.
+    """
     hat_id = hat.get('hat_id')
-    tools = ", ".join(hat.get('tools', [])) or "none"
-    instructions = hat.get('instructions', '')
-    role = hat.get('role', 'agent')
 
-    memory_context = ""
+    memories = []
     if hat_id:
-        relevant = search_memory(hat_id, prompt, k=3)
-        if relevant:
-            memory_context = "\n\nRelevant Memories:\n" + "\n".join([
-                f"{m.get('role', 'unknown').capitalize()} ({m.get('timestamp', 'no time')}): {d}"
-                for d, m in relevant
-            ])
-
-    relationship_context = ""
-    if hat.get("relationships"):
-        info = []
-        for rel in hat["relationships"]:
-            try:
-                h = load_hat(rel)
-                info.append(
-                    f"- To call this helper, include `@{rel}` in your reply.\n"
-                    f"  • @{rel} = {h.get('name')}: {h.get('description', '...')} (Tools: {', '.join(h.get('tools', [])) or 'none'})"
-                )
-            except:
-                info.append(f"- @{rel}: (Details not found)")
-        relationship_context = (
-            "\n\nYou can collaborate with the following agents by @mentioning their ID in your response:\n"
-            + "\n".join(info)
-        )
-        
+        relevant = await cl.make_async(search_memory)(hat_id, prompt, k=3, **(memory_scope or {}))
+        memories = [
+            f"{m.get('role', 'unknown').capitalize()} ({m.get('timestamp', 'no time')}): {d}"
+            for d, m in relevant or []
+        ]
 
-    system_prompt = f"""
-You are a {role} agent named '{hat_name}'.
-Your tools: {tools}.
-Instructions: {instructions}.{relationship_context}{memory_context}
-""".strip()
-
-    print(system_prompt)
-    return call_openai_llm([
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": prompt}
-    ], model=hat.get("model", "gpt-3.5-turbo"))
+    messages, _ = build_hat_messages(prompt, hat, memories)
+    return await call_openai_llm_async(
+        messages, model=hat.get("model", "gpt-3.5-turbo"), on_token=stream_to.stream_token if stream_to else None,
+        cache_policy=llm_cache_policy(hat), priority=priority)
 
 
-async def generate_openai_response_with_system(user_prompt: str, system_prompt: str, hat):
-    return call_openai_llm([
-        {"role": "system", "content": f"You are {hat.get('name', 'an AI agent')}. {hat.get('instructions', '')} {system_prompt}"},
-        {"role": "user", "content": user_prompt}
-    ], model=hat.get("model", "gpt-3.5-turbo"))
+async def generate_openai_response_with_system(user_prompt: str, system_prompt: str, hat, stream_to: cl.Message = None):
+    fitted, cuts = fit_sections([
+        {"name": "instructions", "text": f"You are {hat.get('name', 'an AI agent')}. {hat.get('instructions', '')} {system_prompt}", "share": 1},
+        {"name": "prompt", "text": user_prompt, "share": 2, "keep": "middle"},
+    ], prompt_budget(hat.get("model", "gpt-3.5-turbo"), hat))
+    if cuts:
+        print(f"✂️ [context] {hat.get('name', 'Unnamed Agent')}: {describe_cuts(cuts)}")
+    return await call_openai_llm_async([
+        {"role": "system", "content": fitted["instructions"]},
+        {"role": "user", "content": fitted["prompt"]}
+    ], model=hat.get("model", "gpt-3.5-turbo"), on_token=stream_to.stream_token if stream_to else None,
+        cache_policy=llm_cache_policy(hat))
 
 
 
@@ -194,16 +284,15 @@ Respond ONLY with a valid JSON array [] of Hats.
 
     for attempt in range(3):  # Retry up to 3x
         try:
-            response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[
+            result_text = await call_openai_llm_async(
+                [
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": f"My goal: {goal}"}
                 ],
+                model="gpt-3.5-turbo",
                 temperature=0.5,
                 max_tokens=1800
             )
-            result_text = response.choices[0].message.content
 
             match = re.search(r"\[.*\]", result_text, re.DOTALL)
             if not match:
@@ -213,29 +302,25 @@ Respond ONLY with a valid JSON array [] of Hats.
             # ✅ Check constraints
             roles = [hat.get("role", "") for hat in hats]
             if len(hats) >= 3 and len(set(roles)) >= 3:
-                saved_ids = []
-                for hat in hats:
-                    normalized = normalize_hat(hat, team_id=team_id)
-                    save_hat(normalized["hat_id"], normalized)
-                    saved_ids.append(normalized["hat_id"])
-                return saved_ids
+                normalized_team = [normalize_hat(hat, team_id=team_id) for hat in hats]
+                save_hats([(hat["hat_id"], hat) for hat in normalized_team])  # One batched write for the whole team
+                return [hat["hat_id"] for hat in normalized_team]
 
         except Exception as e:
             print(f"⚠️ Team generation attempt {attempt+1} failed: {e}")
 
     # ⛑️ Fallback — use templates
-    fallback_ids = []
+    fallback_team = []
     base_ids = ["planner", "researcher", "critic"]
     for i, base in enumerate(base_ids):
         try:
             base_hat = load_hat(base)
-            normalized = normalize_hat(base_hat, team_id=team_id, flow_order=i + 1)
-            save_hat(normalized["hat_id"], normalized)
-            fallback_ids.append(normalized["hat_id"])
+            fallback_team.append(normalize_hat(base_hat, team_id=team_id, flow_order=i + 1))
         except Exception as e:
             print(f"❌ Failed to load fallback hat `{base}`: {e}")
 
-    return fallback_ids
+    save_hats([(hat["hat_id"], hat) for hat in fallback_team])
+    return [hat["hat_id"] for hat in fallback_team]
 
 def create_hat_from_prompt(prompt, llm_function):
     return llm_function(prompt)
@@ -1,5 +1,4 @@
-from hat_templates import list_hats
-from hat_manager import load_hat, save_hat, normalize_hat
+from hat_manager import list_hats, load_hat, save_hat, normalize_hat
 
 print("🔧 Normalizing all hats...")
 
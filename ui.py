@@ -3,12 +3,11 @@ import chainlit as cl
 from chainlit.element import Text
 from chainlit.action import Action
 
-from hat_manager import list_hats, load_hat, list_hats_by_team
+from hat_manager import list_hats, list_hats_by_team, list_team_ids
 
 async def show_hat_sidebar():
     hat_ids = list_hats()
-    hats = [load_hat(hat_id) for hat_id in hat_ids]
-    team_ids = list(set([hat.get("team_id") for hat in hats if hat.get("team_id")]))
+    team_ids = list_team_ids()
 
     elements = [Text(content="### 🎩 Hats")]
 
@@ -47,8 +46,12 @@ async def show_hat_sidebar():
         Text(content="### 🧠 Memory Commands"),
         Text(content="- `view memories` — Show memory for current Hat"),
         Text(content="- `view memories <tag>` — Filter memories by tag"),
+        Text(content="- `find memories <terms>` — Exact keyword lookup (no embedding)"),
         Text(content="- `tag last as <tag>` — Tag the last memory entry"),
         Text(content="- `clear memories` — Delete all memory for current Hat"),
+        Text(content="- `compact memories` — Apply the Hat's retention policy now"),
+        Text(content="- `export memories [<hat_id> | team <team_id>]` — Download memories as .jsonl.gz"),
+        Text(content="- `import memories [<path>] [as <hat_id>]` — Load an export (resumable)"),
         Text(content="- `debug memories` — Show raw memory data in CLI"),
 
         Text(content="---"),
@@ -80,19 +83,18 @@ async def show_hat_sidebar():
         Text(content="✅ Per-Hat schedule support (`set schedule`)"),
         Text(content="✅ Multi-Hat reflections + MVP Awards"),
         Text(content="✅ Support `new from base <base_hat_id>` command"),
+        Text(content="✅ Parallel Execution for Hats with same `flow_order`"),
+        Text(content="✅ `import memories` command (resumable, no re-embedding)"),
 
         # 🔄 In Progress / Working
         Text(content="🔄 QA fallback: Prompt user if retries exhausted"),
         Text(content="🔄 `further run team enhancements"),
 
         # ⏳ Planned
-        Text(content="⏳ `export memories` json? command"),
-        Text(content="⏳ `import memories` command"),
         Text(content="⏳ `run again` button after team flow"),
         Text(content="⏳ `create new team` button from goal"),
         Text(content="⏳ Better error handling for failed JSON parsing"),
         Text(content="⏳ Flow Chart Generator — Mermaid.js visualization of team structure"),
-        Text(content="⏳ Parallel Execution for Hats with same `flow_order`"),
         Text(content="⏳ Tool integration (tools field schema is ready but not hydrated)"),
         Text(content="⏳ Dynamic LLM usage per Hat (e.g. OpenAI vs Ollama hybrid flow)"),
         Text(content="⏳ Copilot SDK / Agent Framework extension support (wear a Hat externally)")